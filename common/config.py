@@ -71,6 +71,12 @@ class SenseAiImage(IntEnum):
     RPI64 = 4
 
 
+class OverflowPolicy(IntEnum):
+    BLOCK = 0
+    DROP_OLDEST = 1
+    DROP_NEWEST = 2
+
+
 class DeviceConfig:
     def __init__(self):
         self.device_name = platform.node()
@@ -94,14 +100,42 @@ class FFmpegConfig:
         self.use_double_quotes_for_path: bool = False
         self.max_operation_retry_count: int = 10000000
         self.ms_init_interval: float = 3.  # ms prefix is for media server.
+        self.ms_ready_timeout: float = 10.  # media server readiness probes give up after this
+        self.ms_ready_poll_interval: float = .2
+        self.start_stream_max_concurrency: int = 4  # streams which are being started at the same time by all the processes, i.e. the boot storm
+        self.start_stream_lease_ttl: float = 120.  # a start lease of a crashed process is freed after this
+        self.ms_pool_size: int = 0  # idle media server containers per media server type, 0 disables the warm pool
+        self.ms_shared_enabled: bool = False  # Go2Rtc, SRS and NMS streams share a few media server instances instead of a container per source
+        self.ms_shared_max_streams: int = 32  # streams per shared instance
+        self.ms_shared_rebalance_max_moves: int = 2  # streams which are restarted to move to a less loaded instance per watchdog run
         self.watch_dog_interval: int = 23
         self.watch_dog_failed_wait_interval: float = 3.
+        self.watch_dog_max_workers: int = 8  # streams are checked concurrently on a bounded pool
+        self.process_supervisor_enabled: bool = False  # restarts a stream as soon as one of its processes crashes
+        self.process_supervisor_backoff_initial: float = .5
+        self.process_supervisor_backoff_max: float = 60.
+        self.process_supervisor_stable_interval: float = 60.  # the backoff is reset if the crashed process had run longer than this
+        self.process_supervisor_stderr_tail_size: int = 4096
+        self.restart_backoff_initial: float = 5.  # restart governor, per source exponential backoff with jitter
+        self.restart_backoff_max: float = 300.
+        self.restart_backoff_jitter: float = .2
+        self.restart_circuit_threshold: int = 5  # consecutive failures which open the circuit, 0 disables the circuit breaker
+        self.restart_circuit_open_interval: float = 600.  # a half-open probe restart is allowed once per this interval
+        self.restart_stable_interval: float = 120.  # a stream which works this long after its last restart is considered recovered
         self.start_task_wait_for_interval: float = 1.
         self.record_concat_limit: int = 1
         self.record_video_file_indexer_interval: int = 60
+        self.record_video_file_indexer_max_workers: int = 4  # sources are indexed and their files are probed concurrently on bounded pools
+        self.record_segment_catalog_enabled: bool = False  # indexed segments are kept in a local SQLite catalog for the time range lookups
+        self.record_segment_catalog_path: str = ''  # defaults to record/segments.db in the first general.dir_paths
+        self.record_segment_catalog_prune_interval: int = 3600  # the segments whose files have been deleted are removed from the catalog
+        self.record_segment_watcher_enabled: bool = False  # segments are indexed by inotify as soon as they are closed, the polling is kept as the reconciliation
+        self.record_incremental_merge_enabled: bool = False  # new mp4 segments are appended to the merged hour file instead of merging the whole hour again
         # 1024 - 65535
         self.ms_port_start: int = 7000  # for more info: https://www.thegeekdiary.com/which-network-ports-are-reserved-by-the-linux-operating-system/
         self.ms_port_end: int = 8000  # should be greater than total camera count
+        self.pipe_reader_shm_enabled: bool = False  # MpFFmpegPipeReader writes frames into shared memory instead of publishing JPEGs
+        self.pipe_reader_shm_slot_count: int = 8
 
 
 class AiConfig:
@@ -146,6 +180,25 @@ class DesimaConfig:
         self.max_retry: int = 100
 
 
+class EventBusConfig:
+    def __init__(self):
+        self.publish_queue_size: int = 10000
+        self.publish_batch_size: int = 100
+        self.publish_overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST
+        self.publish_block_timeout: float = 1.
+        self.subscribe_max_workers: int = 8
+        self.subscribe_max_pending: int = 1000
+        self.subscribe_overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK
+        self.async_listeners_enabled: bool = False  # all request channels are listened on one connection in the main process
+
+
+class CacheConfig:
+    def __init__(self):
+        self.enabled: bool = False  # needs notify-keyspace-events 'Khg' on the Redis server, the service does not change it
+        self.ttl: float = 30.
+        self.max_size: int = 1024
+
+
 class Config:
     def __init__(self):
         self.device: DeviceConfig = DeviceConfig()
@@ -158,6 +211,8 @@ class Config:
         self.archive: ArchiveConfig = ArchiveConfig()
         self.snapshot: SnapshotConfig = SnapshotConfig()
         self.desima: DesimaConfig = DesimaConfig()
+        self.event_bus: EventBusConfig = EventBusConfig()
+        self.cache: CacheConfig = CacheConfig()
         self.__connection: Redis | None = None
 
     @staticmethod
@@ -170,7 +225,13 @@ class Config:
         config_json = obj.__get_connection().get(obj.__get_redis_key())
         if config_json is not None:
             simple_namespace = json.loads(config_json, object_hook=lambda d: SimpleNamespace(**d))
-            obj.__dict__.update(simple_namespace.__dict__)
+            # merge section by section, so the fields which were added after the config had been saved keep their default values
+            for key, value in simple_namespace.__dict__.items():
+                section = obj.__dict__.get(key)
+                if isinstance(value, SimpleNamespace) and section is not None and hasattr(section, '__dict__'):
+                    section.__dict__.update(value.__dict__)
+                else:
+                    obj.__dict__[key] = value
         return obj
 
     def to_json(self):
@@ -1,19 +1,104 @@
-from typing import Any
+from __future__ import annotations
+
+from typing import Any, Callable, List
 from redis import Redis
 
 from common.data.redis_mapper import RedisMapper
 
 
 class BaseRepository:
-    def __init__(self, connection: Redis, namespace: str):
+    def __init__(self, connection: Redis, namespace: str, index_key: str = ''):
         self.connection: Redis = connection
         self.namespace: str = namespace
+        self.index_key: str = index_key  # a set of the identifiers, it is used by get_all instead of scanning the whole key space
         self._encoding = 'utf-8'
+        self._scan_count = 1000
+        self._pipeline_size = 500
 
     @staticmethod
     def from_redis(model: Any, redis_binary_dic: dict):
         return RedisMapper(model).from_redis(redis_binary_dic)
 
+    @staticmethod
+    def from_redis_fields(model: Any, fields: List[str], values: list):
+        return RedisMapper(model).from_redis_fields(fields, values)
+
     @staticmethod
     def to_redis(model: Any) -> dict:
         return RedisMapper(model).to_redis()
+
+    @staticmethod
+    def to_redis_fields(model: Any, fields: dict) -> dict:
+        return RedisMapper(model).to_redis_fields(fields)
+
+    # SCAN does not block Redis for the other clients like KEYS does
+    def _scan_keys(self) -> List[bytes]:
+        return list(self.connection.scan_iter(match=f'{self.namespace}*', count=self._scan_count))
+
+    # loads all the hashes through pipelines instead of a round trip per key. If fields are given, only those are fetched by HMGET.
+    def _get_all_by_keys(self, keys: List, model_factory: Callable[[], Any], fields: List[str] | None = None,
+                         missing_keys: List | None = None) -> List[Any]:
+        models: List[Any] = []
+        for index in range(0, len(keys), self._pipeline_size):
+            chunk = keys[index:index + self._pipeline_size]
+            pipe = self.connection.pipeline(transaction=False)
+            for key in chunk:
+                if fields is None:
+                    pipe.hgetall(key)
+                else:
+                    pipe.hmget(key, fields)
+            for key, result in zip(chunk, pipe.execute()):
+                if fields is None:
+                    if not result:  # removed after the scan
+                        if missing_keys is not None:
+                            missing_keys.append(key)
+                        continue
+                    models.append(self.from_redis(model_factory(), result))
+                else:
+                    if all(value is None for value in result):
+                        if missing_keys is not None:
+                            missing_keys.append(key)
+                        continue
+                    models.append(self.from_redis_fields(model_factory(), fields, result))
+        return models
+
+    def __get_identifier(self, key: str) -> str:
+        return key[len(self.namespace):]
+
+    # the hash and its index entry are written in one MULTI/EXEC transaction
+    def _add_indexed(self, key: str, dic: dict) -> int:
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.hset(key, mapping=dic)
+        pipe.sadd(self.index_key, self.__get_identifier(key))
+        return pipe.execute()[0]
+
+    def _remove_indexed(self, key: str) -> int:
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.srem(self.index_key, self.__get_identifier(key))
+        return pipe.execute()[0]
+
+    def _get_all_indexed(self, model_factory: Callable[[], Any], fields: List[str] | None = None) -> List[Any]:
+        identifiers = self.connection.smembers(self.index_key)
+        keys = [f'{self.namespace}{identifier.decode(self._encoding)}' for identifier in identifiers]
+        missing_keys: List[str] = []
+        models = self._get_all_by_keys(keys, model_factory, fields, missing_keys)
+        if len(missing_keys) > 0:  # repairs the index entries of the hashes which were deleted by someone else
+            self.connection.srem(self.index_key, *[self.__get_identifier(key) for key in missing_keys])
+        return models
+
+    # one-shot repair for an index which drifted from the hashes, i.e. the keys which were written by another service
+    def rebuild_index(self) -> int:
+        if not self.index_key:
+            return 0
+        keys = self._scan_keys()
+        pipe = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        identifiers = [self.__get_identifier(key.decode(self._encoding)) for key, key_type in zip(keys, pipe.execute()) if key_type == b'hash']
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.delete(self.index_key)
+        if len(identifiers) > 0:
+            pipe.sadd(self.index_key, *identifiers)
+        pipe.execute()
+        return len(identifiers)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import copy
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Set
+from redis import Redis
+
+from common.utilities import crate_redis_connection, RedisDb, logger, config
+from utils.utils import start_thread
+
+
+# one keyspace notification listener per process and db, it serves the caches of all the namespaces over one pub/sub connection.
+# The notifications are not enabled by the service since notify-keyspace-events is a server-wide setting, it has to be configured
+# on the Redis server ('Khg' or 'KA'), otherwise the caches are bypassed.
+class KeyspaceListener:
+    __instances: Dict[int, KeyspaceListener] = {}
+    __instances_pid: int = 0
+    __instances_lock = Lock()
+
+    def __init__(self, db: RedisDb):
+        self.db: RedisDb = db
+        self.caches: Dict[str, ModelCache] = {}
+        self.lock = Lock()
+        start_thread(self.__listen, [])
+
+    @staticmethod
+    def get_instance(db: RedisDb) -> KeyspaceListener:
+        pid = os.getpid()
+        with KeyspaceListener.__instances_lock:
+            if KeyspaceListener.__instances_pid != pid:  # forked processes need their own listener thread
+                KeyspaceListener.__instances = {}
+                KeyspaceListener.__instances_pid = pid
+            listener = KeyspaceListener.__instances.get(int(db))
+            if listener is None:
+                listener = KeyspaceListener(db)
+                KeyspaceListener.__instances[int(db)] = listener
+            return listener
+
+    def register(self, cache: ModelCache):
+        with self.lock:
+            self.caches[cache.namespace] = cache
+
+    def __set_listening(self, listening: bool):
+        with self.lock:
+            caches = list(self.caches.values())
+        for cache in caches:
+            cache.set_listening(listening)
+
+    @staticmethod
+    def __is_notifications_enabled(connection: Redis) -> bool:
+        try:
+            flags = connection.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+        except BaseException as ex:
+            logger.error(f'notify-keyspace-events could not be read, the repository cache is bypassed, err: {ex}')
+            return False
+        if 'K' in flags and ('A' in flags or ('h' in flags and 'g' in flags)):
+            return True
+        logger.error(f'the repository cache is enabled but notify-keyspace-events of the Redis server is "{flags}", it needs "Khg" or "KA". '
+                     f'The cache is bypassed until it is configured')
+        return False
+
+    def __listen(self):
+        connection = crate_redis_connection(self.db, True, 2)
+        prefix = f'__keyspace@{int(self.db)}__:'
+        while True:
+            subscribed: Set[str] = set()
+            try:
+                if not self.__is_notifications_enabled(connection):
+                    time.sleep(60.)
+                    continue
+                pub_sub = connection.pubsub()
+                while True:
+                    with self.lock:
+                        namespaces = [namespace for namespace in self.caches.keys() if namespace not in subscribed]
+                    for namespace in namespaces:  # the caches which have been created after the listener
+                        pub_sub.psubscribe(f'{prefix}{namespace}*')
+                        subscribed.add(namespace)
+                    message = pub_sub.get_message(timeout=1.)
+                    if message is None:
+                        continue
+                    if message['type'] == 'psubscribe':
+                        namespace = message['channel'].decode('utf-8')[len(prefix):-1]
+                        cache = self.caches.get(namespace)
+                        if cache is not None:
+                            cache.set_listening(True)
+                    elif message['type'] == 'pmessage':
+                        key = message['channel'].decode('utf-8')[len(prefix):]
+                        with self.lock:
+                            caches = list(self.caches.values())
+                        for cache in caches:
+                            if key.startswith(cache.namespace):
+                                cache.invalidate(key[len(cache.namespace):])
+            except BaseException as ex:
+                logger.error(f'an error occurred on the repository cache listener at {datetime.now()}, err: {ex}')
+            finally:
+                self.__set_listening(False)
+            time.sleep(1.)
+
+
+# an in-process, size bounded LRU cache with TTL in front of a repository, one per namespace and process. Entries are invalidated by
+# Redis keyspace notifications, so the writes of the other services are seen too. The cache is bypassed while the notification listener
+# is not subscribed. It is disabled by default, see KeyspaceListener.
+class ModelCache:
+    __instances: Dict[str, ModelCache] = {}
+    __instances_pid: int = 0
+    __instances_lock = Lock()
+
+    def __init__(self, namespace: str, db: RedisDb = RedisDb.MAIN):
+        self.namespace: str = namespace
+        self.db: RedisDb = db
+        self.enabled: bool = config.cache.enabled
+        self.ttl: float = config.cache.ttl
+        self.max_size: int = max(config.cache.max_size, 1)
+        self.items: OrderedDict = OrderedDict()
+        self.lock = Lock()
+        self.generation: int = 0
+        self.listening: bool = False
+        self.hit_count: int = 0
+        self.miss_count: int = 0
+        if self.enabled:
+            KeyspaceListener.get_instance(db).register(self)
+
+    @staticmethod
+    def get_instance(namespace: str, db: RedisDb = RedisDb.MAIN) -> ModelCache:
+        pid = os.getpid()
+        with ModelCache.__instances_lock:
+            if ModelCache.__instances_pid != pid:
+                ModelCache.__instances = {}
+                ModelCache.__instances_pid = pid
+            key = f'{int(db)}:{namespace}'
+            cache = ModelCache.__instances.get(key)
+            if cache is None:
+                cache = ModelCache(namespace, db)
+                ModelCache.__instances[key] = cache
+            return cache
+
+    def set_listening(self, listening: bool):
+        with self.lock:
+            self.listening = listening
+            self.generation += 1
+            self.items.clear()
+
+    def get_generation(self) -> int:
+        return self.generation
+
+    def get(self, identifier: str) -> Any | None:
+        if not self.enabled:
+            return None
+        with self.lock:
+            if not self.listening:
+                return None
+            item = self.items.get(identifier)
+            if item is None or item[0] < time.monotonic():
+                self.miss_count += 1
+                return None
+            self.items.move_to_end(identifier)
+            self.hit_count += 1
+            return copy.copy(item[1])
+
+    # generation is taken before the model is read from Redis, an invalidation in between prevents caching the stale model.
+    def put(self, identifier: str, model: Any, generation: int):
+        if not self.enabled:
+            return
+        with self.lock:
+            if not self.listening or generation != self.generation:
+                return
+            self.items[identifier] = (time.monotonic() + self.ttl, copy.copy(model))
+            self.items.move_to_end(identifier)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def invalidate(self, identifier: str):
+        with self.lock:
+            self.generation += 1
+            self.items.pop(identifier, None)
@@ -1,7 +1,7 @@
 import enum
 import json
 from enum import IntEnum
-from typing import Any
+from typing import Any, List, Callable, Dict
 
 from common.utilities import logger
 
@@ -14,10 +14,80 @@ class DataTypes(IntEnum):
     INT_ENUM = 4
 
 
+# bytes are accepted by int() and float(), so only the strings need a different conversion for the binary responses.
+_str_converters: Dict[DataTypes, Callable] = {
+    DataTypes.STR: lambda value: value,
+    DataTypes.BOOL: lambda value: int(value) == 1,
+    DataTypes.INT_ENUM: int,
+    DataTypes.INT: int,
+    DataTypes.FLOAT: float,
+}
+_bytes_converters: Dict[DataTypes, Callable] = dict(_str_converters)
+_bytes_converters[DataTypes.STR] = lambda value: value.decode('utf-8')
+_field_encoders: Dict[DataTypes, Callable] = {
+    DataTypes.STR: lambda value: value,
+    DataTypes.BOOL: lambda value: 1 if value else 0,
+    DataTypes.INT_ENUM: int,
+    DataTypes.INT: lambda value: value,
+    DataTypes.FLOAT: lambda value: value,
+}
+
+
+# encode/decode functions are generated once per model type, so a (de)serialization runs as straight-line code
+# without per-field type lookups.
+class _ModelCodec:
+    def __init__(self, type_name: str, field_types: Dict[str, DataTypes]):
+        self.field_types = field_types
+        self.str_converters = {field: _str_converters[data_type] for field, data_type in field_types.items()}
+        self.bytes_converters = {field: _bytes_converters[data_type] for field, data_type in field_types.items()}
+        self.field_encoders = {field: _field_encoders[data_type] for field, data_type in field_types.items()}
+        self.decode_bytes = _ModelCodec.__compile_decoder(type_name, field_types, True)
+        self.decode_str = _ModelCodec.__compile_decoder(type_name, field_types, False)
+        self.encode = _ModelCodec.__compile_encoder(type_name, field_types)
+
+    @staticmethod
+    def __get_decode_expr(data_type: DataTypes, binary: bool) -> str:
+        if data_type == DataTypes.STR:
+            return "v.decode('utf-8')" if binary else 'v'
+        elif data_type == DataTypes.BOOL:
+            return 'int(v) == 1'
+        elif data_type == DataTypes.FLOAT:
+            return 'float(v)'
+        return 'int(v)'
+
+    @staticmethod
+    def __get_encode_expr(data_type: DataTypes, field: str) -> str:
+        if data_type == DataTypes.BOOL:
+            return f'1 if md[{field!r}] else 0'
+        elif data_type == DataTypes.INT_ENUM:
+            return f'int(md[{field!r}])'
+        return f'md[{field!r}]'
+
+    @staticmethod
+    def __compile_decoder(type_name: str, field_types: Dict[str, DataTypes], binary: bool) -> Callable[[dict, dict], None]:
+        lines = ['def decode(md, raw):', '    get = raw.get']
+        for field, data_type in field_types.items():
+            key = repr(field.encode('utf-8')) if binary else repr(field)
+            lines.append(f'    v = get({key})')
+            lines.append('    if v is not None:')
+            lines.append(f'        md[{field!r}] = {_ModelCodec.__get_decode_expr(data_type, binary)}')
+        namespace = {}
+        exec(compile('\n'.join(lines), f'<RedisMapper.decode {type_name}>', 'exec'), namespace)
+        return namespace['decode']
+
+    @staticmethod
+    def __compile_encoder(type_name: str, field_types: Dict[str, DataTypes]) -> Callable[[dict], dict]:
+        items = [f'{field!r}: {_ModelCodec.__get_encode_expr(data_type, field)}' for field, data_type in field_types.items()]
+        source = 'def encode(md):\n    return {' + ', '.join(items) + '}'
+        namespace = {}
+        exec(compile(source, f'<RedisMapper.encode {type_name}>', 'exec'), namespace)
+        return namespace['encode']
+
+
 class RedisMapper:
     def __init__(self, model: Any):
         self.type_name = type(model).__name__
-        RedisMapper.__init_model_type(model, self.type_name)
+        self.codec: _ModelCodec = RedisMapper.__init_model_type(model, self.type_name)
         self.model = model
         self.encoding = 'utf-8'
 
@@ -29,44 +99,51 @@ class RedisMapper:
     def from_redis_pubsub(self, redis_binary_dic: dict):
         data = redis_binary_dic['data']
         redis_dic = json.loads(data)
-        field_types = self.__get_field_types()
+        converters = self.codec.str_converters
         model_dic = self.model.__dict__
         for key, value in redis_dic.items():
-            RedisMapper.__set_value(field_types, key, value, model_dic)
+            converter = converters.get(key)
+            if converter is not None:
+                model_dic[key] = converter(value)
         return self.model
 
-    # needs to mutate the model, using copy redundant here
+    # needs to mutate the model, using copy redundant here. Both binary and decode_responses connections are supported.
     def from_redis(self, redis_binary_dic: dict) -> Any:
-        field_types = self.__get_field_types()
+        if not redis_binary_dic:
+            return self.model
+        if isinstance(next(iter(redis_binary_dic)), bytes):
+            self.codec.decode_bytes(self.model.__dict__, redis_binary_dic)
+        else:
+            self.codec.decode_str(self.model.__dict__, redis_binary_dic)
+        return self.model
+
+    # needs to mutate the model, using copy redundant here. values are the HMGET result of the given fields
+    def from_redis_fields(self, fields: List[str], values: list) -> Any:
+        bytes_converters, str_converters = self.codec.bytes_converters, self.codec.str_converters
         model_dic = self.model.__dict__
-        for k, v in redis_binary_dic.items():
-            key, value = k.decode(self.encoding), v.decode(self.encoding)
-            RedisMapper.__set_value(field_types, key, value, model_dic)
+        for key, v in zip(fields, values):
+            if v is None:
+                continue
+            converters = bytes_converters if isinstance(v, bytes) else str_converters
+            model_dic[key] = converters[key](v)
         return self.model
 
     # do not mutate the model dictionary. Otherwise, it can cause big troubles
     def to_redis(self) -> dict:
-        field_types = self.__get_field_types()
-        model_dic = self.model.__dict__.copy()
-        for key, value in self.model.__dict__.items():
-            data_type = field_types[key]
-            if data_type == DataTypes.BOOL:
-                model_dic[key] = 1 if value else 0
-            elif data_type == DataTypes.INT_ENUM:
-                model_dic[key] = int(value)
-            else:
-                model_dic[key] = value
-        return model_dic
+        return self.codec.encode(self.model.__dict__)
 
-    __cache = {}
+    # encodes only the given fields of the model type, i.e. for a partial HSET. Unknown fields raise KeyError
+    def to_redis_fields(self, fields: dict) -> dict:
+        encoders = self.codec.field_encoders
+        return {key: encoders[key](value) for key, value in fields.items()}
 
-    def __get_field_types(self):
-        return RedisMapper.__cache[self.type_name]
+    __cache = {}
 
     @staticmethod
-    def __init_model_type(model, type_name: str):
-        if type_name in RedisMapper.__cache:
-            return
+    def __init_model_type(model, type_name: str) -> _ModelCodec:
+        codec = RedisMapper.__cache.get(type_name)
+        if codec is not None:
+            return codec
         model_dic = model.__dict__
         typed_dic = {}
         for model_field in model_dic:
@@ -85,42 +162,7 @@ class RedisMapper:
                 typed_dic[model_field] = DataTypes.FLOAT
             else:
                 raise NotImplementedError(type(default_value))
-        RedisMapper.__cache[type_name] = typed_dic
+        codec = _ModelCodec(type_name, typed_dic)
+        RedisMapper.__cache[type_name] = codec
         logger.warning(f'new type ({type_name}) added to RedisMapper cache')
-
-    @staticmethod
-    def __set_value(field_types: dict, key: str, value: str, dest_dict: dict):
-        fns = RedisMapper.__get_init_cache_fns()
-        data_type = field_types[key]
-        dest_dict[key] = fns[data_type](value)
-
-    __cache_fns = {}
-
-    @staticmethod
-    def __get_init_cache_fns():
-        fns = RedisMapper.__cache_fns
-        if len(fns) > 0:
-            return fns
-
-        def fn_str(value) -> str:
-            return value
-
-        def fn_bool(value) -> bool:
-            return int(value) == 1
-
-        def fn_int_enum(value) -> int:
-            return int(value)
-
-        def fn_int(value) -> int:
-            return int(value)
-
-        def fn_float(value) -> float:
-            return float(value)
-
-        fns[DataTypes.STR] = fn_str
-        fns[DataTypes.BOOL] = fn_bool
-        fns[DataTypes.INT_ENUM] = fn_int_enum
-        fns[DataTypes.INT] = fn_int
-        fns[DataTypes.FLOAT] = fn_float
-        logger.warning(f'new cached functions dictionary has been initialized')
-        return fns
+        return codec
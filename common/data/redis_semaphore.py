@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import random
+import time
+import uuid
+from datetime import datetime
+from redis.client import Redis
+
+from common.utilities import logger
+
+# KEYS[1]: leases. ARGV: token, limit, now, expires at. returns 1 if the lease has been acquired.
+_acquire_script = '''
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+    return 1
+end
+return 0
+'''
+
+
+class RedisSemaphoreLease:
+    def __init__(self, semaphore: RedisSemaphore, token: str):
+        self.semaphore = semaphore
+        self.token = token
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.semaphore.release(self.token)
+
+
+# a counting semaphore which is shared by all the processes, i.e. the start and the restart listeners of the service instances.
+# A lease is a token in a ZSET scored by its expiry time, so the leases of a crashed holder are freed after lease_ttl.
+class RedisSemaphore:
+    def __init__(self, connection: Redis, name: str, limit: int, lease_ttl: float):
+        self.connection: Redis = connection
+        self.key: str = f'semaphore:{name}'
+        self.limit: int = max(limit, 1)
+        self.lease_ttl: float = max(lease_ttl, 1.)
+        self.poll_interval: float = .2
+        self.acquire_script = connection.register_script(_acquire_script)
+
+    def try_acquire(self) -> str:
+        token = uuid.uuid4().hex
+        now = time.time()
+        if int(self.acquire_script(keys=[self.key], args=[token, self.limit, now, now + self.lease_ttl])) == 1:
+            return token
+        return ''
+
+    # blocks until a lease is acquired, it is released when the returned lease exits
+    def acquire(self) -> RedisSemaphoreLease:
+        started_at = time.monotonic()
+        while True:
+            token = self.try_acquire()
+            if token:
+                waited = time.monotonic() - started_at
+                if waited > 1.:
+                    logger.info(f'{self.key} has been acquired after {waited:.1f} seconds at {datetime.now()}')
+                return RedisSemaphoreLease(self, token)
+            time.sleep(self.poll_interval * (1. + random.random()))
+
+    def release(self, token: str):
+        try:
+            self.connection.zrem(self.key, token)
+        except BaseException as ex:
+            logger.error(f'an error occurred while releasing a lease of {self.key}, it will be freed after its ttl, err: {ex}')
+
+    def get_count(self) -> int:
+        return self.connection.zcount(self.key, time.time(), '+inf')
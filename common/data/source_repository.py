@@ -4,6 +4,7 @@ from typing import List
 from redis.client import Redis
 
 from common.data.base_repository import BaseRepository
+from common.data.model_cache import ModelCache
 from common.data.source_model import SourceModel
 
 
@@ -26,11 +27,25 @@ class SourceRepository(BaseRepository):
             return None
         return self.from_redis(SourceModel(), dic)
 
-    def get_all(self) -> List[SourceModel]:
-        models: List[SourceModel] = []
-        keys = self.connection.keys(self.namespace + '*')
-        for key in keys:
-            dic = self.connection.hgetall(key)
-            model: SourceModel = self.from_redis(SourceModel(), dic)
-            models.append(model)
-        return models
+    def get_all(self, fields: List[str] | None = None) -> List[SourceModel]:
+        return self._get_all_by_keys(self._scan_keys(), SourceModel, fields)
+
+
+class CachedSourceRepository(SourceRepository):
+    def __init__(self, connection: Redis):
+        super().__init__(connection)
+        self.cache = ModelCache.get_instance(self.namespace)
+
+    def add(self, model: SourceModel):
+        super().add(model)
+        self.cache.invalidate(model.id)
+
+    def get(self, identifier: str) -> SourceModel | None:
+        model = self.cache.get(identifier)
+        if model is not None:
+            return model
+        generation = self.cache.get_generation()
+        model = super().get(identifier)
+        if model is not None:
+            self.cache.put(identifier, model, generation)
+        return model
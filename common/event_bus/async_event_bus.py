@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from typing import Dict, Set
+
+from common.event_bus.event_handler import EventHandler, AsyncEventHandler
+from common.event_bus.handler_executor import HandlerExecutor
+from common.utilities import crate_async_redis_connection, RedisDb, logger, config
+
+
+# multiplexes all the registered channels over one pub/sub connection on the asyncio loop. Async handlers run as tasks, the blocking
+# (sync) handlers are dispatched to bounded HandlerExecutors. Channels which are added with the same executor name share one executor,
+# so their events are serialized by the same key, i.e. the start, stop and restart requests of a camera.
+class AsyncEventBus:
+    def __init__(self):
+        self.connection = crate_async_redis_connection(RedisDb.EVENTBUS, True, 2)
+        self.handlers: Dict[str, EventHandler | AsyncEventHandler] = {}
+        self.executor_names: Dict[str, str] = {}
+        self.executors: Dict[str, HandlerExecutor] = {}
+        self.semaphore = asyncio.Semaphore(max(config.event_bus.subscribe_max_workers, 1))
+        self.tasks: Set[asyncio.Task] = set()
+
+    # executor_name is used only by the sync handlers
+    def add_handler(self, channel: str, handler: EventHandler | AsyncEventHandler, executor_name: str = ''):
+        self.handlers[channel] = handler
+        self.executor_names[channel] = executor_name or channel
+
+    async def publish(self, channel: str, event):
+        await self.connection.publish(channel, event)
+
+    async def __handle_async(self, handler: AsyncEventHandler, message: dict):
+        async with self.semaphore:
+            try:
+                await handler.handle(message)
+            except BaseException as ex:
+                logger.error(f'an error occurred while handling an async event, err: {ex}')
+
+    async def __dispatch(self, message: dict):
+        channel = message['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        handler = self.handlers.get(channel)
+        if handler is None:
+            return
+        if isinstance(handler, AsyncEventHandler):
+            task = asyncio.create_task(self.__handle_async(handler, message))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return
+        executor_name = self.executor_names[channel]
+        executor = self.executors.get(executor_name)
+        if executor is None:
+            executor = HandlerExecutor.create(executor_name)
+            self.executors[executor_name] = executor
+        # submit blocks when the executor applies backpressure, so it must not run on the loop thread
+        await asyncio.to_thread(executor.submit, handler.handle, message)
+
+    async def subscribe(self):
+        pub_sub = self.connection.pubsub()
+        await pub_sub.subscribe(*self.handlers.keys())
+        logger.info(f'AsyncEventBus has subscribed to {", ".join(self.handlers.keys())} at {datetime.now()}')
+        try:
+            async for message in pub_sub.listen():
+                if message is None or message['type'] != 'message':
+                    continue
+                await self.__dispatch(message)
+        finally:
+            await pub_sub.close()
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.subscribe()
+            except asyncio.CancelledError:
+                break
+            except BaseException as ex:
+                logger.error(f'an error occurred on AsyncEventBus at {datetime.now()}, err: {ex}')
+            await asyncio.sleep(1.)
+        for executor in self.executors.values():
+            executor.shutdown()
@@ -1,6 +1,10 @@
-from threading import Thread
+from __future__ import annotations
 
+from typing import Dict
+
+from common.event_bus.event_bus_publisher import EventBusPublisher
 from common.event_bus.event_handler import EventHandler
+from common.event_bus.handler_executor import HandlerExecutor
 from common.utilities import crate_redis_connection, RedisDb
 
 
@@ -12,18 +16,38 @@ class EventBus:
     def publish(self, event):  # added for AI service
         self.connection.publish(self.channel, event)
 
-    def publish_async(self, event):
-        th = Thread(target=self.connection.publish, args=[self.channel, event])
-        th.daemon = True
-        th.start()
+    def publish_async(self, event):  # queued and sent in batches by the process-wide publisher thread
+        EventBusPublisher.get_instance().publish(self.channel, event)
 
-    def subscribe_async(self, event_handler: EventHandler):
-        pub_sub = self.connection.pubsub()
-        pub_sub.subscribe(self.channel)
+    def subscribe_async(self, event_handler: EventHandler, executor: HandlerExecutor | None = None):
+        own_executor = executor is None
+        if own_executor:
+            executor = HandlerExecutor.create(self.channel)
+        try:
+            pub_sub = self.connection.pubsub()
+            pub_sub.subscribe(self.channel)
+            for event in pub_sub.listen():
+                executor.submit(event_handler.handle, event)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    # listens the channels on one pub/sub connection and hands their events to one executor, so the events which have the same key are
+    # serialized across the channels
+    @staticmethod
+    def subscribe_all_async(event_handlers: Dict[str, EventHandler], executor: HandlerExecutor):
+        connection = crate_redis_connection(RedisDb.EVENTBUS, True, 2)
+        pub_sub = connection.pubsub()
+        pub_sub.subscribe(*event_handlers.keys())
         for event in pub_sub.listen():
-            th = Thread(target=event_handler.handle, args=[event])
-            th.daemon = True
-            th.start()
+            if event is None or event.get('type') != 'message':
+                continue
+            channel = event['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode('utf-8')
+            event_handler = event_handlers.get(channel)
+            if event_handler is not None:
+                executor.submit(event_handler.handle, event)
 
     def unsubscribe(self):
         pub_sub = self.connection.pubsub()
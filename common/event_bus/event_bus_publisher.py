@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+from collections import deque
+from datetime import datetime
+from threading import Condition, Lock
+from typing import List, Tuple
+
+from common.config import OverflowPolicy
+from common.utilities import crate_redis_connection, RedisDb, logger, config
+from utils.utils import start_thread
+
+
+# one long-lived sender per process. Events are queued into a bounded queue and flushed through a Redis pipeline in batches.
+class EventBusPublisher:
+    __instance: EventBusPublisher | None = None
+    __instance_pid: int = 0
+    __instance_lock = Lock()
+
+    def __init__(self, max_size: int, batch_size: int, overflow_policy: OverflowPolicy, block_timeout: float):
+        self.connection = crate_redis_connection(RedisDb.EVENTBUS, True, 2)
+        self.max_size: int = max(max_size, 1)
+        self.batch_size: int = max(batch_size, 1)
+        self.overflow_policy: OverflowPolicy = overflow_policy
+        self.block_timeout: float = block_timeout
+        self.queue: deque = deque()
+        self.cond = Condition()
+        self.queued_count: int = 0
+        self.sent_count: int = 0
+        self.dropped_count: int = 0
+        self.failed_count: int = 0
+        start_thread(self.__run, [])
+
+    @staticmethod
+    def get_instance() -> EventBusPublisher:
+        pid = os.getpid()
+        with EventBusPublisher.__instance_lock:
+            # forked processes (rq workers, pipe reader owners) need their own sender thread
+            if EventBusPublisher.__instance is None or EventBusPublisher.__instance_pid != pid:
+                c = config.event_bus
+                EventBusPublisher.__instance = EventBusPublisher(c.publish_queue_size, c.publish_batch_size, c.publish_overflow_policy,
+                                                                 c.publish_block_timeout)
+                EventBusPublisher.__instance_pid = pid
+            return EventBusPublisher.__instance
+
+    def publish(self, channel: str, event) -> bool:
+        with self.cond:
+            if len(self.queue) >= self.max_size:
+                if self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped_count += 1
+                    return False
+                elif self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped_count += 1
+                elif not self.cond.wait_for(lambda: len(self.queue) < self.max_size, self.block_timeout):
+                    self.dropped_count += 1
+                    logger.warning(f'event bus publisher queue is full, an event for {channel} has been dropped at {datetime.now()}')
+                    return False
+            self.queue.append((channel, event))
+            self.queued_count += 1
+            self.cond.notify_all()
+        return True
+
+    def get_stats(self) -> dict:
+        with self.cond:
+            return {'queued': self.queued_count, 'sent': self.sent_count, 'dropped': self.dropped_count, 'failed': self.failed_count,
+                    'queue_length': len(self.queue)}
+
+    def __run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.queue) > 0)
+                length = min(len(self.queue), self.batch_size)
+                batch = [self.queue.popleft() for _ in range(length)]
+                self.cond.notify_all()  # wakes up the publishers which are waiting for a free space
+            self.__send(batch)
+
+    def __send(self, batch: List[Tuple[str, any]]):
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            for channel, event in batch:
+                pipe.publish(channel, event)
+            pipe.execute()
+            with self.cond:
+                self.sent_count += len(batch)
+        except BaseException as ex:
+            with self.cond:
+                self.failed_count += len(batch)
+            logger.error(f'an error occurred while publishing a batch of {len(batch)} events, err: {ex}')
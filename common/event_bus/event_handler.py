@@ -5,3 +5,10 @@ class EventHandler(ABC):
     @abstractmethod
     def handle(self, event):
         pass
+
+
+class AsyncEventHandler(ABC):
+    @abstractmethod
+    async def handle(self, event):
+        pass
+
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+from collections import deque
+from datetime import datetime
+from threading import Condition, Thread
+from typing import Callable, Set
+
+from common.config import OverflowPolicy
+from common.utilities import logger, config
+
+
+def get_event_key(event: dict) -> str | None:  # source id for stream requests, source_id for the record requests
+    if event is None or event.get('type') != 'message':
+        return None
+    try:
+        dic = json.loads(event['data'])
+        key = dic.get('id') or dic.get('source_id')
+        return str(key) if key else None
+    except BaseException:
+        return None
+
+
+# runs the pub/sub handlers on a bounded number of worker threads. Events which have the same key (i.e. source id) are never
+# executed concurrently and keep their order. The channels whose events have to be serialized by the same key share one executor,
+# i.e. a start and a stop request for one camera can not interleave, see EventBus.subscribe_all_async.
+class HandlerExecutor:
+    def __init__(self, name: str, max_workers: int, max_pending: int, overflow_policy: OverflowPolicy,
+                 key_fn: Callable[[dict], str | None] = get_event_key):
+        self.name = name
+        self.max_workers: int = max(max_workers, 1)
+        self.max_pending: int = max(max_pending, 1)
+        self.overflow_policy: OverflowPolicy = overflow_policy
+        self.key_fn = key_fn
+        self.queue: deque = deque()
+        self.active_keys: Set[str] = set()
+        self.cond = Condition()
+        self.stopped = False
+        self.running_count: int = 0
+        self.submitted_count: int = 0
+        self.completed_count: int = 0
+        self.failed_count: int = 0
+        self.dropped_count: int = 0
+        self.max_queue_depth: int = 0
+        for index in range(self.max_workers):
+            th = Thread(target=self.__work, name=f'{name}_handler_{index}')
+            th.daemon = True
+            th.start()
+
+    @staticmethod
+    def create(name: str) -> HandlerExecutor:
+        c = config.event_bus
+        return HandlerExecutor(name, c.subscribe_max_workers, c.subscribe_max_pending, c.subscribe_overflow_policy)
+
+    # returns False if the event has been dropped or the executor has been shut down
+    def submit(self, fn: Callable, event) -> bool:
+        key = self.key_fn(event)
+        with self.cond:
+            if self.stopped:
+                return False
+            if len(self.queue) >= self.max_pending:
+                if self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped_count += 1
+                    logger.warning(f'{self.name} handler queue is full, the newest event has been dropped at {datetime.now()}')
+                    return False
+                elif self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped_count += 1
+                    logger.warning(f'{self.name} handler queue is full, the oldest event has been dropped at {datetime.now()}')
+                else:  # backpressure, the pub/sub listener stops reading until a worker takes an event
+                    self.cond.wait_for(lambda: len(self.queue) < self.max_pending or self.stopped)
+                    if self.stopped:
+                        return False
+            self.queue.append((key, fn, event))
+            self.submitted_count += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self.cond.notify_all()
+        return True
+
+    def shutdown(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def get_stats(self) -> dict:
+        with self.cond:
+            return {'queue_depth': len(self.queue), 'max_queue_depth': self.max_queue_depth, 'running': self.running_count,
+                    'submitted': self.submitted_count, 'completed': self.completed_count, 'failed': self.failed_count,
+                    'dropped': self.dropped_count}
+
+    # the first queued item whose key is not being handled, the items of a busy key stay in the queue in their order.
+    def __pop_runnable(self):
+        for index, item in enumerate(self.queue):
+            key = item[0]
+            if key is None or key not in self.active_keys:
+                del self.queue[index]
+                return item
+        return None
+
+    def __work(self):
+        while True:
+            with self.cond:
+                item = self.__pop_runnable()
+                while item is None:
+                    if self.stopped:
+                        return
+                    self.cond.wait()
+                    item = self.__pop_runnable()
+                key, fn, event = item
+                if key is not None:
+                    self.active_keys.add(key)
+                self.running_count += 1
+                self.cond.notify_all()
+            failed = False
+            try:
+                fn(event)
+            except BaseException as ex:
+                failed = True
+                logger.error(f'an error occurred while handling an event on {self.name}, err: {ex}')
+            finally:
+                with self.cond:
+                    if key is not None:
+                        self.active_keys.discard(key)
+                    self.running_count -= 1
+                    if failed:
+                        self.failed_count += 1
+                    else:
+                        self.completed_count += 1
+                    self.cond.notify_all()
@@ -1,5 +1,6 @@
 import logging
 from redis import Redis
+import redis.asyncio as aioredis
 from enum import IntEnum
 from datetime import datetime
 
@@ -24,6 +25,11 @@ def crate_redis_connection(db: RedisDb, socket_keepalive: bool = False, health_c
                  health_check_interval=health_check_interval)
 
 
+def crate_async_redis_connection(db: RedisDb, socket_keepalive: bool = False, health_check_interval: int = 0) -> aioredis.Redis:
+    return aioredis.Redis(host=config_redis.host, port=config_redis.port, db=int(db), socket_keepalive=socket_keepalive,
+                          health_check_interval=health_check_interval)
+
+
 def fix_zero_s(val_str: str) -> str:
     if len(val_str) == 1:
         return f'0{val_str}'
@@ -1,15 +1,18 @@
 import time
 from datetime import datetime
 
-from common.data.source_repository import SourceRepository
+from common.data.source_repository import CachedSourceRepository
+from common.event_bus.async_event_bus import AsyncEventBus
 from common.event_bus.event_bus import EventBus
+from common.event_bus.handler_executor import HandlerExecutor
 from common.utilities import crate_redis_connection, RedisDb, logger, config
 from editor.editor_event_handler import EditorEventHandler
+from record.clip_export_event_handler import ClipExportEventHandler
 from record.vfm_event_handler import VfmEventHandler
 from stream.restart_stream_event_handler import RestartStreamEventHandler
 from stream.start_stream_event_handler import StartStreamEventHandler
 from stream.stop_stream_event_handler import StopStreamEventHandler
-from stream.stream_repository import StreamRepository
+from stream.stream_repository import CachedStreamRepository
 from sustain.recurrent_jobs.black_screen_monitor import BlackScreenMonitor
 from sustain.recurrent_jobs.mac_ip_matching import MacIpMatching
 from sustain.scheduler import setup_scheduler
@@ -17,8 +20,8 @@ from utils.utils import start_thread
 from various.probe_event_handler import ProbeEventHandler
 
 __connection_source = crate_redis_connection(RedisDb.MAIN)
-__source_repository = SourceRepository(__connection_source)
-__stream_repository = StreamRepository(__connection_source)
+__source_repository = CachedSourceRepository(__connection_source)
+__stream_repository = CachedStreamRepository(__connection_source)
 
 
 def listen_editor_event():
@@ -27,22 +30,16 @@ def listen_editor_event():
     event_bus.subscribe_async(handler)
 
 
-def listen_start_stream_event():
-    handler = StartStreamEventHandler(__source_repository, __stream_repository)
-    event_bus = EventBus('start_stream_request')
-    event_bus.subscribe_async(handler)
-
-
-def listen_stop_stream_event():
-    handler = StopStreamEventHandler(__source_repository, __stream_repository)
-    event_bus = EventBus('stop_stream_request')
-    event_bus.subscribe_async(handler)
-
-
-def listen_restart_stream_event():
-    handler = RestartStreamEventHandler(__source_repository, __stream_repository)
-    event_bus = EventBus('restart_stream_request')
-    event_bus.subscribe_async(handler)
+# start, stop and restart requests are listened in one process and share one executor, so the requests of a camera are handled in order
+def listen_stream_events():
+    handlers = {'start_stream_request': StartStreamEventHandler(__source_repository, __stream_repository),
+                'stop_stream_request': StopStreamEventHandler(__source_repository, __stream_repository),
+                'restart_stream_request': RestartStreamEventHandler(__source_repository, __stream_repository)}
+    executor = HandlerExecutor.create('stream_request')
+    try:
+        EventBus.subscribe_all_async(handlers, executor)
+    finally:
+        executor.shutdown()
 
 
 def listen_various_events():
@@ -58,6 +55,18 @@ def listen_various_events():
 
     start_thread(listen_probe_event, [])
 
+    def listen_clip_export_event():
+        while 1:
+            try:
+                clip_export_handler = ClipExportEventHandler(__stream_repository)
+                event_bus = EventBus('clip_export_request')
+                event_bus.subscribe_async(clip_export_handler)
+            except BaseException as ex:
+                logger.error(f'an error occurred on ClipExportEventHandler at {datetime.now()}, err: {ex}')
+            time.sleep(1.)
+
+    start_thread(listen_clip_export_event, [])
+
     def fn_listen_vfm():
         while 1:
             try:
@@ -71,6 +80,18 @@ def listen_various_events():
     fn_listen_vfm()
 
 
+async def listen_all_events_async():  # replaces the listen_* tasks if config.event_bus.async_listeners_enabled is True
+    event_bus = AsyncEventBus()
+    event_bus.add_handler('start_stream_request', StartStreamEventHandler(__source_repository, __stream_repository), 'stream_request')
+    event_bus.add_handler('stop_stream_request', StopStreamEventHandler(__source_repository, __stream_repository), 'stream_request')
+    event_bus.add_handler('restart_stream_request', RestartStreamEventHandler(__source_repository, __stream_repository), 'stream_request')
+    event_bus.add_handler('editor_request', EditorEventHandler())
+    event_bus.add_handler('probe_request', ProbeEventHandler())
+    event_bus.add_handler('vfm_request', VfmEventHandler(__stream_repository))
+    event_bus.add_handler('clip_export_request', ClipExportEventHandler(__stream_repository))
+    await event_bus.run_forever()
+
+
 def execute_various_jobs():
     def fn_check_mac_and_ip_mathing():
         mim = MacIpMatching(__source_repository)
@@ -3,6 +3,8 @@ import asyncio
 from common.config import Config
 from common.data.service_repository import ServiceRepository
 from common.utilities import logger, crate_redis_connection, RedisDb
+from event_listeners_and_jobs import listen_all_events_async
+from sustain.rebuild_indexes import rebuild_indexes
 from sustain.task_manager import add_tasks, start_tasks, clean_others_previous, clean_my_previous
 
 
@@ -18,6 +20,7 @@ def main():
 
     clean_my_previous()
     clean_others_previous()
+    rebuild_indexes(crate_redis_connection(RedisDb.MAIN))
 
     config = Config.create()
     dir_paths = config.general.dir_paths
@@ -32,6 +35,9 @@ def main():
 
     try:
         loop = asyncio.get_event_loop()
+        if config.event_bus.async_listeners_enabled:
+            loop.create_task(listen_all_events_async())
+            logger.info('request channels are being listened by AsyncEventBus')
         loop.run_forever()
     finally:
         clean_my_previous()
@@ -1,10 +1,17 @@
-from typing import List, Any
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Any
 import docker
 from redis.client import Redis
 
+from common.utilities import logger
 from stream.stream_model import StreamModel, MediaServerType
 from media_server.media_server_models import BaseMediaServerModel, Go2RtcMediaServerModel, SrsRealtimeMediaServerModel, LiveGoMediaServerModel, \
     NodeMediaServerModel
+from media_server.media_server_pool import MediaServerPool
+from media_server.port_allocator import PortAllocator
+from media_server.shared_media_servers import SharedMediaServers, is_shared_container
 
 
 # for more info: https://docker-py.readthedocs.io/en/stable/containers.html
@@ -12,6 +19,26 @@ class DockerManager:
     def __init__(self, connection: Redis):
         self.connection: Redis = connection
         self.client = docker.from_env()
+        self.containers_by_name: Dict[str, Any] | None = None  # name indexed snapshot of all containers, see refresh_containers
+        self.port_allocator = PortAllocator(connection)
+        self.pool = MediaServerPool(connection, self.client, self.__create_media_server_model)
+        self.shared = SharedMediaServers(connection, self.client, self.__create_media_server_model)
+
+    # lists the containers once, so checking N streams does not cost N full listings. Called once per watchdog tick.
+    def refresh_containers(self):
+        containers = self.client.containers.list(all=True)
+        self.containers_by_name = {container.name: container for container in containers}
+        logger.info(f'docker container cache has been refreshed ({len(containers)} containers) at {datetime.now()}')
+
+    def __find_container(self, container_name: str):
+        if not container_name:
+            return None
+        # docker matches the name filter as a regex against the names with a leading slash
+        containers = self.client.containers.list(all=True, filters={'name': f'^/?{container_name}$'})
+        for container in containers:
+            if container.name == container_name:
+                return container
+        return None
 
     def __create_media_server_model(self, ms_type: MediaServerType, stream_id: str) -> BaseMediaServerModel:
         if ms_type == MediaServerType.GO_2_RTC:
@@ -24,17 +51,19 @@ class DockerManager:
             ms_model = NodeMediaServerModel(stream_id, self.connection)
         else:
             raise NotImplementedError('MediaServerType was not match')
-
-        ms_model.int_ports()
-
         return ms_model
 
-    def __init_container(self, ms_model: BaseMediaServerModel, all_containers: List):
+    # the ports of the previous container of the stream are returned to the free set only after it has been stopped, otherwise another
+    # stream could take them while they are still mapped
+    def __remove_previous_container(self, ms_model: BaseMediaServerModel):
+        container_name = ms_model.get_container_name()
+        container = self.__find_container(container_name)
+        if container is not None:
+            self.stop_container(container)
+        self.port_allocator.release(container_name)
+
+    def __init_container(self, ms_model: BaseMediaServerModel):
         container_name = ms_model.get_container_name()
-        for container in all_containers:
-            if container.name == container_name:
-                self.stop_container(container)
-                break
         container = self.client.containers.run(ms_model.get_image_name(), detach=True,
                                                command=ms_model.get_commands(),
                                                # auto_remove=True, remove=True,
@@ -45,29 +74,42 @@ class DockerManager:
 
     def run(self, ms_type: MediaServerType, stream_id: str) -> (BaseMediaServerModel, Any):
         ms_model = self.__create_media_server_model(ms_type, stream_id)
-        all_containers = self.client.containers.list(all=True)
-        container = self.__init_container(ms_model, all_containers)
+        if self.shared.is_enabled(ms_model):
+            return ms_model, self.shared.assign(ms_model, ms_type, stream_id)
+        self.__remove_previous_container(ms_model)
+        container = self.pool.claim(ms_model, ms_type) if self.pool.is_enabled() else None
+        if container is None:
+            ms_model.int_ports()
+            container = self.__init_container(ms_model)
+        self.pool.refill_async(ms_type)
         return ms_model, container
 
     def remove(self, model: StreamModel):
+        if is_shared_container(model.ms_container_name):  # the other streams are still being served by the shared instance
+            self.shared.release(model.id, self.shared.create_model(model.ms_type, model.id, model.ms_container_name))
+            return
         container = self.get_container(model)
         if container is not None:
             self.stop_container(container)
+        self.port_allocator.release(model.ms_container_name)
 
     def get_container_by(self, container_name):
         filters: dict = {'name': container_name}
         containers = self.client.containers.list(filters=filters)
         return containers[0] if len(containers) > 0 else None
 
+    # a container which has been created after the refresh is not in the cache, so a miss is confirmed by the name filter
     def get_container(self, model: StreamModel):
         container_name = model.ms_container_name
-        containers = self.client.containers.list(all=True)
-        for container in containers:
-            if container.name == container_name:
+        if self.containers_by_name is not None:
+            container = self.containers_by_name.get(container_name)
+            if container is not None:
                 return container
-        return None
+        return self.__find_container(container_name)
 
-    def get_all_containers(self):
+    def get_all_containers(self) -> List:
+        if self.containers_by_name is not None:
+            return list(self.containers_by_name.values())
         return self.client.containers.list(all=True)
 
     @staticmethod
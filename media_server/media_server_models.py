@@ -6,13 +6,10 @@ import requests
 from abc import ABC, abstractmethod
 from redis.client import Redis
 
-from common.data.source_repository import SourceRepository
 from common.utilities import logger, config
+from media_server.port_allocator import PortAllocator
 from stream.stream_model import StreamModel
-from stream.stream_repository import StreamRepository
-
-inc_namespace = 'media_server_ports'
-ports_count = 'ports_count'
+from utils.net import is_port_open, is_http_ok, is_http_up, wait_until
 
 
 class MediaServerImages(Enum):
@@ -26,32 +23,16 @@ class BaseMediaServerModel(ABC):
     def __init__(self, container_name: str, main_connection: Redis):
         self.container_name = container_name
         self.connection: Redis = main_connection
-        self.inc_starting_port: int = 0
-        self.max_port_num: int = 0
-        self.__set_ports_values(main_connection)
-        self.increment_by = 1
+        self.port_allocator = PortAllocator(main_connection)
         self.host = '127.0.0.1'
         self.protocol = 'http'
         self.port_dic = {}
         self.media_server_port: int = 0
         self.stream_port: int = 0
-        self.media_server_wait: float = config.ffmpeg.ms_init_interval  # otherwise, Media Server read will not work
-        self.stream_repository = StreamRepository(main_connection)
-
-    def __set_ports_values(self, main_connection: Redis):
-        f = config.ffmpeg
-        mp = 65535
-        self.inc_starting_port: int = f.ms_port_start - 1 if f.ms_port_start - 1 > 1 else 1024
-        self.max_port_num: int = (f.ms_port_end if f.ms_port_end > f.ms_port_start else mp) - self.inc_starting_port
-        self.max_port_num = max(self.max_port_num, 16)
-        if self.max_port_num > mp:
-            self.max_port_num = mp
-        source_repository = SourceRepository(main_connection)
-        source_models = source_repository.get_all()
-        min_port_value = len(source_models) * 5
-        if self.max_port_num < min_port_value:
-            logger.error(f'max port number is lower then source count * 5, the min_port_num is not set to {min_port_value}')
-            self.max_port_num = min_port_value
+        self.ready_timeout: float = config.ffmpeg.ms_ready_timeout  # otherwise, Media Server read will not work
+        self.ready_poll_interval: float = config.ffmpeg.ms_ready_poll_interval
+        self.stream_path: str = ''  # the stream name on the media server, it is the source id on a shared instance
+        self.shared: bool = False
 
     def map_to(self, stream_model: StreamModel):
         stream_model.ms_container_ports = json.dumps(self.get_ports())
@@ -62,24 +43,10 @@ class BaseMediaServerModel(ABC):
         stream_model.ms_container_commands = ','.join(self.get_commands())
         stream_model.ms_initialized = True
 
-    def __port_inc(self, ports: set) -> int:
-        inc = self.connection.hincrby(inc_namespace, ports_count, self.increment_by)
-        ret = self.inc_starting_port + (inc % self.max_port_num)
-        if ret in ports:
-            logger.warning(f'port ({ret}) is being used by another container, now trying another one')
-            return self.__port_inc(ports)
-        return ret
-
-    def port_inc(self) -> int:
-        ports = set()
-        stream_models = self.stream_repository.get_all()
-        for stream_model in stream_models:
-            if len(stream_model.ms_container_ports) == 0:
-                continue
-            dic = json.loads(stream_model.ms_container_ports)
-            for field in dic:
-                ports.add(int(dic[field]))
-        return self.__port_inc(ports)
+    # maps the container ports to the host ports which are allocated for the container in one round trip
+    def allocate_ports(self, container_ports: list) -> dict:
+        host_ports = self.port_allocator.allocate(self.get_container_name(), len(container_ports))
+        return {container_port: str(host_port) for container_port, host_port in zip(container_ports, host_ports)}
 
     def get_container_name(self) -> str:
         return self.container_name
@@ -96,6 +63,11 @@ class BaseMediaServerModel(ABC):
     def int_ports(self):
         raise NotImplementedError('get_ports() must be implemented')
 
+    # port_dic maps the container ports to the host ports, i.e. the ports of a claimed pool container
+    @abstractmethod
+    def set_ports(self, port_dic: dict):
+        raise NotImplementedError('set_ports() must be implemented')
+
     def get_ports(self) -> dict:
         return self.port_dic
 
@@ -103,6 +75,33 @@ class BaseMediaServerModel(ABC):
     def on_media_server_initialized(self) -> str:
         raise NotImplementedError('on_media_server_initialized() must be implemented')
 
+    # the media servers which route the streams by their paths can serve many sources from one container
+    def supports_shared(self) -> bool:
+        return False
+
+    def share(self, instance_name: str, port_dic: dict, stream_path: str):
+        self.container_name = instance_name
+        self.set_ports(port_dic)
+        self.stream_path = stream_path
+        self.shared = True
+
+    # called when a stream leaves a shared instance
+    def on_stream_released(self):
+        pass
+
+    # the mapped ports accept connections as soon as the container starts if docker-proxy is used, so the models which have an HTTP API
+    # ping it instead of connecting to the ingest port
+    def is_ready(self) -> bool:
+        return is_port_open(self.host, self.media_server_port, self.ready_poll_interval * 5)
+
+    def wait_until_ready(self) -> bool:
+        started_at = time.monotonic()
+        if wait_until(self.is_ready, self.ready_timeout, self.ready_poll_interval):
+            logger.info(f'media server ({self.container_name}) is ready in {round(time.monotonic() - started_at, 2)} seconds')
+            return True
+        logger.error(f'media server ({self.container_name}) is not ready in {self.ready_timeout} seconds')
+        return False
+
     @abstractmethod
     def get_ms_address(self) -> str:
         raise NotImplementedError('get_ms_address() must be implemented')
@@ -115,6 +114,8 @@ class BaseMediaServerModel(ABC):
 class SrsMediaServerModel(BaseMediaServerModel):
     def __init__(self, unique_name: str, connection: Redis):
         super().__init__(f'{self._get_prefix()}_{unique_name}', connection)
+        self.stream_path = 'livestream'
+        self.api_port: int = 0
 
     @staticmethod
     def _get_prefix():
@@ -128,20 +129,29 @@ class SrsMediaServerModel(BaseMediaServerModel):
 
     def int_ports(self):
         if not self.port_dic:
-            self.media_server_port = self.port_inc()
-            other_port = self.port_inc()
-            self.stream_port = self.port_inc()
-            self.port_dic = {'1935': str(self.media_server_port), '1985': str(other_port), '8080': str(self.stream_port)}
+            self.set_ports(self.allocate_ports(['1935', '1985', '8080']))
+
+    def set_ports(self, port_dic: dict):
+        self.media_server_port = int(port_dic['1935'])
+        self.api_port = int(port_dic['1985'])
+        self.stream_port = int(port_dic['8080'])
+        self.port_dic = port_dic
+
+    def is_ready(self) -> bool:
+        return is_http_ok(f'{self.protocol}://{self.host}:{self.api_port}/api/v1/versions', self.ready_poll_interval * 5)
 
     def on_media_server_initialized(self) -> str:
-        time.sleep(self.media_server_wait)
+        self.wait_until_ready()
         return ''
 
     def get_ms_address(self) -> str:
-        return f'rtmp://{self.host}:{self.media_server_port}/live/livestream'
+        return f'rtmp://{self.host}:{self.media_server_port}/live/{self.stream_path}'
 
     def get_stream_address(self, stream_model: StreamModel) -> str:
-        return f'{self.protocol}://{self.host}:{self.stream_port}/live/livestream.flv'
+        return f'{self.protocol}://{self.host}:{self.stream_port}/live/{self.stream_path}.flv'
+
+    def supports_shared(self) -> bool:
+        return True
 
 
 class SrsRealtimeMediaServerModel(SrsMediaServerModel):
@@ -171,31 +181,26 @@ class LiveGoMediaServerModel(BaseMediaServerModel):
 
     def int_ports(self):
         if not self.port_dic:
-            self.media_server_port = self.port_inc()
-            self.stream_port = self.port_inc()
-            other_port = self.port_inc()
-            self.web_api_port = self.port_inc()
-            self.port_dic = {'1935': str(self.media_server_port), '7001': str(self.stream_port), '7002': str(other_port),
-                             '8090': str(self.web_api_port)}
+            self.set_ports(self.allocate_ports(['1935', '7001', '7002', '8090']))
+
+    def set_ports(self, port_dic: dict):
+        self.media_server_port = int(port_dic['1935'])
+        self.stream_port = int(port_dic['7001'])
+        self.web_api_port = int(port_dic['8090'])
+        self.port_dic = port_dic
+
+    def __get_channel_url(self) -> str:
+        return f'{self.protocol}://{self.host}:{self.web_api_port}/control/get?room={self.predefined_channel_key}'
+
+    # the web api answers only after the channel is created
+    def is_ready(self) -> bool:
+        return is_http_ok(self.__get_channel_url(), self.ready_poll_interval * 5)
 
     def on_media_server_initialized(self) -> str:
         if len(self.channel_key) == 0:
-            max_retry = config.ffmpeg.max_operation_retry_count
-            retry_count = 0
-            while not self.channel_key and retry_count < max_retry:
-                try:
-                    resp = requests.get(
-                        f'{self.protocol}://{self.host}:{self.web_api_port}/control/get?room={self.predefined_channel_key}')
-                    resp.raise_for_status()
-                    self.channel_key = self.predefined_channel_key
-                except BaseException as e:
-                    logger.error(e)
-                    time.sleep(1)
-                retry_count += 1
-            if retry_count == max_retry:
-                logger.error('on_media_server_initialized max retry count has been exceeded for livego.')
-                self.channel_key = self.predefined_channel_key
-        time.sleep(self.media_server_wait)
+            if not self.wait_until_ready():
+                logger.error('on_media_server_initialized readiness timeout has been exceeded for livego.')
+            self.channel_key = self.predefined_channel_key
         return self.channel_key
 
     def get_ms_address(self) -> str:
@@ -208,6 +213,7 @@ class LiveGoMediaServerModel(BaseMediaServerModel):
 class NodeMediaServerModel(BaseMediaServerModel):
     def __init__(self, unique_name: str, connection: Redis):
         super().__init__(f'nms_{unique_name}', connection)
+        self.stream_path = 'STREAM_NAME'
 
     def get_image_name(self) -> str:
         return MediaServerImages.NMS.value
@@ -217,26 +223,36 @@ class NodeMediaServerModel(BaseMediaServerModel):
 
     def int_ports(self):
         if not self.port_dic:
-            self.media_server_port = self.port_inc()
-            self.stream_port = self.port_inc()
-            other_port = self.port_inc()
-            self.port_dic = {'1935': str(self.media_server_port), '8000': str(self.stream_port), '8443': str(other_port)}
+            self.set_ports(self.allocate_ports(['1935', '8000', '8443']))
+
+    def set_ports(self, port_dic: dict):
+        self.media_server_port = int(port_dic['1935'])
+        self.stream_port = int(port_dic['8000'])
+        self.port_dic = port_dic
+
+    # the http server of NMS, any response means it is listening
+    def is_ready(self) -> bool:
+        return is_http_up(f'{self.protocol}://{self.host}:{self.stream_port}', self.ready_poll_interval * 5)
 
     def on_media_server_initialized(self) -> str:
-        time.sleep(self.media_server_wait)
+        self.wait_until_ready()
         return ''
 
     def get_ms_address(self) -> str:
-        return f'rtmp://{self.host}:{self.media_server_port}/live/STREAM_NAME'
+        return f'rtmp://{self.host}:{self.media_server_port}/live/{self.stream_path}'
 
     def get_stream_address(self, stream_model: StreamModel) -> str:
         protocol = 'http'  # or https?
-        return f'{protocol}://{self.host}:{self.stream_port}/live/STREAM_NAME.flv'
+        return f'{protocol}://{self.host}:{self.stream_port}/live/{self.stream_path}.flv'
+
+    def supports_shared(self) -> bool:
+        return True
 
 
 class Go2RtcMediaServerModel(BaseMediaServerModel):
     def __init__(self, unique_name: str, connection: Redis):
         super().__init__(f'go2rtc_{unique_name}', connection)
+        self.stream_path = 'camera1'
         self.webrtc_port: int = 0
 
     def get_image_name(self) -> str:
@@ -252,41 +268,72 @@ class Go2RtcMediaServerModel(BaseMediaServerModel):
             INF [rtsp] listen addr=:8554
             INF [webrtc] listen addr=:8555/tcp
             """
-            self.stream_port = self.port_inc()  # api  http://127.0.0.1:1985/api/ws?src=camera1
-            self.media_server_port = self.port_inc()  # rtsp ffmpeg -f rtsp rtsp://127.0.0.1:8564/camera1
-            self.webrtc_port = self.port_inc()  # webrtc  it is not used now
-            self.port_dic = {'1984': str(self.stream_port), '8554': str(self.media_server_port),
-                             '8555': str(self.webrtc_port)}
+            # api  http://127.0.0.1:1985/api/ws?src=camera1, rtsp ffmpeg -f rtsp rtsp://127.0.0.1:8564/camera1, webrtc  it is not used now
+            self.set_ports(self.allocate_ports(['1984', '8554', '8555']))
+
+    def set_ports(self, port_dic: dict):
+        self.stream_port = int(port_dic['1984'])
+        self.media_server_port = int(port_dic['8554'])
+        self.webrtc_port = int(port_dic['8555'])
+        self.port_dic = port_dic
+
+    def __get_api_url(self, path: str) -> str:
+        return f'{self.protocol}://{self.host}:{self.stream_port}/api{path}'
+
+    def is_ready(self) -> bool:
+        return is_http_ok(self.__get_api_url(''), self.ready_poll_interval * 5)
+
+    # restart and exit make go2rtc reload the config, the API goes down and comes back instead of a fixed sleep.
+    # the API is polled since the mapped port is kept open by docker-proxy while go2rtc restarts
+    def __wait_for_restart(self):
+        wait_until(lambda: not self.is_ready(), self.ready_poll_interval * 10, self.ready_poll_interval / 2)
+        self.wait_until_ready()
 
     def on_media_server_initialized(self) -> str:
-        config_url = f'{self.protocol}://{self.host}:{self.stream_port}/api/config'
-        restart_url = f'{self.protocol}://{self.host}:{self.stream_port}/api/restart'
-        exit_url = f'{self.protocol}://{self.host}:{self.stream_port}/api/exit'
+        if self.shared:  # a shared instance has already been configured, restarting it would break the other streams
+            self.wait_until_ready()
+            try:
+                # an empty src makes the API list the streams instead of creating one. The feeder publishes to the stream, so its src is only
+                # a placeholder which can not be dialed, like the empty camera1 entry of a dedicated container's config
+                requests.put(self.__get_api_url('/streams'), params={'name': self.stream_path, 'src': self.stream_path},
+                             timeout=5).raise_for_status()
+                if requests.get(self.__get_api_url('/streams'), params={'src': self.stream_path}, timeout=5).status_code != 200:
+                    logger.error(f'stream ({self.stream_path}) could not be created on the shared go2rtc instance ({self.container_name})')
+            except BaseException as e:
+                logger.error(e)
+            return ''
         yml = f'streams:{os.linesep}    camera1:{os.linesep}api:{os.linesep}    origin: "*"'
         try:
-            result = requests.post(config_url, data=yml)
+            self.wait_until_ready()
+            result = requests.post(self.__get_api_url('/config'), data=yml)
             if result.status_code == 200:
-                time.sleep(self.media_server_wait)
-
                 try:
-                    requests.post(restart_url)
+                    requests.post(self.__get_api_url('/restart'))
                 except BaseException as e:
                     logger.error(e)
+                self.__wait_for_restart()
 
-                time.sleep(self.media_server_wait)
                 try:
-                    requests.post(exit_url)
+                    requests.post(self.__get_api_url('/exit'))
                 except BaseException as e:
                     logger.error(e)
-
-                time.sleep(self.media_server_wait)
+                self.__wait_for_restart()
         except BaseException as e:
             logger.error(e)
             time.sleep(1)
         return ''
 
     def get_ms_address(self) -> str:
-        return f'rtsp://{self.host}:{self.media_server_port}/camera1'
+        return f'rtsp://{self.host}:{self.media_server_port}/{self.stream_path}'
 
     def get_stream_address(self, stream_model: StreamModel) -> str:
-        return f'{self.protocol}://{self.host}:{self.stream_port}/api/ws?src=camera1'
+        return f'{self.protocol}://{self.host}:{self.stream_port}/api/ws?src={self.stream_path}'
+
+    def supports_shared(self) -> bool:
+        return True
+
+    def on_stream_released(self):
+        try:
+            requests.delete(self.__get_api_url('/streams'), params={'src': self.stream_path}, timeout=5)
+        except BaseException as e:
+            logger.error(e)
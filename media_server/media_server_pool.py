@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Callable
+from redis.client import Redis
+
+from common.utilities import logger, config
+from media_server.media_server_models import BaseMediaServerModel
+from media_server.port_allocator import PortAllocator
+from stream.stream_model import MediaServerType
+from utils.utils import start_thread
+
+pool_namespace = 'media_server_pool:'  # a list of the idle pool containers per MediaServerType
+pool_stats_key = 'media_server_pool_stats'
+pool_name_prefix = 'mspool_'  # must not start with a media server container prefix, otherwise the watchdog stops them as zombies
+
+
+# idle media server containers which have been created with their ports beforehand. A start request claims one by renaming it to
+# the container name of the stream instead of a cold containers.run(), and the pool is refilled in the background.
+class MediaServerPool:
+    def __init__(self, connection: Redis, client, model_factory: Callable[[MediaServerType, str], BaseMediaServerModel]):
+        self.connection: Redis = connection
+        self.client = client
+        self.model_factory = model_factory  # creates a media server model without allocating its ports
+        self.size: int = max(config.ffmpeg.ms_pool_size, 0)
+        self.port_allocator = PortAllocator(connection)
+
+    def is_enabled(self) -> bool:
+        return self.size > 0
+
+    @staticmethod
+    def _get_key(ms_type: MediaServerType) -> str:
+        return f'{pool_namespace}{int(ms_type)}'
+
+    def __inc_stat(self, ms_type: MediaServerType, name: str):
+        self.connection.hincrby(pool_stats_key, f'{ms_type.name.lower()}_{name}', 1)
+
+    def get_stats(self) -> dict:
+        return {key.decode('utf-8'): int(value) for key, value in self.connection.hgetall(pool_stats_key).items()}
+
+    def __remove_container(self, name: str):
+        try:
+            containers = self.client.containers.list(all=True, filters={'name': f'^/?{name}$'})
+            for container in containers:
+                container.stop()
+                container.remove()
+        except BaseException as ex:
+            logger.error(f'an error occurred while removing a pool container ({name}), err: {ex}')
+
+    # returns the renamed container and sets the ports of the model, or None if the pool is empty
+    def claim(self, ms_model: BaseMediaServerModel, ms_type: MediaServerType) -> Any | None:
+        key = self._get_key(ms_type)
+        while True:
+            entry = self.connection.lpop(key)
+            if entry is None:
+                self.__inc_stat(ms_type, 'misses')
+                logger.warning(f'media server pool ({ms_type.name}) is empty, a container will be created at {datetime.now()}')
+                return None
+            dic = json.loads(entry)
+            containers = self.client.containers.list(all=True, filters={'name': f'^/?{dic["name"]}$'})
+            container = containers[0] if len(containers) > 0 else None
+            if container is None or container.status != 'running':
+                logger.warning(f'a broken pool container ({dic["name"]}) has been discarded')
+                self.__remove_container(dic['name'])
+                self.port_allocator.release(dic['name'])
+                continue
+            self.__remove_container(ms_model.get_container_name())  # the previous container of the stream
+            container.rename(ms_model.get_container_name())
+            self.port_allocator.transfer(dic['name'], ms_model.get_container_name())
+            ms_model.set_ports(dic['ports'])
+            self.__inc_stat(ms_type, 'hits')
+            logger.info(f'a pool container ({dic["name"]}) has been claimed as {ms_model.get_container_name()} at {datetime.now()}')
+            return container
+
+    def __create(self, ms_type: MediaServerType):
+        name = f'{pool_name_prefix}{ms_type.name.lower()}_{uuid.uuid4().hex[:12]}'
+        ms_model = self.model_factory(ms_type, name)
+        ms_model.container_name = name  # the owner of the allocated ports
+        ms_model.int_ports()
+        self.client.containers.run(ms_model.get_image_name(), detach=True, command=ms_model.get_commands(),
+                                   restart_policy={'Name': 'unless-stopped'}, name=name, ports=ms_model.get_ports())
+        self.connection.rpush(self._get_key(ms_type), json.dumps({'name': name, 'ports': ms_model.get_ports()}))
+        self.__inc_stat(ms_type, 'created')
+
+    def __refill(self, ms_type: MediaServerType):
+        lock_key = f'{self._get_key(ms_type)}:lock'
+        if not self.connection.set(lock_key, os.getpid(), nx=True, ex=300):
+            return  # another process is refilling it
+        try:
+            while self.connection.llen(self._get_key(ms_type)) < self.size:
+                self.__create(ms_type)
+            logger.info(f'media server pool ({ms_type.name}) has been refilled at {datetime.now()}')
+        except BaseException as ex:
+            logger.error(f'an error occurred while refilling media server pool ({ms_type.name}), err: {ex}')
+        finally:
+            self.connection.delete(lock_key)
+
+    def refill_async(self, ms_type: MediaServerType):
+        if self.is_enabled():
+            start_thread(self.__refill, [ms_type])
+
+    # the pool containers are removed with the other media server containers on startup, so their entries are stale
+    def reset(self):
+        for ms_type in MediaServerType:
+            self.connection.delete(self._get_key(ms_type), f'{self._get_key(ms_type)}:lock')
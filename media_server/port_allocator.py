@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import List, Set
+from redis.client import Redis
+
+from common.utilities import logger, config
+
+free_ports_key = 'media_server_free_ports'
+port_owners_key = 'media_server_port_owners'  # port -> owner (container name)
+owner_times_key = 'media_server_port_owner_times'  # owner -> allocation time, the leak reclamation skips the fresh ones
+owner_ports_namespace = 'media_server_ports_of:'  # the ports of an owner
+
+# KEYS: free ports, port owners, owner ports, owner times. ARGV: owner, count, now. returns the ports or an empty list.
+_allocate_script = '''
+local ports = redis.call('SPOP', KEYS[1], ARGV[2])
+if #ports < tonumber(ARGV[2]) then
+    if #ports > 0 then
+        redis.call('SADD', KEYS[1], unpack(ports))
+    end
+    return {}
+end
+for _, port in ipairs(ports) do
+    redis.call('HSET', KEYS[2], port, ARGV[1])
+    redis.call('SADD', KEYS[3], port)
+end
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[3])
+return ports
+'''
+
+# KEYS: free ports, port owners, owner ports, owner times. ARGV: owner. returns the released port count.
+_release_script = '''
+local ports = redis.call('SMEMBERS', KEYS[3])
+local count = 0
+for _, port in ipairs(ports) do
+    if redis.call('HGET', KEYS[2], port) == ARGV[1] then
+        redis.call('HDEL', KEYS[2], port)
+        redis.call('SADD', KEYS[1], port)
+        count = count + 1
+    end
+end
+redis.call('DEL', KEYS[3])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return count
+'''
+
+# KEYS: port owners, old owner ports, new owner ports, owner times. ARGV: old owner, new owner, now. returns the moved port count.
+_transfer_script = '''
+local ports = redis.call('SMEMBERS', KEYS[2])
+for _, port in ipairs(ports) do
+    redis.call('HSET', KEYS[1], port, ARGV[2])
+    redis.call('SADD', KEYS[3], port)
+end
+redis.call('DEL', KEYS[2])
+redis.call('HDEL', KEYS[4], ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[2], ARGV[3])
+return #ports
+'''
+
+
+# keeps the free media server ports in a Redis set, so an allocation is one atomic round trip whatever the fleet size.
+# the owner of the ports is the name of the container which maps them.
+class PortAllocator:
+    def __init__(self, connection: Redis):
+        self.connection: Redis = connection
+        self.allocate_script = connection.register_script(_allocate_script)
+        self.release_script = connection.register_script(_release_script)
+        self.transfer_script = connection.register_script(_transfer_script)
+
+    @staticmethod
+    def _get_owner_key(owner: str) -> str:
+        return f'{owner_ports_namespace}{owner}'
+
+    @staticmethod
+    def get_port_range() -> range:
+        f = config.ffmpeg
+        start = f.ms_port_start if f.ms_port_start > 1024 else 1025
+        end = f.ms_port_end if f.ms_port_end > start else 65535
+        return range(start, min(end, 65535) + 1)
+
+    def reset(self):
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.delete(free_ports_key, port_owners_key, owner_times_key)
+        for key in self.connection.scan_iter(f'{owner_ports_namespace}*'):
+            pipe.delete(key)
+        ports = list(self.get_port_range())
+        for index in range(0, len(ports), 1000):
+            pipe.sadd(free_ports_key, *ports[index:index + 1000])
+        pipe.execute()
+        logger.info(f'media server port allocator has been reset with {len(ports)} ports ({ports[0]}-{ports[-1]})')
+
+    def allocate(self, owner: str, count: int) -> List[int]:
+        keys = [free_ports_key, port_owners_key, self._get_owner_key(owner), owner_times_key]
+        ports = self.allocate_script(keys=keys, args=[owner, count, time.time()])
+        if len(ports) == 0 and not self.connection.exists(free_ports_key, port_owners_key):
+            self.reset()  # i.e. the first run on a fresh database
+            ports = self.allocate_script(keys=keys, args=[owner, count, time.time()])
+        if len(ports) == 0:
+            raise RuntimeError(f'no free media server port is left for {owner}, please increase ms_port_end')
+        return sorted(int(port) for port in ports)
+
+    def release(self, owner: str) -> int:
+        keys = [free_ports_key, port_owners_key, self._get_owner_key(owner), owner_times_key]
+        return int(self.release_script(keys=keys, args=[owner]))
+
+    # the ports of a renamed container, i.e. a claimed pool container
+    def transfer(self, old_owner: str, new_owner: str) -> int:
+        keys = [port_owners_key, self._get_owner_key(old_owner), self._get_owner_key(new_owner), owner_times_key]
+        return int(self.transfer_script(keys=keys, args=[old_owner, new_owner, time.time()]))
+
+    def get_free_count(self) -> int:
+        return self.connection.scard(free_ports_key)
+
+    # the ports of the owners which do not have a container anymore are released. The owners are given a grace period since
+    # the ports are allocated before their container is created.
+    def reclaim(self, container_names: Set[str], grace_period: float = 120.) -> int:
+        now = time.time()
+        count = 0
+        for owner, allocated_at in self.connection.hgetall(owner_times_key).items():
+            owner = owner.decode('utf-8')
+            if owner in container_names or now - float(allocated_at) < grace_period:
+                continue
+            released = self.release(owner)
+            count += released
+            logger.warning(f'{released} leaked media server ports of {owner} have been reclaimed at {datetime.now()}')
+        return count
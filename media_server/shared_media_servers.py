@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+from redis.client import Redis
+
+from common.utilities import logger, config
+from media_server.media_server_models import BaseMediaServerModel
+from media_server.port_allocator import PortAllocator
+from stream.stream_model import MediaServerType
+
+shared_namespace = 'media_server_shared:'  # instance name -> ports per MediaServerType
+shared_streams_namespace = 'media_server_shared_streams:'  # the stream ids of an instance
+shared_assignments_key = 'media_server_shared_assignments'  # stream id -> instance name
+shared_name_prefix = 'msshared_'  # must not start with a media server container prefix, otherwise the watchdog stops them as zombies
+
+# KEYS[1]: lock key, ARGV[1]: the token of the holder
+_unlock_script = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def is_shared_container(container_name: str) -> bool:
+    return container_name.startswith(shared_name_prefix)
+
+
+# a few media server instances serve many sources by their stream paths, instead of a container per camera.
+# A stream is assigned to the least loaded running instance, and a new instance is created once all of them are full.
+class SharedMediaServers:
+    def __init__(self, connection: Redis, client, model_factory: Callable[[MediaServerType, str], BaseMediaServerModel]):
+        self.connection: Redis = connection
+        self.client = client
+        self.model_factory = model_factory  # creates a media server model without allocating its ports
+        self.enabled: bool = config.ffmpeg.ms_shared_enabled
+        self.max_streams: int = max(config.ffmpeg.ms_shared_max_streams, 1)
+        self.port_allocator = PortAllocator(connection)
+        self.lock_ttl: float = 120.  # longer than a container creation
+        self.lock_timeout: float = 60.
+        self.unlock_script = connection.register_script(_unlock_script)
+
+    def is_enabled(self, ms_model: BaseMediaServerModel) -> bool:
+        return self.enabled and ms_model.supports_shared()
+
+    @staticmethod
+    def _get_key(ms_type: MediaServerType) -> str:
+        return f'{shared_namespace}{int(ms_type)}'
+
+    @staticmethod
+    def _get_streams_key(instance_name: str) -> str:
+        return f'{shared_streams_namespace}{instance_name}'
+
+    # the assignments of a type are serialized across the processes, so two starts can not create two half empty instances.
+    # the lock expires if its holder dies, and a waiter gives up after lock_timeout
+    def __lock(self, ms_type: MediaServerType) -> Tuple[str, str]:
+        lock_key = f'{self._get_key(ms_type)}:lock'
+        token = f'{os.getpid()}_{uuid.uuid4().hex}'
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.connection.set(lock_key, token, nx=True, ex=int(self.lock_ttl)):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'shared media server lock ({lock_key}) could not be acquired in {self.lock_timeout} seconds')
+            time.sleep(.1)
+        return lock_key, token
+
+    # an expired lock which has been taken by another process is not deleted
+    def __unlock(self, lock: Tuple[str, str]):
+        self.unlock_script(keys=[lock[0]], args=[lock[1]])
+
+    def __find_container(self, name: str):
+        containers = self.client.containers.list(all=True, filters={'name': f'^/?{name}$'})
+        return containers[0] if len(containers) > 0 else None
+
+    def __drop_instance(self, ms_type: MediaServerType, name: str):
+        self.connection.hdel(self._get_key(ms_type), name)
+        self.connection.delete(self._get_streams_key(name))
+        container = self.__find_container(name)
+        if container is not None:
+            container.stop()
+            container.remove()
+        self.port_allocator.release(name)
+        logger.warning(f'shared media server instance ({name}) has been dropped at {datetime.now()}')
+
+    def __create_instance(self, ms_type: MediaServerType) -> Tuple[str, dict, Any]:
+        name = f'{shared_name_prefix}{ms_type.name.lower()}_{uuid.uuid4().hex[:12]}'
+        ms_model = self.model_factory(ms_type, name)
+        ms_model.container_name = name
+        ms_model.int_ports()
+        container = self.client.containers.run(ms_model.get_image_name(), detach=True, command=ms_model.get_commands(),
+                                               restart_policy={'Name': 'unless-stopped'}, name=name, ports=ms_model.get_ports())
+        ms_model.on_media_server_initialized()
+        self.connection.hset(self._get_key(ms_type), name, json.dumps(ms_model.get_ports()))
+        logger.info(f'a new shared media server instance ({name}) has been created at {datetime.now()}')
+        return name, ms_model.get_ports(), container
+
+    def get_loads(self, ms_type: MediaServerType) -> Dict[str, int]:
+        names = [name.decode('utf-8') for name in self.connection.hkeys(self._get_key(ms_type))]
+        pipe = self.connection.pipeline(transaction=False)
+        for name in names:
+            pipe.scard(self._get_streams_key(name))
+        return dict(zip(names, pipe.execute()))
+
+    # the model is bound to the assigned instance and the stream id becomes its stream path
+    def assign(self, ms_model: BaseMediaServerModel, ms_type: MediaServerType, stream_id: str) -> Any:
+        lock = self.__lock(ms_type)
+        try:
+            # a restarted stream is assigned again, possibly to another instance, so its path is removed from the previous one
+            prev_name = self.connection.hget(shared_assignments_key, stream_id)
+            prev_model = self.create_model(ms_type, stream_id, prev_name.decode('utf-8')) if prev_name is not None else None
+            self.release(stream_id, prev_model)
+            instances = {name.decode('utf-8'): json.loads(ports) for name, ports in self.connection.hgetall(self._get_key(ms_type)).items()}
+            loads = self.get_loads(ms_type)
+            best_name, container = None, None
+            for name in sorted(instances, key=lambda n: loads.get(n, 0)):
+                if loads.get(name, 0) >= self.max_streams:
+                    break
+                candidate = self.__find_container(name)
+                if candidate is None or candidate.status != 'running':
+                    self.__drop_instance(ms_type, name)
+                    continue
+                best_name, container = name, candidate
+                break
+            if best_name is None:
+                best_name, ports, container = self.__create_instance(ms_type)
+                instances[best_name] = ports
+            self.connection.sadd(self._get_streams_key(best_name), stream_id)
+            self.connection.hset(shared_assignments_key, stream_id, best_name)
+        finally:
+            self.__unlock(lock)
+        ms_model.share(best_name, instances[best_name], stream_id)
+        logger.info(f'stream ({stream_id}) has been assigned to the shared media server instance ({best_name})')
+        return container
+
+    # the instance keeps running for the other streams, only the stream path is released
+    def release(self, stream_id: str, ms_model: BaseMediaServerModel | None = None) -> bool:
+        name = self.connection.hget(shared_assignments_key, stream_id)
+        if name is None:
+            return False
+        name = name.decode('utf-8')
+        self.connection.srem(self._get_streams_key(name), stream_id)
+        self.connection.hdel(shared_assignments_key, stream_id)
+        if ms_model is not None:
+            ms_model.on_stream_released()
+        return True
+
+    def create_model(self, ms_type: MediaServerType, stream_id: str, instance_name: str) -> BaseMediaServerModel | None:
+        ports = self.connection.hget(self._get_key(ms_type), instance_name)
+        if ports is None:
+            return None
+        ms_model = self.model_factory(ms_type, stream_id)
+        ms_model.share(instance_name, json.loads(ports), stream_id)
+        return ms_model
+
+    # returns the streams which should be restarted to move from the most loaded instances to the least loaded ones.
+    # the idle instances are stopped, except the last one.
+    def rebalance(self, ms_type: MediaServerType, max_moves: int) -> List[str]:
+        loads = self.get_loads(ms_type)
+        for name in [name for name, load in loads.items() if load == 0][:max(len(loads) - 1, 0)]:
+            lock = self.__lock(ms_type)
+            try:
+                if self.connection.scard(self._get_streams_key(name)) == 0:
+                    self.__drop_instance(ms_type, name)
+                    loads.pop(name)
+            finally:
+                self.__unlock(lock)
+        moves: List[str] = []
+        if len(loads) < 2:
+            return moves
+        while len(moves) < max_moves:
+            most = max(loads, key=loads.get)
+            least = min(loads, key=loads.get)
+            if loads[most] - loads[least] <= 1:
+                break
+            stream_ids = [stream_id.decode('utf-8') for stream_id in self.connection.srandmember(self._get_streams_key(most), max_moves)]
+            candidates = [stream_id for stream_id in stream_ids if stream_id not in moves]
+            if len(candidates) == 0:
+                break
+            moves.append(candidates[0])
+            loads[most] -= 1
+            loads[least] += 1
+        return moves
+
+    # the instances are removed with the other media server containers on startup
+    def reset(self):
+        for ms_type in MediaServerType:
+            for name in self.connection.hkeys(self._get_key(ms_type)):
+                self.connection.delete(self._get_streams_key(name.decode('utf-8')))
+            self.connection.delete(self._get_key(ms_type), f'{self._get_key(ms_type)}:lock')
+        self.connection.delete(shared_assignments_key)
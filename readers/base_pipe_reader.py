@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import pybase64
 import json
 from abc import ABC, abstractmethod
@@ -11,6 +13,7 @@ from PIL import Image
 
 from common.event_bus.event_bus import EventBus
 from common.utilities import logger
+from readers.shm_frame_buffer import SharedMemoryFrameBuffer, get_shm_name
 from utils.json_serializer import serialize_json_dic
 from utils.utils import start_thread
 
@@ -18,6 +21,7 @@ from utils.utils import start_thread
 class PushMethod(IntEnum):
     REDIS_PUBSUB = 0
     REST_API = 1
+    SHARED_MEMORY = 2  # frames are written into a per-source ring buffer, only a small descriptor is published over Redis
 
 
 class PipeReaderOptions:
@@ -31,12 +35,14 @@ class PipeReaderOptions:
     width: int = 0
     height: int = 0
     ai_clip_enabled: bool = False
+    shm_slot_count: int = 8
 
 
 class BasePipeReader(ABC):
     def __init__(self, options: PipeReaderOptions):
         self.options: PipeReaderOptions = options
-        self.event_bus = EventBus(options.pubsub_channel) if self.options.method == PushMethod.REDIS_PUBSUB else None
+        self.event_bus = EventBus(options.pubsub_channel) if self.options.method != PushMethod.REST_API else None
+        self.frame_buffer: SharedMemoryFrameBuffer | None = None
         self.has_external_scale = options.width > 0 and options.height > 0
         if not self.has_external_scale:
             probe = ffmpeg.probe(options.address)
@@ -80,7 +86,30 @@ class BasePipeReader(ABC):
         img_str = pybase64.b64encode(buffered.getvalue()).decode()
         return img_str
 
+    # the buffer is created lazily by the process which writes the frames since MpFFmpegPipeReader sends them from its owner process.
+    def __send_shared_memory(self, img_data: np.array):
+        if self.frame_buffer is None:
+            self.frame_buffer = SharedMemoryFrameBuffer.create(get_shm_name(self.options.id), self.options.shm_slot_count, self.packet_size,
+                                                               self.cl_channels)
+        slot, seq, timestamp = self.frame_buffer.write(img_data)
+        dic = {'name': self.options.name, 'source_id': self.options.id, 'ai_clip_enabled': self.options.ai_clip_enabled,
+               'shm_name': self.frame_buffer.name, 'slot': slot, 'seq': seq, 'timestamp': timestamp,
+               'width': img_data.shape[1], 'height': img_data.shape[0], 'channels': self.cl_channels}
+        self.event_bus.publish_async(serialize_json_dic(dic))
+
+    def _release_frame_buffer(self):
+        if self.options.method != PushMethod.SHARED_MEMORY:
+            return
+        if self.frame_buffer is not None:
+            self.frame_buffer.unlink()
+            self.frame_buffer = None
+        else:
+            SharedMemoryFrameBuffer.unlink_by_name(get_shm_name(self.options.id))
+
     def send(self, img_data):
+        if self.options.method == PushMethod.SHARED_MEMORY:
+            self.__send_shared_memory(img_data)
+            return
         img_str = self.__create_base64_img(img_data)
         dic = {'name': self.options.name, 'base64_image': img_str, 'source_id': self.options.id, 'ai_clip_enabled': self.options.ai_clip_enabled}
         if self.options.method == PushMethod.REDIS_PUBSUB:
@@ -23,6 +23,7 @@ class FFmpegPipeReader(BasePipeReader):
 
     def close(self):
         self.process.terminate()
+        self._release_frame_buffer()
 
     def get_pid(self) -> int:
         return self.process.pid
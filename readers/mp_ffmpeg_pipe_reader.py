@@ -59,6 +59,7 @@ class MpFFmpegPipeReader(BasePipeReader):
         self.process.terminate()
         if self.owner_proc is not None:
             self.owner_proc.kill()
+        self._release_frame_buffer()
 
     def get_pid(self) -> int:
         return self.process.pid
@@ -70,12 +71,9 @@ class MpFFmpegPipeReader(BasePipeReader):
             time.sleep(7.)  # otherwise mp_ffmpeg_reader_owner_pid won't be set due to the delay of the process creation by start stream handler
             main_conn = crate_redis_connection(RedisDb.MAIN)
             rep = StreamRepository(main_conn)
-            stream_model = rep.get(self.options.id)
-            if stream_model is None:
+            if rep.update_fields(self.options.id, mp_ffmpeg_reader_owner_pid=os.getppid()) == 0:
                 logger.error(f'camera ({self.options.id}/{self.options.name}) could not be found in the database, MultiProcessFFmpegPipeReader is now exiting')
                 return
-            stream_model.mp_ffmpeg_reader_owner_pid = os.getppid()
-            rep.add(stream_model)
             while not me.is_closed():
                 np_img = me.get_img()
                 if np_img is None:
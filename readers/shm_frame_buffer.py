@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from common.utilities import logger
+
+# buffer header: slot_count, frame_capacity, channels, last written sequence number
+_HEADER = struct.Struct('<IIIQ')
+_HEADER_SIZE = 64
+# slot header: sequence number (0 while the slot is being written), timestamp, width, height, channels
+_SLOT_HEADER = struct.Struct('<QdIII')
+_SLOT_HEADER_SIZE = 32
+
+
+def get_shm_name(source_id: str) -> str:
+    return f'ffrs_{source_id}'
+
+
+# a single writer ring buffer in shared memory. Consumers on the same host attach it by name and map the frame with zero copies
+# by using the slot which is published over Redis. A slot is consistent if its sequence number is unchanged after the frame has been used.
+class SharedMemoryFrameBuffer:
+    def __init__(self, shm: shared_memory.SharedMemory, slot_count: int, frame_capacity: int, channels: int):
+        self.shm = shm
+        self.name: str = shm.name
+        self.slot_count: int = slot_count
+        self.frame_capacity: int = frame_capacity
+        self.channels: int = channels
+        self.slot_size: int = _SLOT_HEADER_SIZE + frame_capacity
+        self.seq: int = 0
+
+    @staticmethod
+    def __get_size(slot_count: int, frame_capacity: int) -> int:
+        return _HEADER_SIZE + slot_count * (_SLOT_HEADER_SIZE + frame_capacity)
+
+    @staticmethod
+    def create(name: str, slot_count: int, frame_capacity: int, channels: int = 3) -> SharedMemoryFrameBuffer:
+        slot_count = max(slot_count, 2)
+        size = SharedMemoryFrameBuffer.__get_size(slot_count, frame_capacity)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # a previous reader of the same source was killed before it could release its buffer
+            logger.warning(f'a previous shared memory frame buffer ({name}) has been found and will be recreated')
+            SharedMemoryFrameBuffer.unlink_by_name(name)
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        _HEADER.pack_into(shm.buf, 0, slot_count, frame_capacity, channels, 0)
+        return SharedMemoryFrameBuffer(shm, slot_count, frame_capacity, channels)
+
+    @staticmethod
+    def attach(name: str) -> SharedMemoryFrameBuffer:
+        shm = shared_memory.SharedMemory(name=name)
+        slot_count, frame_capacity, channels, last_seq = _HEADER.unpack_from(shm.buf, 0)
+        buffer = SharedMemoryFrameBuffer(shm, slot_count, frame_capacity, channels)
+        buffer.seq = last_seq
+        return buffer
+
+    @staticmethod
+    def unlink_by_name(name: str):
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        except BaseException as ex:
+            logger.error(f'an error occurred while unlinking the shared memory frame buffer ({name}), err: {ex}')
+
+    def __get_slot_offset(self, slot: int) -> int:
+        return _HEADER_SIZE + slot * self.slot_size
+
+    def write(self, img: np.array) -> (int, int, float):
+        height, width = img.shape[0], img.shape[1]
+        data = img.reshape(-1)
+        if data.nbytes > self.frame_capacity:
+            raise ValueError(f'frame size ({data.nbytes}) exceeds the shared memory slot capacity ({self.frame_capacity})')
+        self.seq += 1
+        slot = self.seq % self.slot_count
+        offset = self.__get_slot_offset(slot)
+        timestamp = time.time()
+        buf = self.shm.buf
+        _SLOT_HEADER.pack_into(buf, offset, 0, timestamp, width, height, self.channels)
+        frame_offset = offset + _SLOT_HEADER_SIZE
+        np.frombuffer(buf, np.uint8, data.nbytes, frame_offset)[:] = data
+        _SLOT_HEADER.pack_into(buf, offset, self.seq, timestamp, width, height, self.channels)
+        _HEADER.pack_into(buf, 0, self.slot_count, self.frame_capacity, self.channels, self.seq)
+        return slot, self.seq, timestamp
+
+    def read_slot_header(self, slot: int) -> (int, float, int, int, int):
+        return _SLOT_HEADER.unpack_from(self.shm.buf, self.__get_slot_offset(slot))
+
+    # returns a view over the shared memory, it is valid as long as read_slot_header(slot) returns the same sequence number.
+    def read(self, slot: int) -> (int, float, np.array):
+        seq, timestamp, width, height, channels = self.read_slot_header(slot)
+        frame_offset = self.__get_slot_offset(slot) + _SLOT_HEADER_SIZE
+        img = np.frombuffer(self.shm.buf, np.uint8, width * height * channels, frame_offset).reshape([height, width, channels])
+        return seq, timestamp, img
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BaseException as ex:
+            logger.error(f'an error occurred while closing the shared memory frame buffer ({self.name}), err: {ex}')
+
+    def unlink(self):
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,77 @@
+import os
+import uuid
+from datetime import datetime
+from os import path
+
+from common.data.redis_mapper import RedisMapper
+from common.event_bus.event_bus import EventBus
+from common.event_bus.event_handler import EventHandler
+from common.utilities import logger
+from record.clip_exporter import ClipExporter
+from record.req_resp import ClipExportRequestEvent, ClipExportResponseEvent
+from stream.stream_repository import StreamRepository
+from utils.dir import str_to_datetime
+from utils.json_serializer import serialize_json
+
+
+class ClipExportEventHandler(EventHandler):
+    def __init__(self, stream_repository: StreamRepository):
+        self.stream_repository = stream_repository
+        self.exporter = ClipExporter(stream_repository.get_connection())
+        self.event_bus = EventBus('clip_export_response')
+        logger.info(f'ClipExportEventHandler: initialized at {datetime.now()}')
+
+    def __publish(self, response: ClipExportResponseEvent):
+        self.event_bus.publish_async(serialize_json(response))
+
+    def __publish_error(self, response: ClipExportResponseEvent, error: str):
+        logger.warning(f'clip export ({response.id}) of {response.source_id} has failed, err: {error}')
+        response.done = True
+        response.error = error
+        self.__publish(response)
+
+    def handle(self, dic: dict):
+        if RedisMapper.is_pubsub_message_invalid(dic):
+            return
+        logger.info(f'ClipExportEventHandler handle called at {datetime.now()}')
+
+        mapper = RedisMapper(ClipExportRequestEvent())
+        request: ClipExportRequestEvent = mapper.from_redis_pubsub(dic)
+        response = ClipExportResponseEvent()
+        response.id = request.id or uuid.uuid4().hex
+        response.source_id = request.source_id
+        stream_model = self.stream_repository.get(request.source_id)
+        if stream_model is None:
+            self.__publish_error(response, f'stream({request.source_id}) was not found')
+            return
+        start, end = str_to_datetime(request.start), str_to_datetime(request.end)
+        if start is None or end is None or start >= end:
+            self.__publish_error(response, f'the time range ({request.start} - {request.end}) is invalid')
+            return
+
+        segments = self.exporter.find_segments(stream_model, start, end)
+        if len(segments) == 0:
+            self.__publish_error(response, f'no record segment was found between {start} and {end}')
+            return
+        response.segment_count = len(segments)
+        response.output_file_name = request.output_file_name or self.exporter.get_default_output_file_name(stream_model, start, end)
+
+        def on_progress(progress: float):
+            response.progress = round(progress, 2)
+            self.__publish(response)
+
+        error, duration = self.exporter.export(stream_model, segments, start, end, response.output_file_name, on_progress)
+        if len(error) > 0:
+            if path.isfile(response.output_file_name):
+                try:
+                    os.remove(response.output_file_name)
+                except BaseException as ex:
+                    logger.error(f'an error occurred while deleting a failed clip, err: {ex}')
+            self.__publish_error(response, error)
+            return
+        response.progress = 100.
+        response.done = True
+        response.succeeded = True
+        response.duration = duration
+        self.__publish(response)
+        logger.info(f'clip export ({response.id}) of {response.source_id} has been completed ({response.output_file_name}) at {datetime.now()}')
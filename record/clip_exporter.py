@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import os
+import stat
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from os import path
+from pathlib import Path
+from typing import Callable, List, Tuple
+from redis.client import Redis
+
+from common.data.source_model import RecordFileTypes
+from common.utilities import logger
+from record.media_duration import get_media_info, MediaInfo
+from record.segment_catalog import SegmentCatalog, SegmentModel
+from record.video_file_indexer import VideoFileIndexer
+from stream.stream_model import StreamModel
+from utils.dir import get_record_dir_by, get_sorted_valid_files, filename_to_datetime, create_dir_if_not_exists, TimeIndex
+
+clip_export_pids_key = 'clip_export_pids'  # the watchdog does not kill them as zombie FFmpeg processes
+_pipe_formats = {RecordFileTypes.MP4: 'mp4', RecordFileTypes.WEBM: 'webm', RecordFileTypes.MKV: 'matroska', RecordFileTypes.FLV: 'flv',
+                 RecordFileTypes.AVI: 'avi', RecordFileTypes.MPG: 'mpeg', RecordFileTypes.OGV: 'ogg'}
+
+
+# exports a time range of a source without re-encoding. Only the overlapping segments are given to the concat demuxer, the first and
+# the last ones are cut by the inpoint / outpoint directives, so the clip is written by stream copying the needed ranges.
+# The cuts snap to the key frames since there is no re-encoding.
+class ClipExporter:
+    def __init__(self, connection: Redis):
+        self.connection: Redis = connection
+
+    # the indexed segments are looked up in the catalog if it is enabled, otherwise the hour directories of the range are scanned
+    def find_segments(self, stream_model: StreamModel, start: datetime, end: datetime) -> List[SegmentModel]:
+        catalog = SegmentCatalog.get_instance()
+        if catalog is not None:
+            segments = catalog.query(stream_model.id, start, end)
+            missing = [segment.path for segment in segments if not path.isfile(segment.path)]
+            if len(missing) > 0:  # deleted by the retention, see SegmentCatalog.remove_missing
+                catalog.remove_all(missing)
+                segments = [segment for segment in segments if segment.path not in missing]
+            if len(segments) > 0:
+                return segments
+        return self.__scan_segments(stream_model, start, end)
+
+    # the merge output of an hour is named by its hour, i.e. 2023_04_18_19.mp4, the segments are named by their start seconds
+    @staticmethod
+    def __is_merged_file(filename: str) -> bool:
+        return len(Path(filename).stem.split('_')) == 4
+
+    @staticmethod
+    def __scan_segments(stream_model: StreamModel, start: datetime, end: datetime) -> List[SegmentModel]:
+        ext = '.' + RecordFileTypes.str(stream_model.record_file_type)
+        record_dir = get_record_dir_by(stream_model)
+        filenames: List[str] = []
+        hour = start.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)  # a segment which has started in the previous hour
+        while hour < end:
+            ti = TimeIndex()
+            ti.set_values(hour)
+            hour_dir = ti.get_indexed_path(record_dir)
+            if path.isdir(hour_dir):
+                filenames.extend(get_sorted_valid_files(hour_dir, ext))
+            hour += timedelta(hours=1)
+        segments: List[SegmentModel] = []
+        for index, filename in enumerate(filenames):
+            segment_start = filename_to_datetime(filename)
+            if segment_start is None:
+                continue
+            info = get_media_info(filename, stream_model.record_file_type)
+            segment = SegmentModel()
+            segment.source_id = stream_model.id
+            segment.path = filename
+            segment.start_ts = segment_start.timestamp()
+            if info is None and ClipExporter.__is_merged_file(filename):
+                # i.e. a fragmented mp4 which keeps its duration in the fragments, it spans up to an hour, not a segment interval
+                probe_results = VideoFileIndexer.check_by_ffprobe(stream_model, [filename], delete_corrupted=False)
+                if len(probe_results) > 0:
+                    info = MediaInfo(float(probe_results[0].duration), probe_results[0].codec)
+            if info is not None:
+                segment.duration, segment.codec = info.duration, info.codec
+            elif index + 1 < len(filenames) and filename_to_datetime(filenames[index + 1]) is not None:
+                segment.duration = filename_to_datetime(filenames[index + 1]).timestamp() - segment.start_ts
+            else:
+                segment.duration = stream_model.record_segment_interval * 60.
+            if segment.start_ts < end.timestamp() and segment.start_ts + segment.duration > start.timestamp():
+                segments.append(segment)
+        return segments
+
+    @staticmethod
+    def __write_concat_list(segments: List[SegmentModel], start: datetime, end: datetime) -> Tuple[str, float]:
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        duration = 0.
+        fd, list_path = tempfile.mkstemp(prefix='clip_', suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write('ffconcat version 1.0\n')
+            for segment in segments:
+                escaped = segment.path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+                inpoint = max(start_ts - segment.start_ts, 0.)
+                outpoint = min(end_ts - segment.start_ts, segment.duration)
+                if inpoint > 0:
+                    f.write(f'inpoint {inpoint:.3f}\n')
+                if outpoint < segment.duration:
+                    f.write(f'outpoint {outpoint:.3f}\n')
+                duration += max(outpoint - inpoint, 0.)
+        return list_path, duration
+
+    @staticmethod
+    def __create_args(stream_model: StreamModel, list_path: str, output_file_name: str) -> List[str]:
+        args: List[str] = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', '-f', 'concat', '-safe', '0',
+                           '-i', list_path, '-c', 'copy', '-avoid_negative_ts', 'make_zero']
+        if path.exists(output_file_name) and stat.S_ISFIFO(os.stat(output_file_name).st_mode):
+            # a pipe is not seekable, so the muxer needs to be given and mp4 is written as fragmented
+            pipe_format = _pipe_formats.get(stream_model.record_file_type, 'matroska')
+            args.extend(['-f', pipe_format])
+            if pipe_format == 'mp4':
+                args.extend(['-movflags', 'frag_keyframe+empty_moov'])
+        args.extend(['-y', output_file_name])
+        return args
+
+    def get_default_output_file_name(self, stream_model: StreamModel, start: datetime, end: datetime) -> str:
+        clips_dir = path.join(get_record_dir_by(stream_model), 'clips')
+        create_dir_if_not_exists(clips_dir)
+        ext = RecordFileTypes.str(stream_model.record_file_type)
+        return path.join(clips_dir, f'{start.strftime("%Y_%m_%d_%H_%M_%S")}-{end.strftime("%Y_%m_%d_%H_%M_%S")}.{ext}')
+
+    # returns the error, an empty string if it has succeeded, and the duration of the written clip by the last out_time_us of FFmpeg
+    # since the cuts snap to the key frames. on_progress is called with the percentage at most once a second
+    def export(self, stream_model: StreamModel, segments: List[SegmentModel], start: datetime, end: datetime, output_file_name: str,
+               on_progress: Callable[[float], None]) -> Tuple[str, float]:
+        list_path, clip_duration = self.__write_concat_list(segments, start, end)
+        proc = None
+        try:
+            args = self.__create_args(stream_model, list_path, output_file_name)
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.connection.sadd(clip_export_pids_key, proc.pid)
+            logger.info(f'a clip export subprocess ({proc.pid}) has been opened for {stream_model.id} at {datetime.now()}')
+            last_published_at = 0.
+            out_time = 0.
+            for line in proc.stdout:
+                key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+                if key != 'out_time_us' or not value.isdigit():
+                    continue
+                out_time = int(value) / 1e6  # the final progress block is written at the end with the whole duration
+                if clip_duration > 0 and time.monotonic() - last_published_at >= 1.:
+                    last_published_at = time.monotonic()
+                    on_progress(min(out_time / clip_duration * 100., 99.))
+            stderr = proc.stderr.read().decode('utf-8', errors='replace').strip()
+            proc.wait()
+            if proc.returncode != 0:
+                return stderr or f'FFmpeg has exited with {proc.returncode}', out_time
+            return '', out_time
+        finally:
+            if proc is not None:
+                self.connection.srem(clip_export_pids_key, proc.pid)
+            try:
+                os.remove(list_path)
+            except BaseException as ex:
+                logger.error(f'an error occurred while deleting the clip concat list, err: {ex}')
@@ -15,7 +15,7 @@ class ConcatDemuxer:
     def __init__(self, stream_repository: StreamRepository):
         self.stream_repository = stream_repository
 
-    def concatenate(self, source_id: str, filenames: List[str], output_filename: str) -> subprocess.Popen | None:
+    def concatenate(self, source_id: str, filenames: List[str], output_filename: str, output_args: List[str] | None = None) -> subprocess.Popen | None:
         if len(filenames) == 0:
             return None
 
@@ -28,13 +28,13 @@ class ConcatDemuxer:
 
         proc = None
         try:
-            args: List[str] = ['ffmpeg', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_txt_path, '-c', 'copy', '-y', output_filename]
+            args: List[str] = ['ffmpeg', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_txt_path, '-c', 'copy']
+            if output_args:
+                args.extend(output_args)
+            args.extend(['-y', output_filename])
             proc = subprocess.Popen(args, stderr=subprocess.PIPE)
             logger.info(f'a concat demuxer subprocess has been opened at {datetime.now()}')
-            stream_model = self.stream_repository.get(source_id)
-            stream_model.concat_demuxer_args = ' '.join(args)
-            stream_model.concat_demuxer_pid = proc.pid
-            self.stream_repository.add(stream_model)
+            self.stream_repository.update_fields(source_id, concat_demuxer_args=' '.join(args), concat_demuxer_pid=proc.pid)
             proc.wait()
         finally:
             try:
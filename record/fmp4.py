@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+# the helpers of the incremental merge over fragmented mp4 files, which are ftyp + moov (the init segment) + moof / mdat pairs.
+# The fragments of a new file are appended to a merged file as they are, only their sequence numbers and decode times are shifted.
+# FFmpeg starts the decode times (tfdt) of an empty_moov file from 0 whatever -output_ts_offset is, so they are shifted here.
+
+_fragment_boxes = {b'moof', b'mdat'}  # ftyp, moov and the mfra trailer of the appended file are skipped
+_copy_chunk_size = 1024 * 1024
+
+
+def iter_boxes(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int, int]]:
+    # yields (type, box start, data start, box end)
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            raise ValueError(f'invalid mp4 box ({box_type}) at {position}')
+        yield box_type, position, position + header_size, position + size
+        position += size
+
+
+def __find_child(f: BinaryIO, box_type: bytes, start: int, end: int) -> Tuple[int, int] | None:
+    for child_type, _, data_start, box_end in iter_boxes(f, start, end):
+        if child_type == box_type:
+            return data_start, box_end
+    return None
+
+
+# the appended fragments can be decoded by the init segment of the merged file only if their tracks, timescales and sample descriptions
+# are the same, i.e. a camera whose resolution has been changed needs a full merge.
+def get_init_signature(filename: str) -> str:
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        moov = __find_child(f, b'moov', 0, end)
+        if moov is None:
+            raise ValueError(f'no moov box was found in {filename}')
+        for box_type, _, trak_start, trak_end in iter_boxes(f, moov[0], moov[1]):
+            if box_type != b'trak':
+                continue
+            tkhd = __find_child(f, b'tkhd', trak_start, trak_end)
+            mdia = __find_child(f, b'mdia', trak_start, trak_end)
+            if tkhd is None or mdia is None:
+                raise ValueError(f'an invalid trak box was found in {filename}')
+            f.seek(tkhd[0])
+            version = f.read(4)[0]
+            f.seek(16 if version == 1 else 8, os.SEEK_CUR)
+            sha.update(f.read(4))  # track_ID
+            mdhd = __find_child(f, b'mdhd', mdia[0], mdia[1])
+            minf = __find_child(f, b'minf', mdia[0], mdia[1])
+            stbl = __find_child(f, b'stbl', minf[0], minf[1]) if minf is not None else None
+            stsd = __find_child(f, b'stsd', stbl[0], stbl[1]) if stbl is not None else None
+            if mdhd is None or stsd is None:
+                raise ValueError(f'an invalid mdia box was found in {filename}')
+            f.seek(mdhd[0])
+            version = f.read(4)[0]
+            f.seek(16 if version == 1 else 8, os.SEEK_CUR)
+            sha.update(f.read(4))  # timescale
+            f.seek(stsd[0])
+            sha.update(f.read(stsd[1] - stsd[0]))
+    return sha.hexdigest()
+
+
+class TrackFragment:
+    def __init__(self):
+        self.track_id: int = 0
+        self.decode_time_position: int = -1  # the position of the base media decode time in the moof, -1 if there is no tfdt
+        self.decode_time_version: int = 0  # the decode time is 32-bit in version 0 and 64-bit in version 1
+        self.decode_time: int = 0  # in the timescale of the track
+        self.duration: int = 0  # the sum of the sample durations in the timescale of the track
+
+
+def __iter_children(moof: bytes | bytearray, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    # yields (type, data start, box end) of the boxes in a moof which has been read as a whole
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', moof, position)
+        if size < 8 or position + size > end:
+            raise ValueError(f'invalid mp4 box ({box_type}) in a moof')
+        yield box_type, position + 8, position + size
+        position += size
+
+
+# default_durations are the default sample durations of the tracks (trex), they are used if neither tfhd nor trun has a duration
+def __parse_track_fragments(moof: bytes | bytearray, default_durations: Dict[int, int]) -> List[TrackFragment]:
+    fragments: List[TrackFragment] = []
+    for box_type, traf_start, traf_end in __iter_children(moof, 8, len(moof)):
+        if box_type != b'traf':
+            continue
+        fragment = TrackFragment()
+        default_duration = 0
+        for child_type, data_start, _ in __iter_children(moof, traf_start, traf_end):
+            version = moof[data_start]
+            flags = struct.unpack_from('>I', moof, data_start)[0] & 0xFFFFFF
+            if child_type == b'tfhd':  # it is the first box of a traf
+                fragment.track_id = struct.unpack_from('>I', moof, data_start + 4)[0]
+                default_duration = default_durations.get(fragment.track_id, 0)
+                if flags & 0x8:  # default-sample-duration-present, after the base data offset and the sample description index
+                    position = data_start + 8 + (8 if flags & 0x1 else 0) + (4 if flags & 0x2 else 0)
+                    default_duration = struct.unpack_from('>I', moof, position)[0]
+            elif child_type == b'tfdt':
+                fragment.decode_time_position = data_start + 4
+                fragment.decode_time_version = version
+                fragment.decode_time = struct.unpack_from('>Q' if version == 1 else '>I', moof, data_start + 4)[0]
+            elif child_type == b'trun':
+                sample_count = struct.unpack_from('>I', moof, data_start + 4)[0]
+                if not flags & 0x100:  # sample-duration-present
+                    fragment.duration += sample_count * default_duration
+                    continue
+                position = data_start + 8 + (4 if flags & 0x1 else 0) + (4 if flags & 0x4 else 0)
+                sample_size = 4 * bin(flags & 0xF00).count('1')  # duration, size, flags and composition time offset
+                for index in range(sample_count):
+                    fragment.duration += struct.unpack_from('>I', moof, position + index * sample_size)[0]
+        fragments.append(fragment)
+    return fragments
+
+
+def __get_default_durations(f: BinaryIO, moov: Tuple[int, int]) -> Dict[int, int]:
+    durations: Dict[int, int] = {}
+    mvex = __find_child(f, b'mvex', moov[0], moov[1])
+    if mvex is None:
+        return durations
+    for box_type, _, data_start, _ in list(iter_boxes(f, mvex[0], mvex[1])):
+        if box_type == b'trex':
+            f.seek(data_start + 4)
+            track_id, _, default_duration = struct.unpack('>III', f.read(12))
+            durations[track_id] = default_duration
+    return durations
+
+
+# returns the end decode time of each track by track_ID, which is the decode time of its last fragment plus the durations of its samples.
+# These are the decode time offsets of the fragments which are appended to the file.
+def get_track_ends(filename: str) -> Dict[int, int]:
+    ends: Dict[int, int] = {}
+    with open(filename, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        moov = __find_child(f, b'moov', 0, end)
+        if moov is None:
+            raise ValueError(f'no moov box was found in {filename}')
+        default_durations = __get_default_durations(f, moov)
+        for box_type, box_start, _, box_end in list(iter_boxes(f, 0, end)):
+            if box_type != b'moof':
+                continue
+            f.seek(box_start)
+            for fragment in __parse_track_fragments(f.read(box_end - box_start), default_durations):
+                ends[fragment.track_id] = max(ends.get(fragment.track_id, 0), fragment.decode_time + fragment.duration)
+    return ends
+
+
+def __shift_decode_times(moof: bytearray, decode_time_offsets: Dict[int, int]):
+    for fragment in __parse_track_fragments(moof, {}):
+        if fragment.decode_time_position < 0:
+            raise ValueError(f'a fragment of the track {fragment.track_id} has no tfdt')
+        if fragment.track_id not in decode_time_offsets:
+            raise ValueError(f'the track {fragment.track_id} has no fragment to be appended to')
+        decode_time = fragment.decode_time + decode_time_offsets[fragment.track_id]
+        if fragment.decode_time_version == 1:
+            struct.pack_into('>Q', moof, fragment.decode_time_position, decode_time)
+        elif decode_time <= 0xFFFFFFFF:
+            struct.pack_into('>I', moof, fragment.decode_time_position, decode_time)
+        else:
+            raise ValueError(f'the decode time of the track {fragment.track_id} overflows its tfdt')
+
+
+def __shift_sequence_number(moof: bytearray, sequence_offset: int):
+    position = 8
+    while position + 8 <= len(moof):
+        size, box_type = struct.unpack_from('>I4s', moof, position)
+        if size < 8:
+            break
+        if box_type == b'mfhd':
+            sequence_number = struct.unpack_from('>I', moof, position + 12)[0]
+            struct.pack_into('>I', moof, position + 12, (sequence_number + sequence_offset) & 0xFFFFFFFF)
+            return
+        position += size
+
+
+# appends the fragments of src to dst and returns the appended fragment count. decode_time_offsets are the track ends of dst, see
+# get_track_ends. The caller commits by its own state and rolls back a failed append, see IncrementalMerger.
+def append_fragments(src_filename: str, dst_filename: str, sequence_offset: int, decode_time_offsets: Dict[int, int]) -> int:
+    count = 0
+    with open(src_filename, 'rb') as src, open(dst_filename, 'ab') as dst:
+        end = src.seek(0, os.SEEK_END)
+        for box_type, box_start, _, box_end in list(iter_boxes(src, 0, end)):
+            if box_type not in _fragment_boxes:
+                continue
+            src.seek(box_start)
+            if box_type == b'moof':
+                moof = bytearray(src.read(box_end - box_start))
+                __shift_sequence_number(moof, sequence_offset)
+                __shift_decode_times(moof, decode_time_offsets)
+                dst.write(moof)
+                count += 1
+            else:
+                remaining = box_end - box_start
+                while remaining > 0:
+                    chunk = src.read(min(_copy_chunk_size, remaining))
+                    if not chunk:
+                        raise ValueError(f'{src_filename} has been truncated')
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    return count
+
+
+def count_fragments(filename: str) -> int:
+    with open(filename, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        return sum(1 for box_type, _, _, _ in iter_boxes(f, 0, end) if box_type == b'moof')
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime
+from os import path
+from typing import Callable, List
+
+from common.data.source_model import RecordFileTypes
+from common.utilities import logger
+from record.concat_demuxer import ConcatDemuxer
+from record.fmp4 import get_init_signature, append_fragments, count_fragments, iter_boxes, get_track_ends
+
+# the merged file is written as a fragmented mp4, bitexact and without the metadata, so the init segments of the merges are comparable
+_fragmented_args = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof+skip_trailer', '-fflags', '+bitexact', '-map_metadata', '-1',
+                     '-f', 'mp4']
+
+
+class MergeState:
+    def __init__(self):
+        self.committed_size: int = 0  # the bytes after this size are the leftovers of an interrupted append
+        self.fragment_index: int = 0  # the sequence number of the last appended fragment
+        self.signature: str = ''  # see get_init_signature
+        self.segments: List[str] = []  # the base names of the merged segments, they are deleted if a crash has left them
+        self.updated_at: str = ''
+
+
+# appends the new segments of an hour to its merged file instead of concatenating the whole hour again, so a merge writes only the new data.
+# The new segments are concatenated into a fragmented temp file, then its fragments are appended to the merged file with their decode
+# times shifted by the track ends of the merged file, see get_track_ends.
+# A merge is committed by a sidecar state which is written as pending first. A pending state whose size matches the merged file is
+# promoted, otherwise the merged file is truncated back to the committed size.
+class IncrementalMerger:
+    def __init__(self, cd: ConcatDemuxer, has_error: Callable[[object], bool]):
+        self.cd = cd
+        self.has_error = has_error
+
+    @staticmethod
+    def is_supported(record_file_type: RecordFileTypes) -> bool:
+        return record_file_type == RecordFileTypes.MP4  # appending Matroska clusters needs the segment size and the cues to be rewritten
+
+    @staticmethod
+    def __get_hidden_path(output_file: str, suffix: str) -> str:
+        # hidden, so they are not listed as the record files of the hour
+        return path.join(path.dirname(output_file), f'.{path.basename(output_file)}{suffix}')
+
+    @staticmethod
+    def __load_state(state_path: str) -> MergeState | None:
+        if not path.exists(state_path):
+            return None
+        try:
+            with open(state_path, 'r') as f:
+                state = MergeState()
+                state.__dict__.update(json.load(f))
+                return state
+        except BaseException as ex:
+            logger.error(f'an error occurred while loading the merge state ({state_path}), err: {ex}')
+            return None
+
+    @staticmethod
+    def __save_state(state: MergeState, state_path: str):
+        state.updated_at = datetime.now().isoformat()
+        tmp_path = f'{state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state.__dict__, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_path)
+
+    @staticmethod
+    def __remove(filename: str):
+        try:
+            if path.exists(filename):
+                os.remove(filename)
+        except BaseException as ex:
+            logger.error(f'an error occurred while deleting a merge file ({filename}), err: {ex}')
+
+    # returns the committed state of the merged file, None if it has to be merged from scratch
+    def __recover(self, output_file: str, state_path: str, pending_path: str) -> MergeState | None:
+        pending = self.__load_state(pending_path)
+        if pending is not None:
+            if path.exists(output_file) and path.getsize(output_file) == pending.committed_size:
+                os.replace(pending_path, state_path)  # the merge had been completed before the crash
+                logger.warning(f'a pending merge state of {output_file} has been committed')
+            else:
+                self.__remove(pending_path)
+        if not path.exists(output_file):
+            self.__remove(state_path)
+            return None
+        state = self.__load_state(state_path)
+        if state is None:
+            return None
+        size = path.getsize(output_file)
+        if size < state.committed_size:
+            logger.error(f'merged file ({output_file}) is shorter than its committed size, it will be merged from scratch')
+            return None
+        if size > state.committed_size:
+            os.truncate(output_file, state.committed_size)
+            logger.warning(f'an interrupted append to {output_file} has been rolled back ({size - state.committed_size} bytes)')
+        return state
+
+    def __concatenate(self, source_id: str, filenames: List[str], output_file: str, output_args: List[str]) -> bool:
+        proc = None
+        try:
+            proc = self.cd.concatenate(source_id, filenames, output_file, output_args)
+            return proc is not None and not self.has_error(proc)
+        finally:
+            try:
+                if proc is not None:
+                    proc.terminate()
+            except BaseException as ex:
+                logger.error(f'an error occurred while terminating the demuxer subprocess, err:{ex}')
+
+    # filenames are the sorted files of the hour, the merged file may be one of them. Returns the merged file and the merged segments.
+    def merge(self, source_id: str, filenames: List[str], output_file: str) -> (str, List[str]):
+        state_path = self.__get_hidden_path(output_file, '.merge.json')
+        pending_path = f'{state_path}.pending'
+        temp_file = self.__get_hidden_path(output_file, '.append.mp4')
+        state = self.__recover(output_file, state_path, pending_path)
+        segments = [filename for filename in filenames if filename != output_file]
+        if state is not None:
+            merged = set(state.segments)
+            for filename in [filename for filename in segments if path.basename(filename) in merged]:
+                self.__remove(filename)  # it had been appended, but the crash had left it
+            segments = [filename for filename in segments if path.basename(filename) not in merged]
+        if len(segments) == 0:
+            return '', []
+        try:
+            if state is not None:
+                if self.__append(source_id, state, segments, output_file, temp_file, state_path, pending_path):
+                    return output_file, segments
+                logger.warning(f'the new segments can not be appended to {output_file}, it will be merged from scratch')
+            if self.__merge_all(source_id, segments, output_file, temp_file, state_path, pending_path):
+                return output_file, segments
+            return '', []
+        finally:
+            self.__remove(temp_file)
+
+    def __append(self, source_id: str, state: MergeState, segments: List[str], output_file: str, temp_file: str, state_path: str,
+                 pending_path: str) -> bool:
+        if not self.__concatenate(source_id, segments, temp_file, _fragmented_args):
+            return False
+        if get_init_signature(temp_file) != state.signature:
+            return False  # i.e. the resolution of the camera has been changed
+        try:
+            decode_time_offsets = get_track_ends(output_file)  # the decode times of the temp file start from 0
+        except BaseException as ex:
+            logger.error(f'the track ends of {output_file} can not be read, err: {ex}')
+            return False
+        fragment_count = count_fragments(temp_file)
+        pending = MergeState()
+        pending.committed_size = state.committed_size + self.__get_fragments_size(temp_file)
+        pending.fragment_index = state.fragment_index + fragment_count
+        pending.signature = state.signature
+        pending.segments = state.segments + [path.basename(filename) for filename in segments]
+        self.__save_state(pending, pending_path)
+        try:
+            append_fragments(temp_file, output_file, state.fragment_index, decode_time_offsets)
+        except BaseException as ex:
+            logger.error(f'an error occurred while appending to {output_file}, it will be rolled back, err: {ex}')
+            os.truncate(output_file, state.committed_size)
+            self.__remove(pending_path)
+            return False
+        os.replace(pending_path, state_path)
+        self.__remove_segments(segments)
+        logger.info(f'{len(segments)} segments ({fragment_count} fragments) have been appended to {output_file} at {datetime.now()}')
+        return True
+
+    # the first merge of an hour, or a full merge if the merged file can not be appended (i.e. a merged file of the legacy mode)
+    def __merge_all(self, source_id: str, segments: List[str], output_file: str, temp_file: str, state_path: str, pending_path: str) -> bool:
+        inputs = ([output_file] if path.exists(output_file) else []) + segments
+        if not self.__concatenate(source_id, inputs, temp_file, _fragmented_args):
+            return False
+        pending = MergeState()
+        pending.committed_size = path.getsize(temp_file)
+        pending.fragment_index = count_fragments(temp_file)
+        pending.signature = get_init_signature(temp_file)
+        pending.segments = [path.basename(filename) for filename in segments]
+        self.__save_state(pending, pending_path)
+        os.replace(temp_file, output_file)
+        os.replace(pending_path, state_path)
+        self.__remove_segments(segments)
+        logger.info(f'{len(segments)} segments have been merged into {output_file} at {datetime.now()}')
+        return True
+
+    @staticmethod
+    def __get_fragments_size(filename: str) -> int:
+        with open(filename, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            return sum(box_end - box_start for box_type, box_start, _, box_end in iter_boxes(f, 0, end) if box_type in (b'moof', b'mdat'))
+
+    def __remove_segments(self, segments: List[str]):
+        for filename in segments:
+            self.__remove(filename)
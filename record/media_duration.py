@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import os
+import struct
+from typing import BinaryIO, Tuple
+
+from common.data.source_model import RecordFileTypes
+
+# reads the durations and the video codecs of the record segments from their container metadata by a few small reads, instead of
+# spawning ffprobe per file. None means the file could not be parsed (i.e. an unfinished or a corrupted file), so the caller falls back
+# to ffprobe.
+
+_mp4_container_boxes = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+# Matroska / WebM element ids
+_ebml_header_id = 0x1A45DFA3
+_segment_id = 0x18538067
+_seek_head_id = 0x114D9B74
+_seek_id = 0x4DBB
+_seek_element_id = 0x53AB
+_seek_position_id = 0x53AC
+_info_id = 0x1549A966
+_timecode_scale_id = 0x2AD7B1
+_duration_id = 0x4489
+_cues_id = 0x1C53BB6B
+_cue_point_id = 0xBB
+_cue_time_id = 0xB3
+_cluster_id = 0x1F43B675
+_tracks_id = 0x1654AE6B
+_track_entry_id = 0xAE
+_track_type_id = 0x83
+_codec_id_id = 0x86
+_video_track_type = 1
+_max_element_read_size = 4 * 1024 * 1024
+
+
+class MediaInfo:
+    def __init__(self, duration: float, codec: str):
+        self.duration: float = duration
+        self.codec: str = codec  # i.e. avc1, hvc1, V_VP9, empty if there is no video track
+
+
+# returns None if the file can not be parsed, so the caller falls back to ffprobe instead of treating the segment as corrupt.
+# A Matroska file without a Duration element gets the time of its last cue, which can be short of the real duration by up to one GOP.
+def get_media_info(filename: str, record_file_type: RecordFileTypes) -> MediaInfo | None:
+    try:
+        with open(filename, 'rb') as f:
+            if record_file_type == RecordFileTypes.MP4:
+                return get_mp4_info(f)
+            if record_file_type == RecordFileTypes.WEBM or record_file_type == RecordFileTypes.MKV:
+                return get_matroska_info(f)
+    except Exception:  # i.e. an IndexError from a malformed box or element
+        return None
+    return None
+
+
+# mp4
+
+def __read_box_header(f: BinaryIO, end: int) -> Tuple[bytes, int, int] | None:
+    start = f.tell()
+    if start + 8 > end:
+        return None
+    size, box_type = struct.unpack('>I4s', f.read(8))
+    header_size = 8
+    if size == 1:  # 64-bit large size
+        size = struct.unpack('>Q', f.read(8))[0]
+        header_size = 16
+    elif size == 0:  # the last box, extends to the end of the file
+        size = end - start
+    if size < header_size or start + size > end:
+        return None
+    return box_type, start + header_size, start + size
+
+
+def __parse_mvhd(f: BinaryIO) -> float | None:
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, os.SEEK_CUR)  # creation and modification times
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+        unknown = 0xFFFFFFFFFFFFFFFF
+    else:
+        f.seek(8, os.SEEK_CUR)
+        timescale, duration = struct.unpack('>II', f.read(8))
+        unknown = 0xFFFFFFFF
+    if timescale == 0 or duration == 0 or duration == unknown:
+        return None  # i.e. a fragmented mp4 which keeps its duration in the fragments
+    return duration / timescale
+
+
+def __parse_sample_entry(f: BinaryIO) -> str:
+    f.seek(8, os.SEEK_CUR)  # version, flags and entry count of stsd
+    _, codec = struct.unpack('>I4s', f.read(8))  # the box type of the first sample entry is the codec
+    return codec.decode('ascii', errors='replace').strip()
+
+
+def get_mp4_info(f: BinaryIO) -> MediaInfo | None:
+    end = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    duration, codec, handler = None, '', b''
+    ends = [end]  # the ends of the boxes which are being descended into
+    # the other boxes are skipped by their sizes, so moov is found by a few reads even if it is written after mdat
+    while True:
+        while len(ends) > 1 and f.tell() >= ends[-1]:
+            ends.pop()
+            if len(ends) == 1:
+                return MediaInfo(duration, codec) if duration is not None else None  # moov has been parsed
+        header = __read_box_header(f, ends[-1])
+        if header is None:
+            return MediaInfo(duration, codec) if duration is not None else None
+        box_type, data_start, box_end = header
+        if box_type in _mp4_container_boxes:
+            if box_type == b'trak':
+                handler = b''
+            ends.append(box_end)
+            continue
+        if box_type == b'mvhd':
+            duration = __parse_mvhd(f)
+        elif box_type == b'hdlr':
+            f.seek(8, os.SEEK_CUR)  # version, flags and pre_defined
+            handler = f.read(4)
+        elif box_type == b'stsd' and handler == b'vide' and not codec:
+            codec = __parse_sample_entry(f)
+        f.seek(box_end)
+
+
+# matroska / webm
+
+def __read_vint(f: BinaryIO, keep_marker: bool) -> Tuple[int, int] | None:
+    first = f.read(1)
+    if not first:
+        return None
+    first = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise ValueError('invalid EBML variable size integer')
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = (first & (mask - 1)) == mask - 1
+    for b in f.read(length - 1):
+        value = (value << 8) | b
+        all_ones = all_ones and b == 0xFF
+    if not keep_marker and all_ones:
+        return -1, length  # unknown size, i.e. a live segment
+    return value, length
+
+
+def __read_element_header(f: BinaryIO) -> Tuple[int, int] | None:
+    element_id = __read_vint(f, True)
+    if element_id is None:
+        return None
+    size = __read_vint(f, False)
+    if size is None:
+        return None
+    return element_id[0], size[0]
+
+
+def __read_uint(f: BinaryIO, size: int) -> int:
+    return int.from_bytes(f.read(size), 'big')
+
+
+def __read_float(f: BinaryIO, size: int) -> float:
+    data = f.read(size)
+    return struct.unpack('>f', data)[0] if size == 4 else struct.unpack('>d', data)[0]
+
+
+# yields (id, data start, data end) of the children in [start, end), the data position of an unknown sized element is its end
+def __iter_elements(f: BinaryIO, start: int, end: int):
+    position = start
+    while position < end:
+        f.seek(position)
+        header = __read_element_header(f)
+        if header is None:
+            return
+        element_id, size = header
+        data_start = f.tell()
+        data_end = end if size < 0 else data_start + size
+        yield element_id, data_start, data_end
+        if size < 0:
+            return
+        position = data_end
+
+
+def __parse_cues_duration(f: BinaryIO, start: int, end: int, timecode_scale: int) -> float | None:
+    last_cue_time = -1
+    for element_id, data_start, data_end in __iter_elements(f, start, end):
+        if element_id != _cue_point_id:
+            continue
+        for child_id, child_start, child_end in __iter_elements(f, data_start, data_end):
+            if child_id == _cue_time_id:
+                f.seek(child_start)
+                last_cue_time = max(last_cue_time, __read_uint(f, child_end - child_start))
+    # the time of the last key frame, it is short of the duration by a GOP at most
+    return last_cue_time * timecode_scale / 1e9 if last_cue_time > 0 else None
+
+
+def __parse_video_codec(f: BinaryIO, start: int, end: int) -> str:
+    for element_id, data_start, data_end in __iter_elements(f, start, end):
+        if element_id != _track_entry_id:
+            continue
+        track_type, codec = 0, ''
+        for child_id, child_start, child_end in __iter_elements(f, data_start, data_end):
+            f.seek(child_start)
+            if child_id == _track_type_id:
+                track_type = __read_uint(f, child_end - child_start)
+            elif child_id == _codec_id_id:
+                codec = f.read(child_end - child_start).rstrip(b'\0').decode('ascii', errors='replace')
+        if track_type == _video_track_type:
+            return codec
+    return ''
+
+
+def get_matroska_info(f: BinaryIO) -> MediaInfo | None:
+    file_size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    header = __read_element_header(f)
+    if header is None or header[0] != _ebml_header_id or header[1] < 0:
+        return None
+    f.seek(header[1], os.SEEK_CUR)
+    header = __read_element_header(f)
+    if header is None or header[0] != _segment_id:
+        return None
+    segment_start = f.tell()
+    segment_end = file_size if header[1] < 0 else min(segment_start + header[1], file_size)
+    timecode_scale = 1000000
+    cues_position = -1
+    duration, codec = None, ''
+    for element_id, data_start, data_end in __iter_elements(f, segment_start, segment_end):
+        if element_id == _seek_head_id:
+            for seek_id, seek_start, seek_end in __iter_elements(f, data_start, data_end):
+                if seek_id != _seek_id:
+                    continue
+                target_id, position = 0, -1
+                for child_id, child_start, child_end in __iter_elements(f, seek_start, seek_end):
+                    f.seek(child_start)
+                    if child_id == _seek_element_id:
+                        target_id = __read_uint(f, child_end - child_start)
+                    elif child_id == _seek_position_id:
+                        position = __read_uint(f, child_end - child_start)
+                if target_id == _cues_id and position >= 0:
+                    cues_position = segment_start + position
+        elif element_id == _info_id:
+            for child_id, child_start, child_end in __iter_elements(f, data_start, data_end):
+                f.seek(child_start)
+                if child_id == _timecode_scale_id:
+                    timecode_scale = __read_uint(f, child_end - child_start)
+                elif child_id == _duration_id:
+                    duration = __read_float(f, child_end - child_start)
+        elif element_id == _tracks_id:
+            codec = __parse_video_codec(f, data_start, data_end)
+        elif element_id == _cluster_id:
+            break  # the duration and the tracks are written before the clusters
+    if duration is not None and duration > 0:
+        return MediaInfo(duration * timecode_scale / 1e9, codec)
+    if cues_position < 0 or cues_position >= file_size:
+        return None
+    f.seek(cues_position)
+    header = __read_element_header(f)
+    if header is None or header[0] != _cues_id or header[1] < 0 or header[1] > _max_element_read_size:
+        return None
+    duration = __parse_cues_duration(f, f.tell(), min(f.tell() + header[1], file_size), timecode_scale)
+    return MediaInfo(duration, codec) if duration is not None else None
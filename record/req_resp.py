@@ -6,6 +6,7 @@ class ProbeResult:
     video_filename: str = ''
     date_str: str = ''
     duration: int = 0
+    codec: str = ''
 
 
 class VfiResponseEvent:
@@ -23,3 +24,25 @@ class VfmResponseEvent:
     output_file_name: str = ''
     merged_video_filenames: List[str] = []
     merged_video_file_duration: int = 0
+
+
+class ClipExportRequestEvent:
+    def __init__(self):
+        self.id: str = ''  # correlates the progress and the result responses, generated if it is empty
+        self.source_id: str = ''
+        self.start: str = ''  # 2023_04_18_19_01_11, the same format as the record file names
+        self.end: str = ''
+        self.output_file_name: str = ''  # a file or a named pipe, defaults to the clips directory of the source
+
+
+class ClipExportResponseEvent:
+    def __init__(self):
+        self.id: str = ''
+        self.source_id: str = ''
+        self.output_file_name: str = ''
+        self.progress: float = 0.  # 0 - 100
+        self.done: bool = False
+        self.succeeded: bool = False
+        self.duration: float = 0.
+        self.segment_count: int = 0
+        self.error: str = ''
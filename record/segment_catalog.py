@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from datetime import datetime
+from os import path
+from threading import Lock
+from typing import List
+
+from common.utilities import logger, config
+from utils.dir import create_dir_if_not_exists
+
+_create_table_sql = '''
+CREATE TABLE IF NOT EXISTS segments (
+    path TEXT PRIMARY KEY,
+    source_id TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    duration REAL NOT NULL,
+    size INTEGER NOT NULL,
+    codec TEXT NOT NULL
+)'''
+_create_index_sql = 'CREATE INDEX IF NOT EXISTS ix_segments_source_start ON segments (source_id, start_ts)'
+_insert_sql = 'INSERT OR REPLACE INTO segments (path, source_id, start_ts, duration, size, codec) VALUES (?, ?, ?, ?, ?, ?)'
+_select_columns = 'path, source_id, start_ts, duration, size, codec'
+_max_segment_duration = 24 * 60 * 60.  # bounds the start_ts range of an overlap query, so it can use the index
+
+
+class SegmentModel:
+    def __init__(self):
+        self.source_id: str = ''
+        self.start_ts: float = 0.  # epoch seconds, the start time in the file name
+        self.duration: float = 0.
+        self.size: int = 0
+        self.codec: str = ''
+        self.path: str = ''
+
+    def get_start(self) -> datetime:
+        return datetime.fromtimestamp(self.start_ts)
+
+    @staticmethod
+    def from_row(row) -> SegmentModel:
+        model = SegmentModel()
+        model.path, model.source_id, model.start_ts, model.duration, model.size, model.codec = row
+        return model
+
+
+def _get_default_path() -> str:
+    dir_paths = config.general.dir_paths
+    return path.join(dir_paths[0], 'record', 'segments.db') if len(dir_paths) > 0 else 'segments.db'
+
+
+# a local SQLite catalog of the indexed record segments, so a time range of a source is answered by an index lookup instead of walking the
+# YYYY/MM/DD/HH directories and probing the files again. It is written by VideoFileIndexer in one transaction per indexed batch.
+class SegmentCatalog:
+    __instance: SegmentCatalog | None = None
+    __instance_pid: int = 0
+    __instance_lock = Lock()
+
+    def __init__(self, db_path: str):
+        create_dir_if_not_exists(path.dirname(path.abspath(db_path)))
+        self.db_path = db_path
+        self.lock = Lock()  # one connection per process is shared by the indexer threads
+        self.connection = sqlite3.connect(db_path, timeout=30., check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')  # the readers of the other processes do not block the writer
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(_create_table_sql)
+        self.connection.execute(_create_index_sql)
+        self.connection.commit()
+
+    # returns None if the catalog is disabled
+    @staticmethod
+    def get_instance() -> SegmentCatalog | None:
+        if not config.ffmpeg.record_segment_catalog_enabled:
+            return None
+        pid = os.getpid()
+        with SegmentCatalog.__instance_lock:
+            if SegmentCatalog.__instance is None or SegmentCatalog.__instance_pid != pid:
+                db_path = config.ffmpeg.record_segment_catalog_path or _get_default_path()
+                SegmentCatalog.__instance = SegmentCatalog(db_path)
+                SegmentCatalog.__instance_pid = pid
+                logger.info(f'segment catalog has been opened ({db_path}) at {datetime.now()}')
+            return SegmentCatalog.__instance
+
+    def add_all(self, segments: List[SegmentModel]):
+        if len(segments) == 0:
+            return
+        rows = [(s.path, s.source_id, s.start_ts, s.duration, s.size, s.codec) for s in segments]
+        with self.lock, self.connection:
+            self.connection.executemany(_insert_sql, rows)
+
+    def remove_all(self, paths: List[str]):
+        if len(paths) == 0:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM segments WHERE path = ?', [(p,) for p in paths])
+
+    # the merged segments are replaced by the merge output in one transaction
+    def replace(self, removed_paths: List[str], segment: SegmentModel):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM segments WHERE path = ?', [(p,) for p in removed_paths])
+            self.connection.execute(_insert_sql, (segment.path, segment.source_id, segment.start_ts, segment.duration, segment.size, segment.codec))
+
+    # returns the segments of the source which overlap [start, end), ordered by their start times
+    def query(self, source_id: str, start: datetime, end: datetime) -> List[SegmentModel]:
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        sql = (f'SELECT {_select_columns} FROM segments WHERE source_id = ? AND start_ts >= ? AND start_ts < ? AND start_ts + duration > ? '
+               f'ORDER BY start_ts')
+        with self.lock:
+            rows = self.connection.execute(sql, (source_id, start_ts - _max_segment_duration, end_ts, start_ts)).fetchall()
+        return [SegmentModel.from_row(row) for row in rows]
+
+    def get_by_path(self, segment_path: str) -> SegmentModel | None:
+        with self.lock:
+            row = self.connection.execute(f'SELECT {_select_columns} FROM segments WHERE path = ?', (segment_path,)).fetchone()
+        return SegmentModel.from_row(row) if row is not None else None
+
+    # the record files are also deleted by the retention and the disk usage cleanup, which do not know the catalog, so the segments whose
+    # files do not exist anymore are removed. returns the removed segment count
+    def remove_missing(self) -> int:
+        with self.lock:
+            paths = [row[0] for row in self.connection.execute('SELECT path FROM segments').fetchall()]
+        missing = [segment_path for segment_path in paths if not path.exists(segment_path)]
+        self.remove_all(missing)
+        return len(missing)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from datetime import datetime
+from os import path
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+from common.utilities import logger
+from stream.stream_model import StreamModel
+from utils.dir import get_record_dir_by, create_dir_if_not_exists
+from utils.inotify import Inotify, is_inotify_available, IN_CLOSE_WRITE, IN_MOVED_TO, IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR
+from utils.utils import start_thread
+
+
+# watches the record directories of the sources, the segment muxer closes a segment once it has been finished, so a segment is indexed
+# seconds after it has been closed without rescanning the directories. The periodic move is kept as the reconciliation of the missed events.
+class SegmentWatcher:
+    def __init__(self, on_segment_closed: Callable[[str, str, bool], None]):
+        self.on_segment_closed = on_segment_closed  # (source id, filename, closed), must not block the event loop
+        self.inotify: Inotify | None = None
+        self.lock = Lock()
+        self.watches: Dict[str, Tuple[int, str]] = {}  # source id -> (wd, record dir)
+        self.sources: Dict[int, Tuple[str, str]] = {}  # wd -> (source id, record dir)
+
+    def start(self) -> bool:
+        if not is_inotify_available():
+            logger.error('inotify is not available, the segment watcher will not be started and the record files will be indexed by polling')
+            return False
+        self.inotify = Inotify()
+        start_thread(self.__run, [])
+        logger.info(f'segment watcher has been started at {datetime.now()}')
+        return True
+
+    def is_started(self) -> bool:
+        return self.inotify is not None
+
+    def __remove_watch(self, source_id: str):
+        wd, _ = self.watches.pop(source_id)
+        self.sources.pop(wd, None)
+        self.inotify.rm_watch(wd)
+
+    # adds the watches of the new recording sources and removes the ones of the stopped sources, called by each reconciliation run
+    def sync(self, stream_models: List[StreamModel]):
+        if self.inotify is None:
+            return
+        record_dirs = {stream_model.id: get_record_dir_by(stream_model) for stream_model in stream_models}
+        with self.lock:
+            for source_id, (wd, record_dir) in list(self.watches.items()):
+                if record_dirs.get(source_id) != record_dir:
+                    self.__remove_watch(source_id)
+            for source_id, record_dir in record_dirs.items():
+                if source_id in self.watches:
+                    continue
+                try:
+                    create_dir_if_not_exists(record_dir)
+                    wd = self.inotify.add_watch(record_dir, IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR)
+                    self.watches[source_id] = (wd, record_dir)
+                    self.sources[wd] = (source_id, record_dir)
+                    logger.info(f'record directory of {source_id} is being watched ({record_dir})')
+                except BaseException as ex:
+                    logger.error(f'an error occurred while watching the record directory of {source_id}, err: {ex}')
+
+    def __run(self):
+        while self.inotify is not None:
+            try:
+                events = self.inotify.read_events(1.)
+            except BaseException as ex:
+                logger.error(f'an error occurred while reading the inotify events, err: {ex} at {datetime.now()}')
+                continue
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning(f'inotify event queue has overflowed, the missed segments will be indexed by the next reconciliation')
+                    continue
+                with self.lock:
+                    entry = self.sources.get(wd)
+                    if entry is not None and mask & IN_IGNORED:  # the directory has been removed
+                        self.sources.pop(wd, None)
+                        self.watches.pop(entry[0], None)
+                        continue
+                if entry is None or not name or not mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    continue
+                try:
+                    # a moved-in file has not been closed by the watched writer, i.e. it may be the segment which is being written
+                    self.on_segment_closed(entry[0], path.join(entry[1], name), bool(mask & IN_CLOSE_WRITE))
+                except BaseException as ex:
+                    logger.error(f'an error occurred while handling a closed segment ({name}) of {entry[0]}, err: {ex}')
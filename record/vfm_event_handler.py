@@ -1,13 +1,16 @@
 from datetime import datetime
+from os import path
 
 from common.data.redis_mapper import RedisMapper
 from common.event_bus.event_bus import EventBus
 from common.event_bus.event_handler import EventHandler
 from common.utilities import logger
 from record.req_resp import VfmRequestEvent, VfmResponseEvent
+from record.segment_catalog import SegmentCatalog, SegmentModel
 from record.video_file_indexer import VideoFileIndexer
 from record.video_file_merger import VideoFileMerger
 from stream.stream_repository import StreamRepository
+from utils.dir import filename_to_datetime
 from utils.json_serializer import serialize_json
 
 
@@ -17,6 +20,31 @@ class VfmEventHandler(EventHandler):
         self.event_bus = EventBus('vfm_response')
         logger.info(f'VideoFileMergerEventHandler: initialized at {datetime.now()}')
 
+    # the merged segments are replaced by the merge output
+    @staticmethod
+    def __update_catalog(response: VfmResponseEvent, codec: str):
+        catalog = SegmentCatalog.get_instance()
+        if catalog is None:
+            return
+        try:
+            segment = SegmentModel()
+            segment.source_id = response.source_id
+            segment.path = response.output_file_name
+            # the output itself is in the catalog if the new segments have been appended to it
+            merged_segments = [catalog.get_by_path(filename) for filename in [response.output_file_name] + response.merged_video_filenames]
+            starts = [merged_segment.start_ts for merged_segment in merged_segments if merged_segment is not None]
+            if len(starts) > 0:
+                segment.start_ts = min(starts)
+            else:
+                start = filename_to_datetime(response.output_file_name)  # the hour of the merge, i.e. 2023_04_18_19.mp4
+                segment.start_ts = start.timestamp() if start is not None else 0.
+            segment.duration = response.merged_video_file_duration
+            segment.size = path.getsize(response.output_file_name)
+            segment.codec = codec
+            catalog.replace(response.merged_video_filenames, segment)
+        except BaseException as ex:
+            logger.error(f'an error occurred while updating the segment catalog for a merge, err: {ex}')
+
     def handle(self, dic: dict):
         if RedisMapper.is_pubsub_message_invalid(dic):
             return
@@ -36,5 +64,6 @@ class VfmEventHandler(EventHandler):
         prs = VideoFileIndexer.check_by_ffprobe(stream_model, [response.output_file_name])
         if len(prs) > 0:
             response.merged_video_file_duration = prs[0].duration
+            self.__update_catalog(response, prs[0].codec)
 
         self.event_bus.publish_async(serialize_json(response))
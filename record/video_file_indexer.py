@@ -1,17 +1,24 @@
+from __future__ import annotations
+
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from os import path
-from typing import List
+from threading import Lock
+from typing import Dict, List, Tuple
 import ffmpeg
 from pathlib import Path
 
 from common.data.source_model import RecordFileTypes
 from common.event_bus.event_bus import EventBus
 from common.utilities import config, logger
+from record.media_duration import get_media_info
 from record.req_resp import ProbeResult, VfiResponseEvent
+from record.segment_catalog import SegmentCatalog, SegmentModel
 from stream.stream_model import StreamModel
 from stream.stream_repository import StreamRepository
-from utils.dir import get_record_dir_by, get_filename_date_record_dir, create_dir_if_not_exists, get_sorted_valid_files
+from utils.dir import get_record_dir_by, get_filename_date_record_dir, create_dir_if_not_exists, get_sorted_valid_files, filename_to_datetime
 from utils.json_serializer import serialize_json
 
 
@@ -22,6 +29,11 @@ class VideoFileIndexer:
         if self.last_file_count < 1:
             self.last_file_count = 1
         self.eb = EventBus('vfi_response')
+        # probing is either in-process parsing or waiting on an ffprobe subprocess, so threads are enough
+        self.probe_executor = ThreadPoolExecutor(max_workers=max(config.ffmpeg.record_video_file_indexer_max_workers, 1))
+        # the files of a source are indexed by either the periodic move or the segment watcher at a time
+        self.source_locks: Dict[str, Lock] = {}
+        self.source_locks_lock = Lock()
 
     @staticmethod
     def __remove_invalid_midget_files(filenames: List[str]) -> List[str]:
@@ -42,55 +54,134 @@ class VideoFileIndexer:
     def __get_video_file_duration(file_name: str, default: int) -> int:
         result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_name],
                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        ret = result.stdout
+        ret = result.stdout.decode('utf-8').strip()
         return int(float(ret)) if ret != 'N/A' else default
 
     @staticmethod
-    def check_by_ffprobe(stream_model: StreamModel, filenames: List[str]) -> List[ProbeResult]:
-        valid_list: List[ProbeResult] = []
-        for filename in filenames:
+    def __probe(stream_model: StreamModel, filename: str, delete_corrupted: bool = True) -> ProbeResult | None:
+        try:
+            pr = ProbeResult()
+            pr.video_filename = filename
+            info = get_media_info(filename, stream_model.record_file_type)  # ffprobe is spawned only if it can not be parsed
+            if info is not None:
+                pr.duration = int(info.duration)
+                pr.codec = info.codec
+            elif stream_model.record_file_type == RecordFileTypes.WEBM:
+                pr.duration = VideoFileIndexer.__get_video_file_duration(filename, stream_model.record_segment_interval)
+            else:
+                probe_result = ffmpeg.probe(filename)
+                pr.duration = int(float(probe_result['streams'][0]['duration']))
+                pr.codec = probe_result['streams'][0].get('codec_name', '')
+            return pr
+        except BaseException as ex:
+            if not delete_corrupted:
+                logger.warning(f'a video file({filename}) could not be probed, ex: {ex}')
+                return None
             try:
-                pr = ProbeResult()
-                pr.video_filename = filename
-                if stream_model.record_file_type == RecordFileTypes.WEBM:
-                    pr.duration = VideoFileIndexer.__get_video_file_duration(filename, stream_model.record_segment_interval)
-                else:
-                    probe_result = ffmpeg.probe(filename)
-                    print(probe_result)
-                    pr.duration = int(float(probe_result['streams'][0]['duration']))
-                valid_list.append(pr)
-            except BaseException as ex:
-                try:
-                    os.remove(filename)
-                    logger.warning(f'a corrupted video file({filename}) was found and deleted, ex: {ex}')
-                except BaseException as ex2:
-                    logger.warning(f'an error occurred during the deleting the file name: {filename}, ex: {ex2}')
-        return valid_list
+                os.remove(filename)
+                logger.warning(f'a corrupted video file({filename}) was found and deleted, ex: {ex}')
+            except BaseException as ex2:
+                logger.warning(f'an error occurred during the deleting the file name: {filename}, ex: {ex2}')
+        return None
+
+    # the results keep the order of the filenames. The readers which must not delete the files pass delete_corrupted=False
+    @staticmethod
+    def check_by_ffprobe(stream_model: StreamModel, filenames: List[str], executor: ThreadPoolExecutor | None = None,
+                         delete_corrupted: bool = True) -> List[ProbeResult]:
+        if executor is None or len(filenames) < 2:
+            results = [VideoFileIndexer.__probe(stream_model, filename, delete_corrupted) for filename in filenames]
+        else:
+            results = list(executor.map(lambda filename: VideoFileIndexer.__probe(stream_model, filename, delete_corrupted), filenames))
+        return [pr for pr in results if pr is not None]
 
-    def move(self, stream_model: StreamModel):
+    @staticmethod
+    def __create_segment(source_id: str, filename: str, probe_result: ProbeResult) -> SegmentModel:
+        segment = SegmentModel()
+        segment.source_id = source_id
+        segment.path = filename
+        start = filename_to_datetime(filename)
+        segment.start_ts = start.timestamp() if start is not None else 0.
+        segment.duration = probe_result.duration
+        segment.size = path.getsize(filename)
+        segment.codec = probe_result.codec
+        return segment
+
+    # one transaction per indexed batch
+    @staticmethod
+    def __add_to_catalog(segments: List[SegmentModel]):
+        catalog = SegmentCatalog.get_instance()
+        if catalog is None or len(segments) == 0:
+            return
+        try:
+            catalog.add_all(segments)
+        except BaseException as ex:
+            logger.error(f'an error occurred while adding the segments to the catalog, err: {ex}')
+
+    def __get_source_lock(self, source_id: str) -> Lock:
+        with self.source_locks_lock:
+            lock = self.source_locks.get(source_id)
+            if lock is None:
+                lock = Lock()
+                self.source_locks[source_id] = lock
+            return lock
+
+    # returns the backlog (the finished files which are waiting to be indexed) and the moved file count
+    def move(self, stream_model: StreamModel) -> Tuple[int, int]:
+        with self.__get_source_lock(stream_model.id):
+            return self.__move(stream_model)
+
+    # indexes a single segment as soon as the segment muxer closes it, see SegmentWatcher. The last_file_count margin of move() is for
+    # the segment which is still being written, a closed one is not, so only a moved-in segment is held back if it is the newest one
+    def index_file(self, source_id: str, filename: str, closed: bool = True) -> bool:
+        with self.__get_source_lock(source_id):
+            if not path.isfile(filename):
+                return False  # it has already been indexed by the periodic move
+            stream_model = self.stream_repository.get(source_id)
+            if stream_model is None:
+                return False
+            if Path(filename).suffix != '.' + RecordFileTypes.str(stream_model.record_file_type):
+                return False
+            if not closed and self.__is_newest(filename):
+                return False  # it will be indexed by the periodic move
+            filenames = self.__remove_invalid_midget_files([filename])
+            return len(filenames) > 0 and self.__index(stream_model, filenames) > 0
+
+    @staticmethod
+    def __is_newest(filename: str) -> bool:
+        filenames = get_sorted_valid_files(path.dirname(filename), Path(filename).suffix)
+        return len(filenames) > 0 and filenames[-1] == filename
+
+    def __move(self, stream_model: StreamModel) -> Tuple[int, int]:
         source_id = stream_model.id
         source_record_dir = get_record_dir_by(stream_model)
         stream_model = self.stream_repository.get(source_id)
         if stream_model is None:
             logger.info(f'no stream({source_id}) was found for move operation')
-            return
+            return 0, 0
         ext = '.' + RecordFileTypes.str(stream_model.record_file_type)
         filenames = get_sorted_valid_files(source_record_dir, ext)
         valid_file_length = len(filenames) - self.last_file_count
         if valid_file_length < 1:
             logger.info(f'no valid record file({ext}) was found on source({source_id}) record parent directory')
-            return
+            return 0, 0
         filenames = filenames[0:valid_file_length]
+        backlog = len(filenames)
         filenames: List[str] = self.__remove_invalid_midget_files(filenames)
         if len(filenames) == 0:
             logger.info(f'no valid record file({ext}) was found on source({source_id}) record parent directory')
-            return
-        probe_results = self.check_by_ffprobe(stream_model, filenames)
+            return backlog, 0
+        return backlog, self.__index(stream_model, filenames)
+
+    # probes, moves to the indexed folders and publishes the files, returns the moved file count
+    def __index(self, stream_model: StreamModel, filenames: List[str]) -> int:
+        source_id = stream_model.id
+        probe_results = self.check_by_ffprobe(stream_model, filenames, self.probe_executor)
         if len(probe_results) == 0:
-            logger.info(f'no valid record file({ext}) was found on source({source_id}) record parent directory')
-            return
+            logger.info(f'no valid record file was found on source({source_id}) record parent directory')
+            return 0
 
         valid_list: List[ProbeResult] = []
+        segments: List[SegmentModel] = []
         for probe_result in probe_results:
             filename = probe_result.video_filename
             dest_dir = get_filename_date_record_dir(stream_model, filename)
@@ -105,11 +196,14 @@ class VideoFileIndexer:
                 pr.date_str = Path(dest_filename).stem
                 pr.duration = probe_result.duration
                 valid_list.append(pr)
-                print(f'source_id: {source_id}, video_filename: {pr.video_filename}, duration: {pr.duration}')
+                segments.append(self.__create_segment(source_id, dest_filename, probe_result))
+                logger.info(f'{pr.video_filename} of {source_id} has been indexed, duration: {pr.duration} at {datetime.now()}')
             except BaseException as ex:
                 logger.error(f'an error occurred while moving files to indexed folders, err: {ex}')
+        self.__add_to_catalog(segments)
         # publish them
         if len(valid_list) > 0:
             event = VfiResponseEvent()
             event.results = valid_list
             self.eb.publish_async(serialize_json(event))
+        return len(valid_list)
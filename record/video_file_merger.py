@@ -3,8 +3,9 @@ import os.path as path
 from typing import List
 
 from common.data.source_model import RecordFileTypes
-from common.utilities import logger
+from common.utilities import logger, config
 from record.concat_demuxer import ConcatDemuxer
+from record.incremental_merger import IncrementalMerger
 from stream.stream_model import StreamModel
 from stream.stream_repository import StreamRepository
 from utils.dir import get_given_date_record_dir, sort_video_files
@@ -14,6 +15,7 @@ class VideoFileMerger:
     def __init__(self, stream_repository: StreamRepository):
         self.stream_repository = stream_repository
         self.cd = ConcatDemuxer(stream_repository)
+        self.incremental_merger = IncrementalMerger(self.cd, self.__has_error)
 
     @staticmethod
     def __has_error(proc) -> bool:
@@ -51,7 +53,7 @@ class VideoFileMerger:
         if len(source_record_dir) == 0:
             logger.warning(f'video file merge operation is now exiting since the source_id({source_id}) and/or date_str({date_str}) is invalid')
             return '', []
-        lds = os.listdir(source_record_dir)
+        lds = [ld for ld in os.listdir(source_record_dir) if not ld.startswith('.')]  # i.e. the merge state files
         if len(lds) < 2:
             logger.warning(
                 f'video file merge operation is now exiting since there is not enough video file for source_id({source_id}) and/or date_str({date_str})')
@@ -64,6 +66,8 @@ class VideoFileMerger:
         ext = '.' + RecordFileTypes.str(stream_model.record_file_type)
         output_file_name = f'{self.__fix_zeroless_file_name(date_str)}{ext}'
         output_file = path.join(source_record_dir, output_file_name)
+        if config.ffmpeg.record_incremental_merge_enabled and IncrementalMerger.is_supported(stream_model.record_file_type):
+            return self.incremental_merger.merge(source_id, filenames, output_file)
         prev_output_file_exists = path.exists(output_file)
         prev_output_file = ''
         if prev_output_file_exists:
@@ -1,23 +1,26 @@
 import os
-import subprocess
 import time
 from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List
 import psutil
 
 from command_builder import CommandBuilder
 from common.data.source_model import SourceModel, MediaServerType, SourceState
+from common.data.redis_semaphore import RedisSemaphore
 from common.data.source_repository import SourceRepository
 from common.utilities import logger, config
 
-from readers.base_pipe_reader import PipeReaderOptions
+from readers.base_pipe_reader import PipeReaderOptions, PushMethod
 from readers.ffmpeg_pipe_reader import FFmpegPipeReader
 from readers.mp_ffmpeg_pipe_reader import MpFFmpegPipeReader
 from media_server.docker_manager import DockerManager
+from media_server.media_server_models import BaseMediaServerModel
 from stream.base_stream_event_handler import BaseStreamEventHandler
 from stream.stream_model import StreamModel
 from stream.stream_repository import StreamRepository
+from sustain.process_supervisor import ProcessSupervisor
 from utils.dir import get_hls_path
 from utils.json_serializer import serialize_json
 from utils.utils import start_thread
@@ -27,6 +30,9 @@ class StartStreamEventHandler(BaseStreamEventHandler):
     def __init__(self, source_repository: SourceRepository, stream_repository: StreamRepository):
         super().__init__(source_repository, stream_repository, 'start_stream_response')
         self.source_repository = source_repository
+        # limits the streams which are being started at the same time by all the processes, every start creates a container and FFmpegs
+        self.start_semaphore = RedisSemaphore(stream_repository.connection, 'start_stream', config.ffmpeg.start_stream_max_concurrency,
+                                              config.ffmpeg.start_stream_lease_ttl)
         logger.info(f'StartStreamEventHandler initialized at {datetime.now()}')
 
     def publish_async(self, stream_model: StreamModel):
@@ -45,22 +51,38 @@ class StartStreamEventHandler(BaseStreamEventHandler):
         if need_reload:
             stream_model = StreamModel().map_from_source(source_model)
             self.stream_repository.add(stream_model)  # to prevent missing fields because of the update operation.
-            starters: List[ProcessStarter] = [MediaServerProcessStarter(self.source_repository, self.stream_repository)]
-            if stream_model.is_hls_enabled():
-                starters.append(HlsProcessStarter(self.stream_repository))
-            if stream_model.is_record_enabled():
-                starters.append(RecordProcessStarter(self.stream_repository))
-            if stream_model.is_ffmpeg_snapshot_enabled():
-                starters.append(SnapshotProcessStarter(self.stream_repository))
-            for starter in starters:
-                starter.start_process(source_model, stream_model)
+            with self.start_semaphore.acquire():
+                self.__start_processes(source_model, stream_model)
         self.set_source_state(source_model.id, SourceState.Started)
         self.publish_async(stream_model)
 
+    # the media server is started first, the others read from it, so they are started in parallel once it is ready.
+    # each starter updates only its own fields of the stream.
+    def __start_processes(self, source_model: SourceModel, stream_model: StreamModel):
+        ms_starter = MediaServerProcessStarter(self.source_repository, self.stream_repository)
+        if not ms_starter.start_process(source_model, stream_model):
+            return
+        starters: List[ProcessStarter] = []
+        if stream_model.is_hls_enabled():
+            starters.append(HlsProcessStarter(self.stream_repository))
+        if stream_model.is_record_enabled():
+            starters.append(RecordProcessStarter(self.stream_repository))
+        if stream_model.is_ffmpeg_snapshot_enabled():
+            starters.append(SnapshotProcessStarter(self.stream_repository))
+        if len(starters) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=len(starters)) as executor:
+            for starter in starters:
+                starter.ms_model = ms_starter.ms_model
+                executor.submit(starter.start_process, source_model, stream_model)
+
 
 class ProcessStarter(ABC):
-    def __init__(self, stream_repository: StreamRepository):
+    def __init__(self, stream_repository: StreamRepository, pid_field: str):
         self.stream_repository = stream_repository
+        self.pid_field = pid_field  # the stream field of the supervised process
+        self.supervisor = ProcessSupervisor.get_instance()
+        self.ms_model: BaseMediaServerModel | None = None  # the media server which the process reads from, see MediaServerProcessStarter
 
     @abstractmethod
     def _create_process(self, source_model: SourceModel, stream_model: StreamModel) -> any:
@@ -74,37 +96,53 @@ class ProcessStarter(ABC):
     def _dispose_process(self, proc: any):
         raise NotImplementedError('StartStreamEventHandler._dispose_process')
 
-    @staticmethod
-    def _wait_extra(stream_model: StreamModel):
+    # only the fields which are set by _create_process are written back
+    @abstractmethod
+    def _get_updated_fields(self, stream_model: StreamModel) -> dict:
+        raise NotImplementedError('StartStreamEventHandler._get_updated_fields')
+
+    # otherwise, media_server won't work for Go2Rtc and livego. Their APIs are polled since a mapped port accepts connections as soon as
+    # the container starts if docker-proxy is used
+    def _wait_extra(self, stream_model: StreamModel):
+        if self.ms_model is None:
+            return
         if stream_model.ms_type == MediaServerType.GO_2_RTC or stream_model.ms_type == MediaServerType.LIVE_GO:
-            time.sleep(config.ffmpeg.ms_init_interval)  # otherwise, media_server won't work for Go2Rtc and livego
+            if not self.ms_model.wait_until_ready():
+                logger.warning(f'media server ({stream_model.ms_address}) is not ready for {stream_model.id} at {datetime.now()}')
 
-    def start_process(self, source_model: SourceModel, stream_model: StreamModel):
+    def start_process(self, source_model: SourceModel, stream_model: StreamModel) -> bool:
         try:
             proc = self._create_process(source_model, stream_model)
-            self.stream_repository.add(stream_model)
+            self.stream_repository.update_fields(stream_model.id, **self._get_updated_fields(stream_model))
         except BaseException as e1:
             logger.error(f'an error occurred during the creation of a subprocess operation, err: {e1} at {datetime.now()}')
-            return
+            return False
+
+        stream_id, pid = stream_model.id, getattr(stream_model, self.pid_field)
 
         def fn(ps: ProcessStarter, p):
+            started_at = time.monotonic()
             try:
                 ps._execute_process(p)
             except BaseException as e2:
                 logger.error(f'an error occurred during the executing of a subprocess operation, err: {e2} at {datetime.now()}')
-                return
             finally:
                 try:
                     ps._dispose_process(p)
                 except BaseException as e3:
                     logger.error(f'an error occurred during the disposing subprocess operation, err: {e3} at {datetime.now()}')
+            try:
+                ps.supervisor.on_exit(stream_id, ps.pid_field, pid, getattr(p, 'returncode', None), started_at)
+            except BaseException as e4:
+                logger.error(f'an error occurred while supervising an exited subprocess, err: {e4} at {datetime.now()}')
 
         start_thread(fn, [self, proc])
+        return True
 
 
 class SubProcessTemplate(ProcessStarter, ABC):
-    def __init__(self, stream_repository: StreamRepository):
-        super().__init__(stream_repository)
+    def __init__(self, stream_repository: StreamRepository, pid_field: str):
+        super().__init__(stream_repository, pid_field)
 
     def _execute_process(self, proc: any):
         proc.wait()
@@ -115,7 +153,7 @@ class SubProcessTemplate(ProcessStarter, ABC):
 
 class MediaServerProcessStarter(SubProcessTemplate):
     def __init__(self, source_repository: SourceRepository, stream_repository: StreamRepository):
-        super().__init__(stream_repository)
+        super().__init__(stream_repository, 'ms_feeder_pid')
         self.source_repository = source_repository
         self.docker_manager = DockerManager(stream_repository.connection)
 
@@ -125,6 +163,7 @@ class MediaServerProcessStarter(SubProcessTemplate):
 
     def _create_process(self, source_model: SourceModel, stream_model: StreamModel) -> any:
         ms_model, _ = self.docker_manager.run(stream_model.ms_type, stream_model.id)
+        self.ms_model = ms_model
         self.__wait_for(ms_model)
         ms_model.map_to(stream_model)
         source_model.ms_address = stream_model.ms_address
@@ -134,7 +173,7 @@ class MediaServerProcessStarter(SubProcessTemplate):
         args = cmd_builder.build_input()
         args.extend(cmd_builder.build_output())
         if not stream_model.is_mp_ffmpeg_pipe_reader_enabled():
-            proc = subprocess.Popen(args)  # do not use PIPE, otherwise FFmpeg recording process will be stuck.
+            proc = self.supervisor.open_process(args)  # do not use PIPE without draining, otherwise FFmpeg recording process will be stuck.
             logger.info(f'stream Media Server feeder subprocess has been opened at {datetime.now()}')
             stream_model.ms_feeder_pid = proc.pid
         else:
@@ -146,6 +185,9 @@ class MediaServerProcessStarter(SubProcessTemplate):
             options.width = stream_model.ffmpeg_reader_width
             options.height = stream_model.ffmpeg_reader_height
             options.pubsub_channel = f'ffrs{stream_model.id}'
+            if config.ffmpeg.pipe_reader_shm_enabled:
+                options.method = PushMethod.SHARED_MEMORY
+                options.shm_slot_count = config.ffmpeg.pipe_reader_shm_slot_count
 
             dr = MpFFmpegPipeReader(options, args)
             stream_model.ms_feeder_pid = dr.get_pid()
@@ -154,10 +196,17 @@ class MediaServerProcessStarter(SubProcessTemplate):
         stream_model.ms_feeder_args = ' '.join(args)
         return proc
 
+    def _get_updated_fields(self, stream_model: StreamModel) -> dict:
+        return {'ms_container_ports': stream_model.ms_container_ports, 'ms_image_name': stream_model.ms_image_name,
+                'ms_container_name': stream_model.ms_container_name, 'ms_address': stream_model.ms_address,
+                'ms_stream_address': stream_model.ms_stream_address, 'ms_container_commands': stream_model.ms_container_commands,
+                'ms_initialized': stream_model.ms_initialized, 'ms_feeder_pid': stream_model.ms_feeder_pid,
+                'ms_feeder_args': stream_model.ms_feeder_args}
+
 
 class HlsProcessStarter(SubProcessTemplate):
     def __init__(self, stream_repository: StreamRepository):
-        super().__init__(stream_repository)
+        super().__init__(stream_repository, 'hls_pid')
 
     @staticmethod
     def __wait_for(stream_model: StreamModel):
@@ -175,17 +224,20 @@ class HlsProcessStarter(SubProcessTemplate):
         self._wait_extra(stream_model)
         cmd_builder = CommandBuilder(source_model)
         args = cmd_builder.build_hls_stream()
-        proc = subprocess.Popen(args)
+        proc = self.supervisor.open_process(args)
         logger.info(f'stream HLS subprocess has been opened at {datetime.now()}')
         stream_model.hls_pid = proc.pid
         stream_model.hls_args = ' '.join(args)
         self.__wait_for(stream_model)
         return proc
 
+    def _get_updated_fields(self, stream_model: StreamModel) -> dict:
+        return {'hls_pid': stream_model.hls_pid, 'hls_args': stream_model.hls_args}
+
 
 class RecordProcessStarter(SubProcessTemplate):
     def __init__(self, stream_repository: StreamRepository):
-        super().__init__(stream_repository)
+        super().__init__(stream_repository, 'record_pid')
 
     def _create_process(self, source_model: SourceModel, stream_model: StreamModel) -> any:
         self._wait_extra(stream_model)
@@ -196,16 +248,19 @@ class RecordProcessStarter(SubProcessTemplate):
             length = len(svc_args)
             svc_args = svc_args[3:length]
             args.extend(svc_args)
-        proc = subprocess.Popen(args)
+        proc = self.supervisor.open_process(args)
         logger.info(f'recording subprocess has been opened at {datetime.now()}')
         stream_model.record_pid = proc.pid
         stream_model.record_args = ' '.join(args)
         return proc
 
+    def _get_updated_fields(self, stream_model: StreamModel) -> dict:
+        return {'record_pid': stream_model.record_pid, 'record_args': stream_model.record_args}
+
 
 class SnapshotProcessStarter(ProcessStarter):
     def __init__(self, stream_repository: StreamRepository):
-        super().__init__(stream_repository)
+        super().__init__(stream_repository, 'snapshot_pid')
 
     def _execute_process(self, ffmpeg_reader: any):
         ffmpeg_reader.read()
@@ -227,3 +282,6 @@ class SnapshotProcessStarter(ProcessStarter):
         stream_model.snapshot_pid = ffmpeg_reader.get_pid()
         logger.info(f'starting Snapshot process at {datetime.now()}')
         return ffmpeg_reader
+
+    def _get_updated_fields(self, stream_model: StreamModel) -> dict:
+        return {'snapshot_pid': stream_model.snapshot_pid}
@@ -58,6 +58,8 @@ class StreamModel:
 
         self.go2rtc_player_mode = Go2RtcPlayerMode.Mse
 
+        self.version: int = 0  # increased by every write (add and update_fields), it is used for the optimistic concurrency control
+
     def map_from_source(self, source: SourceModel):
         # noinspection DuplicatedCode
         self.id = source.id
@@ -1,15 +1,35 @@
 from __future__ import annotations
 
+from datetime import datetime
 from redis import Redis
 from typing import List
 
 from common.data.base_repository import BaseRepository
+from common.data.model_cache import ModelCache
+from common.utilities import logger
 from stream.stream_model import StreamModel
 
+# KEYS[1]: stream key, ARGV[1]: expected version or an empty string, ARGV[2..]: field/value pairs.
+# returns the new version, -1 if the stream does not exist and -2 if the version does not match.
+_update_fields_script = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+if ARGV[1] ~= '' then
+    local version = redis.call('HGET', KEYS[1], 'version') or '0'
+    if version ~= ARGV[1] then
+        return -2
+    end
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+return redis.call('HINCRBY', KEYS[1], 'version', 1)
+'''
+
 
 class StreamRepository(BaseRepository):
     def __init__(self, connection: Redis):
-        super().__init__(connection, 'streams:')
+        super().__init__(connection, 'streams:', 'streams_index')
+        self.update_fields_script = None
 
     def get_connection(self) -> Redis:
         return self.connection
@@ -17,14 +37,42 @@ class StreamRepository(BaseRepository):
     def _get_key(self, key: str):
         return f'{self.namespace}{key}'
 
+    # a full write increases the version too, so a compare-and-set update_fields which has read the stream before can not overwrite it
     def add(self, model: StreamModel) -> int:
         key = self._get_key(model.id)
         dic = self.to_redis(model)
-        return self.connection.hset(key, mapping=dic)
+        dic.pop('version', None)
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.hset(key, mapping=dic)
+        pipe.sadd(self.index_key, model.id)
+        pipe.hincrby(key, 'version', 1)
+        result, _, model.version = pipe.execute()
+        return result
 
     def remove(self, identifier: str) -> int:
         key = self._get_key(identifier)
-        return self.connection.delete(key)
+        return self._remove_indexed(key)
+
+    # writes only the given fields atomically instead of a get + add of the whole hash. A removed stream is not resurrected and
+    # if expected_version is given, the update is applied only if nobody else has updated the stream in between.
+    # returns the new version or 0 if nothing has been written.
+    def update_fields(self, identifier: str, expected_version: int | None = None, **fields) -> int:
+        if len(fields) == 0:
+            return 0
+        if self.update_fields_script is None:
+            self.update_fields_script = self.connection.register_script(_update_fields_script)
+        args = ['' if expected_version is None else str(expected_version)]
+        for field, value in self.to_redis_fields(StreamModel(), fields).items():
+            args.append(field)
+            args.append(value)
+        result = int(self.update_fields_script(keys=[self._get_key(identifier)], args=args))
+        if result == -1:
+            logger.warning(f'stream ({identifier}) could not be found, the fields ({", ".join(fields)}) have not been updated at {datetime.now()}')
+            return 0
+        elif result == -2:
+            logger.warning(f'stream ({identifier}) has been updated by another writer, the fields ({", ".join(fields)}) have not been updated at {datetime.now()}')
+            return 0
+        return result
 
     def get(self, identifier: str) -> StreamModel | None:
         key = self._get_key(identifier)
@@ -34,17 +82,43 @@ class StreamRepository(BaseRepository):
         model: StreamModel = self.from_redis(StreamModel(), dic)
         return model
 
-    def get_all(self) -> List[StreamModel]:
-        models: List[StreamModel] = []
-        keys = self.connection.keys(self.namespace + '*')
-        for key in keys:
-            dic = self.connection.hgetall(key)
-            model: StreamModel = self.from_redis(StreamModel(), dic)
-            models.append(model)
-        return models
+    def get_all(self, fields: List[str] | None = None) -> List[StreamModel]:
+        return self._get_all_indexed(StreamModel, fields)
 
     def delete_by_namespace(self) -> int:
         result = 0
         for key in self.connection.scan_iter(self.namespace + '*'):
             result += self.connection.delete(key)
+        self.connection.delete(self.index_key)
+        return result
+
+
+class CachedStreamRepository(StreamRepository):
+    def __init__(self, connection: Redis):
+        super().__init__(connection)
+        self.cache = ModelCache.get_instance(self.namespace)
+
+    def add(self, model: StreamModel) -> int:
+        result = super().add(model)
+        self.cache.invalidate(model.id)
         return result
+
+    def remove(self, identifier: str) -> int:
+        result = super().remove(identifier)
+        self.cache.invalidate(identifier)
+        return result
+
+    def update_fields(self, identifier: str, expected_version: int | None = None, **fields) -> int:
+        result = super().update_fields(identifier, expected_version, **fields)
+        self.cache.invalidate(identifier)
+        return result
+
+    def get(self, identifier: str) -> StreamModel | None:
+        model = self.cache.get(identifier)
+        if model is not None:
+            return model
+        generation = self.cache.get_generation()
+        model = super().get(identifier)
+        if model is not None:
+            self.cache.put(identifier, model, generation)
+        return model
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 from common.data.source_model import SourceModel
 from common.utilities import datetime_now
@@ -15,6 +15,12 @@ class WatchDogOperations(str, Enum):
     check_source_state_conflict = 'check_source_state_conflict'
 
 
+class CircuitState(IntEnum):
+    Closed = 0
+    Open = 1
+    HalfOpen = 2
+
+
 class FailedStreamModel:
     def __init__(self):
         self.id: str = ''
@@ -32,6 +38,12 @@ class FailedStreamModel:
         self.source_state_conflict_count: int = 0
         self.last_check_at: str = ''
 
+        # restart governor state, see RestartGovernor
+        self.consecutive_failure_count: int = 0
+        self.circuit_state: CircuitState = CircuitState.Closed
+        self.next_restart_at: float = 0.  # epoch seconds
+        self.last_restart_at: float = 0.
+
     def map_from_source(self, source: SourceModel):
         self.id = source.id
         self.brand = source.brand
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from typing import Any, Callable, List
 from redis.client import Redis
 
 from common.data.base_repository import BaseRepository
@@ -8,7 +9,7 @@ from sustain.failed_stream.failed_stream_model import FailedStreamModel
 
 class FailedStreamRepository(BaseRepository):
     def __init__(self, connection: Redis):
-        super().__init__(connection, 'failed_streams:')
+        super().__init__(connection, 'failed_streams:', 'failed_streams_index')
 
     def _get_key(self, identifier: str) -> str:
         return f'{self.namespace}{identifier}'
@@ -16,13 +17,14 @@ class FailedStreamRepository(BaseRepository):
     def add(self, model: FailedStreamModel):
         key = self._get_key(model.id)
         dic = self.to_redis(model)
-        self.connection.hset(key, mapping=dic)
+        self._add_indexed(key, dic)
 
     def remove_all(self) -> int:
         r = self.connection
         count = 0
         for key in r.scan_iter(f'{self.namespace}*'):
             count += r.delete(key)
+        r.delete(self.index_key)
         return count
 
     def get(self, identifier: str) -> FailedStreamModel | None:
@@ -31,3 +33,22 @@ class FailedStreamRepository(BaseRepository):
         if not dic:
             return None
         return self.from_redis(FailedStreamModel(), dic)
+
+    def get_all(self) -> List[FailedStreamModel]:
+        return self._get_all_indexed(FailedStreamModel)
+
+    # read-modify-write under WATCH, it is retried if the hash is changed by another writer (i.e. another process) in between.
+    # returns the result of fn.
+    def update(self, identifier: str, model_factory: Callable[[], FailedStreamModel], fn: Callable[[FailedStreamModel], Any]) -> Any:
+        key = self._get_key(identifier)
+
+        def transaction_fn(pipe) -> Any:
+            dic = pipe.hgetall(key)
+            model = self.from_redis(FailedStreamModel(), dic) if dic else model_factory()
+            result = fn(model)
+            pipe.multi()
+            pipe.hset(key, mapping=self.to_redis(model))
+            pipe.sadd(self.index_key, identifier)
+            return result
+
+        return self.connection.transaction(transaction_fn, key, value_from_callable=True)
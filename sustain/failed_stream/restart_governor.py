@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import random
+import time
+from datetime import datetime
+from threading import Lock, Timer
+from typing import Callable, List, Set
+from redis.client import Redis
+
+from common.data.source_model import SourceModel
+from common.utilities import logger, config
+from stream.stream_model import StreamModel
+from sustain.failed_stream.failed_stream_model import FailedStreamModel, CircuitState, WatchDogOperations
+from sustain.failed_stream.failed_stream_repository import FailedStreamRepository
+
+
+# decides whether a restart_stream_request can be published for a source. Consecutive restarts are delayed by an exponential backoff
+# with jitter, and after restart_circuit_threshold consecutive failures the circuit is opened, so a dead camera does not create
+# containers and FFmpeg processes forever. An open circuit allows one half-open probe restart per restart_circuit_open_interval.
+# The state is kept on FailedStreamModel, so the watchdog, the supervisor and the recurrent jobs share it across the processes.
+class RestartGovernor:
+    def __init__(self, connection: Redis):
+        self.failed_stream_repository = FailedStreamRepository(connection)
+        c = config.ffmpeg
+        self.backoff_initial: float = max(c.restart_backoff_initial, 0.)
+        self.backoff_max: float = max(c.restart_backoff_max, self.backoff_initial)
+        self.backoff_jitter: float = min(max(c.restart_backoff_jitter, 0.), 1.)
+        self.circuit_threshold: int = c.restart_circuit_threshold
+        self.circuit_open_interval: float = max(c.restart_circuit_open_interval, 1.)
+        self.stable_interval: float = c.restart_stable_interval
+        self.deferred_ids: Set[str] = set()  # the sources which have a retry timer in this process
+        self.deferred_lock = Lock()
+
+    def __get_backoff(self, failure_count: int) -> float:
+        delay = min(self.backoff_initial * (2 ** min(max(failure_count - 1, 0), 16)), self.backoff_max)
+        return delay * (1. + random.uniform(-self.backoff_jitter, self.backoff_jitter))
+
+    def __decide(self, model: FailedStreamModel, op: WatchDogOperations | None, failure: bool) -> bool:
+        if op is not None:
+            model.set_failed_count(op)
+        now = time.time()
+        if now < model.next_restart_at:
+            return False
+        if not failure:  # i.e. a changed ip address, it does not spend the backoff budget or change the circuit
+            model.last_restart_at = now
+            return True
+        if model.circuit_state != CircuitState.Closed:
+            model.circuit_state = CircuitState.HalfOpen
+            model.next_restart_at = now + self.circuit_open_interval
+            model.last_restart_at = now
+            logger.warning(f'restart circuit of {model.id} is half-open, a probe restart is allowed at {datetime.now()}')
+            return True
+        model.consecutive_failure_count += 1
+        if 0 < self.circuit_threshold <= model.consecutive_failure_count:
+            model.circuit_state = CircuitState.Open
+            model.next_restart_at = now + self.circuit_open_interval
+            logger.error(f'restart circuit of {model.id} has been opened after {model.consecutive_failure_count} consecutive failures, '
+                         f'the next probe restart is in {self.circuit_open_interval} seconds')
+            return False
+        model.next_restart_at = now + self.__get_backoff(model.consecutive_failure_count)
+        model.last_restart_at = now
+        return True
+
+    # op is also counted on the failed stream model, in the same transaction. failure is False for the restarts which are not caused by
+    # a broken stream, they only wait for a pending backoff.
+    def try_acquire(self, source_model: SourceModel, op: WatchDogOperations | None = None, failure: bool = True) -> bool:
+        allowed = self.failed_stream_repository.update(source_model.id, lambda: FailedStreamModel().map_from_source(source_model),
+                                                       lambda model: self.__decide(model, op, failure))
+        if not allowed:
+            logger.warning(f'restart of {source_model.id} ({source_model.name}) has been deferred by the restart governor at {datetime.now()}')
+        return allowed
+
+    # publishes the restart if it is allowed, otherwise retries it when the governor's delay has elapsed instead of dropping it.
+    # get_source returns the current source model or None if it has been removed. Returns True if the restart has been published now.
+    def acquire_or_defer(self, source_model: SourceModel, publish: Callable[[SourceModel], None], get_source: Callable[[], SourceModel | None],
+                         op: WatchDogOperations | None = None, failure: bool = True) -> bool:
+        if self.try_acquire(source_model, op, failure):
+            publish(source_model)
+            return True
+        with self.deferred_lock:
+            if source_model.id in self.deferred_ids:
+                return False
+            self.deferred_ids.add(source_model.id)
+        model = self.failed_stream_repository.get(source_model.id)
+        delay = max(model.next_restart_at - time.time(), 1.) if model is not None else 1.
+        timer = Timer(delay, self.__retry, [source_model.id, publish, get_source, failure])
+        timer.daemon = True
+        timer.start()
+        logger.info(f'restart of {source_model.id} will be retried in {delay:.1f} seconds')
+        return False
+
+    # op has already been counted by the deferred attempt
+    def __retry(self, source_id: str, publish: Callable[[SourceModel], None], get_source: Callable[[], SourceModel | None], failure: bool):
+        with self.deferred_lock:
+            self.deferred_ids.discard(source_id)
+        try:
+            source_model = get_source()
+            if source_model is None:
+                return
+            self.acquire_or_defer(source_model, publish, get_source, None, failure)
+        except BaseException as ex:
+            logger.error(f'an error occurred while retrying a deferred restart of {source_id}, err: {ex}')
+
+    def __reset(self, model: FailedStreamModel) -> bool:
+        if model.consecutive_failure_count == 0 and model.circuit_state == CircuitState.Closed:
+            return False
+        if time.time() - model.last_restart_at < self.stable_interval:
+            return False
+        model.consecutive_failure_count = 0
+        model.circuit_state = CircuitState.Closed
+        model.next_restart_at = 0.
+        return True
+
+    # called by the watchdog on every tick, the streams which have been working since their last restart get a closed circuit back
+    def reset_recovered(self, stream_models: List[StreamModel], broken_streams: List[StreamModel]):
+        broken_ids: Set[str] = {stream_model.id for stream_model in broken_streams}
+        running_ids: Set[str] = {stream_model.id for stream_model in stream_models if stream_model.id not in broken_ids}
+        for model in self.failed_stream_repository.get_all():
+            if model.id not in running_ids or (model.consecutive_failure_count == 0 and model.circuit_state == CircuitState.Closed):
+                continue
+            if self.failed_stream_repository.update(model.id, lambda: model, self.__reset):
+                logger.info(f'restart governor state of {model.id} has been reset since it has been working stably at {datetime.now()}')
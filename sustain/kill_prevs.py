@@ -6,13 +6,14 @@ from redis.client import Redis
 
 from common.utilities import logger
 from media_server.docker_manager import DockerManager
-from media_server.media_server_models import MediaServerImages, inc_namespace, ports_count
+from media_server.media_server_models import MediaServerImages
+from media_server.port_allocator import PortAllocator
 from stream.stream_repository import StreamRepository
 
 
 def kill_all_mp_ffmpeg_reader_owner_procs(connection_main: Redis):
     rep = StreamRepository(connection_main)
-    streams = rep.get_all()
+    streams = rep.get_all(['id', 'stream_type', 'mp_ffmpeg_reader_owner_pid'])
     for stream in streams:
         if stream.is_mp_ffmpeg_pipe_reader_enabled():
             try:
@@ -35,7 +36,10 @@ def kill_all_prev_ffmpeg_procs():
 
 
 def reset_ms_container_ports(connection_main: Redis):
-    connection_main.hset(inc_namespace, ports_count, 0)
+    PortAllocator(connection_main).reset()
+    docker_manager = DockerManager(connection_main)
+    docker_manager.pool.reset()  # the pool and shared containers are removed by remove_all_prev_ms_containers
+    docker_manager.shared.reset()
 
 
 def remove_all_prev_ms_containers(connection_main: Redis):
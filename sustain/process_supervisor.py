@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import time
+from datetime import datetime
+from threading import Lock, Timer
+from typing import Dict, List, Set
+
+from common.data.source_repository import SourceRepository
+from common.event_bus.event_bus import EventBus
+from common.utilities import crate_redis_connection, RedisDb, logger, config, datetime_now
+from stream.stream_repository import StreamRepository
+from sustain.failed_stream.failed_stream_model import WatchDogOperations
+from sustain.failed_stream.restart_governor import RestartGovernor
+from utils.json_serializer import serialize_json_dic
+from utils.utils import start_thread
+
+
+_pid_field_operations: Dict[str, WatchDogOperations] = {
+    'ms_feeder_pid': WatchDogOperations.check_ms_feeder_process,
+    'hls_pid': WatchDogOperations.check_hls_process,
+    'record_pid': WatchDogOperations.check_record_process,
+    'snapshot_pid': WatchDogOperations.check_snapshot_process,
+}
+
+
+class ProcessExitModel:
+    def __init__(self):
+        self.id: str = ''
+        self.name: str = ''
+        self.process: str = ''  # the pid field of the stream, i.e. hls_pid
+        self.pid: int = 0
+        self.exit_code: int = 0  # -1 if it is not available, i.e. the pipe reader processes
+        self.stderr: str = ''
+        self.crashed: bool = False
+        self.restart_delay: float = 0.
+        self.created_at: str = datetime_now()
+
+
+# receives the exits of the processes which are started by ProcessStarter as soon as their waits return, instead of waiting for
+# the watchdog to poll them. An exit is a crash only if the stream still exists with the same pid, the stop and restart operations
+# remove or replace the stream before they kill the processes.
+class ProcessSupervisor:
+    __instance: ProcessSupervisor | None = None
+    __instance_pid: int = 0
+    __instance_lock = Lock()
+
+    def __init__(self):
+        connection_main = crate_redis_connection(RedisDb.MAIN)
+        self.stream_repository = StreamRepository(connection_main)
+        self.source_repository = SourceRepository(connection_main)
+        self.restart_governor = RestartGovernor(connection_main)
+        self.exit_event_bus = EventBus('process_exit')
+        self.restart_event_bus = EventBus('restart_stream_request')
+        self.enabled: bool = config.ffmpeg.process_supervisor_enabled
+        self.backoff_initial: float = max(config.ffmpeg.process_supervisor_backoff_initial, .1)
+        self.backoff_max: float = max(config.ffmpeg.process_supervisor_backoff_max, self.backoff_initial)
+        self.stable_interval: float = config.ffmpeg.process_supervisor_stable_interval
+        self.stderr_tail_size: int = max(config.ffmpeg.process_supervisor_stderr_tail_size, 256)
+        self.lock = Lock()
+        self.failures: Dict[str, int] = {}
+        self.pending_restarts: Set[str] = set()
+        self.stderr_tails: Dict[int, bytearray] = {}
+
+    @staticmethod
+    def get_instance() -> ProcessSupervisor:
+        pid = os.getpid()
+        with ProcessSupervisor.__instance_lock:
+            if ProcessSupervisor.__instance is None or ProcessSupervisor.__instance_pid != pid:
+                ProcessSupervisor.__instance = ProcessSupervisor()
+                ProcessSupervisor.__instance_pid = pid
+            return ProcessSupervisor.__instance
+
+    # stderr is captured only while supervising, it is drained continuously and only its tail is kept. Otherwise, FFmpeg gets stuck
+    # on a full pipe.
+    def open_process(self, args: List[str]) -> subprocess.Popen:
+        if not self.enabled:
+            return subprocess.Popen(args)
+        proc = subprocess.Popen(args, stderr=subprocess.PIPE)
+        with self.lock:
+            self.stderr_tails[proc.pid] = bytearray()
+        start_thread(self.__drain, [proc])
+        return proc
+
+    def __drain(self, proc: subprocess.Popen):
+        try:
+            while True:
+                chunk = proc.stderr.read1(4096)
+                if not chunk:
+                    break
+                with self.lock:
+                    tail = self.stderr_tails.get(proc.pid)
+                    if tail is None:
+                        continue
+                    tail.extend(chunk)
+                    if len(tail) > self.stderr_tail_size:
+                        del tail[:len(tail) - self.stderr_tail_size]
+        except BaseException as ex:
+            logger.error(f'an error occurred while draining stderr of a process ({proc.pid}), err: {ex}')
+
+    def __pop_stderr_tail(self, pid: int) -> str:
+        with self.lock:
+            tail = self.stderr_tails.pop(pid, None)
+        if not tail:
+            return ''
+        lines = [line for line in tail.decode('utf-8', errors='replace').replace('\r', '\n').split('\n') if line.strip()]
+        return '\n'.join(lines[-20:])
+
+    def __get_restart_delay(self, stream_id: str, uptime: float) -> float:
+        with self.lock:
+            if uptime >= self.stable_interval:
+                self.failures[stream_id] = 0
+            count = self.failures.get(stream_id, 0)
+            self.failures[stream_id] = count + 1
+        return min(self.backoff_initial * (2 ** min(count, 16)), self.backoff_max)
+
+    def on_exit(self, stream_id: str, pid_field: str, pid: int, exit_code: int | None, started_at: float):
+        stderr = self.__pop_stderr_tail(pid)
+        if not self.enabled or not stream_id or pid <= 0:
+            return
+        stream_model = self.stream_repository.get(stream_id)
+        model = ProcessExitModel()
+        model.id = stream_id
+        model.name = stream_model.name if stream_model is not None else ''
+        model.process = pid_field
+        model.pid = pid
+        model.exit_code = exit_code if exit_code is not None else -1
+        model.stderr = stderr
+        model.crashed = stream_model is not None and getattr(stream_model, pid_field, 0) == pid
+        if model.crashed:
+            model.restart_delay = self.__get_restart_delay(stream_id, time.monotonic() - started_at)
+        self.exit_event_bus.publish_async(serialize_json_dic(model.__dict__))
+        if not model.crashed:
+            logger.info(f'a supervised process ({pid_field}: {pid}) of {stream_id} has exited because the stream was stopped or restarted')
+            return
+        logger.warning(f'a supervised process ({pid_field}: {pid}) of {stream_id} has crashed with exit code {model.exit_code}, '
+                       f'the stream will be restarted in {model.restart_delay} seconds at {datetime.now()}')
+        with self.lock:
+            if stream_id in self.pending_restarts:  # the other processes of the same stream exit together
+                return
+            self.pending_restarts.add(stream_id)
+        timer = Timer(model.restart_delay, self.__restart, [stream_id, pid_field, pid])
+        timer.daemon = True
+        timer.start()
+
+    def __restart(self, stream_id: str, pid_field: str, pid: int):
+        try:
+            with self.lock:
+                self.pending_restarts.discard(stream_id)
+            stream_model = self.stream_repository.get(stream_id)
+            if stream_model is None or getattr(stream_model, pid_field, 0) != pid:
+                logger.info(f'stream ({stream_id}) has already been stopped or restarted, the supervisor restart is skipped')
+                return
+            source_model = self.source_repository.get(stream_id)
+            if source_model is None:
+                return
+            if not self.restart_governor.try_acquire(source_model, _pid_field_operations.get(pid_field)):
+                return
+            self.restart_event_bus.publish_async(serialize_json_dic(source_model.__dict__))
+            logger.warning(f'a restart request has been published by the process supervisor for {stream_id} at {datetime.now()}')
+        except BaseException as ex:
+            logger.error(f'an error occurred while restarting a supervised stream ({stream_id}), err: {ex}')
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List
+import psutil
+
+from common.utilities import logger
+
+
+class ProcessInfo:
+    def __init__(self, proc: psutil.Process):
+        self.proc = proc
+        self.pid: int = proc.info['pid']
+        self.name: str = proc.info['name'] or ''
+        self.status: str = proc.info['status'] or ''
+        self.ppid: int = proc.info['ppid'] or 0
+        self.__rss: int | None = None
+        self.__cmdline: List[str] | None = None
+
+    # memory and cmdline are read from /proc only if a check needs them, and only once per snapshot
+    def get_rss(self) -> int:
+        if self.__rss is None:
+            try:
+                self.__rss = self.proc.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                self.__rss = 0
+        return self.__rss
+
+    def get_cmdline(self) -> List[str]:
+        if self.__cmdline is None:
+            try:
+                self.__cmdline = self.proc.cmdline()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                self.__cmdline = []
+        return self.__cmdline
+
+
+# one walk over the process table per watchdog tick, every check of the tick queries this snapshot instead of psutil
+class ProcessTable:
+    def __init__(self, processes: Dict[int, ProcessInfo]):
+        self.processes: Dict[int, ProcessInfo] = processes
+        self.created_at = datetime.now()
+
+    @staticmethod
+    def take() -> ProcessTable:
+        processes: Dict[int, ProcessInfo] = {}
+        for proc in psutil.process_iter(attrs=['pid', 'name', 'status', 'ppid']):
+            processes[proc.info['pid']] = ProcessInfo(proc)
+        logger.info(f'a process table snapshot has been taken ({len(processes)} processes) at {datetime.now()}')
+        return ProcessTable(processes)
+
+    def get(self, pid: int) -> ProcessInfo | None:
+        return self.processes.get(pid)
+
+    # a process which has been started after the snapshot is not in the table, so a miss is confirmed by psutil
+    def pid_exists(self, pid: int) -> bool:
+        if pid in self.processes:
+            return True
+        return psutil.pid_exists(pid)
+
+    def get_rss(self, pid: int) -> int:
+        info = self.processes.get(pid)
+        if info is not None:
+            return info.get_rss()
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return 0
+
+    def get_by_name(self, name: str) -> List[ProcessInfo]:
+        return [info for info in self.processes.values() if info.name == name]
@@ -0,0 +1,23 @@
+from redis.client import Redis
+
+from common.utilities import logger, crate_redis_connection, RedisDb
+from stream.stream_repository import StreamRepository
+from sustain.failed_stream.failed_stream_repository import FailedStreamRepository
+from sustain.rec_stuck.rec_stuck_repository import RecStuckRepository
+from sustain.task.task_repository import TaskRepository
+
+
+# sources are written by the web application, so SourceRepository still enumerates them by SCAN and has no index.
+def rebuild_indexes(connection_main: Redis):
+    repositories = [StreamRepository(connection_main), RecStuckRepository(connection_main), FailedStreamRepository(connection_main),
+                    TaskRepository(connection_main)]
+    for repository in repositories:
+        try:
+            count = repository.rebuild_index()
+            logger.warning(f'{repository.index_key} has been rebuilt with {count} entries')
+        except BaseException as ex:
+            logger.error(f'an error occurred while rebuilding {repository.index_key}, err: {ex}')
+
+
+if __name__ == '__main__':  # python3 -m sustain.rebuild_indexes --redis-host 127.0.0.1 --redis-port 6379
+    rebuild_indexes(crate_redis_connection(RedisDb.MAIN))
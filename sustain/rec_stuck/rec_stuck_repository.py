@@ -9,7 +9,7 @@ from sustain.rec_stuck.rec_stuck_model import RecStuckModel
 
 class RecStuckRepository(BaseRepository):
     def __init__(self, connection: Redis):
-        super().__init__(connection, 'recstucks:')
+        super().__init__(connection, 'recstucks:', 'recstucks_index')
 
     def _get_key(self, identifier: str) -> str:
         return f'{self.namespace}{identifier}'
@@ -17,27 +17,22 @@ class RecStuckRepository(BaseRepository):
     def add(self, model: RecStuckModel):
         key = self._get_key(model.id)
         dic = self.to_redis(model)
-        self.connection.hset(key, mapping=dic)
+        self._add_indexed(key, dic)
 
     def remove_all(self) -> int:
         r = self.connection
         count = 0
         for key in r.scan_iter(f'{self.namespace}*'):
             count += r.delete(key)
+        r.delete(self.index_key)
         return count
 
     def remove(self, model: RecStuckModel) -> int:
         key = self._get_key(model.id)
-        return self.connection.delete(key)
+        return self._remove_indexed(key)
 
     def get_all(self) -> List[RecStuckModel]:
-        models: List[RecStuckModel] = []
-        keys = self.connection.keys(f'{self.namespace}*')
-        for key in keys:
-            dic = self.connection.hgetall(key)
-            model: RecStuckModel = self.from_redis(RecStuckModel(), dic)
-            models.append(model)
-        return models
+        return self._get_all_indexed(RecStuckModel)
 
     def get(self, identifier: str) -> RecStuckModel | None:
         key = self._get_key(identifier)
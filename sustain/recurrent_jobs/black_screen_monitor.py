@@ -9,6 +9,7 @@ from stream.stream_model import StreamModel
 from stream.stream_repository import StreamRepository
 from sustain.failed_stream.failed_stream_model import WatchDogOperations
 from sustain.failed_stream.notify_failed_stream_model import NotifyFailedStreamModel
+from sustain.failed_stream.restart_governor import RestartGovernor
 from utils.json_serializer import serialize_json_dic
 
 
@@ -19,11 +20,17 @@ class BlackScreenMonitor:
         self.interval = float(max(config.jobs.black_screen_monitor_interval, 10))
         self.restart_stream_event_bus = EventBus('restart_stream_request')
         self.notify_failed_event_bus = EventBus('notify_failed')
+        self.restart_governor = RestartGovernor(source_repository.connection)
 
     def __publish_restart(self, source_model: SourceModel):
         logger.warning(f'BlackScreenMonitor: a broken stream({source_model.id}/{source_model.name}) has been found and restart event will be triggered')
         self.restart_stream_event_bus.publish(serialize_json_dic(source_model.__dict__))
 
+    def __restart(self, source_model: SourceModel, stream_model: StreamModel):
+        self.__publish_restart(source_model)
+        time.sleep(1.)
+        self.__publish_failed_notification(stream_model)
+
     def __publish_failed_notification(self, stream_model: StreamModel):
         model = NotifyFailedStreamModel().map_from(WatchDogOperations.check_ms_feeder_process, stream_model)
         self.notify_failed_event_bus.publish_async(serialize_json_dic(model.__dict__))
@@ -50,8 +57,8 @@ class BlackScreenMonitor:
                     logger.info(f'BlackScreenMonitor: ({source_id}/{stream_model.name}) has been probed successfully')
                 except BaseException as ex:
                     logger.error(f'BlackScreenMonitor: an error occurred while probing for source ({source_id}/{stream_model.name}), ex: {ex}')
-                    self.__publish_restart(source_model)
-                    time.sleep(1.)
-                    self.__publish_failed_notification(stream_model)
+                    self.restart_governor.acquire_or_defer(source_model, lambda model, sm=stream_model: self.__restart(model, sm),
+                                                           lambda sid=source_id: self.source_repository.get(sid),
+                                                           WatchDogOperations.check_ms_feeder_process)
                 time.sleep(1.)
             time.sleep(self.interval)
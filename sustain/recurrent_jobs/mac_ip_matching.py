@@ -7,6 +7,7 @@ from getmac import get_mac_address
 from common.data.source_repository import SourceRepository
 from common.event_bus.event_bus import EventBus
 from common.utilities import logger
+from sustain.failed_stream.restart_governor import RestartGovernor
 from utils.json_serializer import serialize_json_dic
 
 
@@ -14,6 +15,7 @@ class MacIpMatching:
     def __init__(self, source_repository: SourceRepository):
         self.source_repository: SourceRepository = source_repository
         self.restart_stream_event_bus = EventBus('restart_stream_request')
+        self.restart_governor = RestartGovernor(source_repository.connection)
         self.ip_pattern = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
         self.last_check = datetime.now()
 
@@ -115,8 +117,12 @@ class MacIpMatching:
                 source_model.ip_address = ''
                 source_model.mac_address = ''
                 self.source_repository.add(source_model)
-                self.__publish_restart(self.source_repository.get(source_model.id))
-                time.sleep(1.)
+                source_id = source_model.id
+                source_model = self.source_repository.get(source_id)
+                # a changed ip address is not a failure of the stream, it only waits for a pending backoff of the governor
+                if source_model is not None and self.restart_governor.acquire_or_defer(source_model, self.__publish_restart,
+                                                                                       lambda: self.source_repository.get(source_id), failure=False):
+                    time.sleep(1.)
 
     def __publish_restart(self, source_model):
         dic = source_model.__dict__
@@ -3,26 +3,22 @@ from enum import IntEnum
 
 class TaskOp(IntEnum):
     none = 0
-    listen_start_stream_event = 1
-    listen_stop_stream_event = 2
-    listen_restart_stream_event = 3
     listen_editor_event = 4
     listen_various_events = 5
     watchdog = 6
     schedule_video_file_indexer = 7
     execute_various_jobs = 8
+    listen_stream_events = 9  # 1, 2 and 3 were the start, stop and restart listeners which are merged into it
 
     @staticmethod
     def create_dict():
         return {
-            TaskOp.listen_start_stream_event: 'listen_start_stream_event',
-            TaskOp.listen_stop_stream_event: 'listen_stop_stream_event',
-            TaskOp.listen_restart_stream_event: 'listen_restart_stream_event',
             TaskOp.listen_editor_event: 'listen_editor_event',
             TaskOp.listen_various_events: 'listen_various_events',
             TaskOp.watchdog: 'watchdog',
             TaskOp.schedule_video_file_indexer: 'schedule_video_file_indexer',
-            TaskOp.execute_various_jobs: 'execute_various_jobs'
+            TaskOp.execute_various_jobs: 'execute_various_jobs',
+            TaskOp.listen_stream_events: 'listen_stream_events'
         }
 
     @staticmethod
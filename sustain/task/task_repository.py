@@ -9,7 +9,7 @@ from sustain.task.task_model import TaskModel, TaskOp
 
 class TaskRepository(BaseRepository):
     def __init__(self, connection: Redis):
-        super().__init__(connection, 'tasks:')
+        super().__init__(connection, 'tasks:', 'tasks_index')
 
     def _get_key(self, identifier: TaskOp) -> str:
         return f'{self.namespace}{identifier}'
@@ -17,23 +17,18 @@ class TaskRepository(BaseRepository):
     def add(self, model: TaskModel):
         key = self._get_key(model.op)
         dic = self.to_redis(model)
-        self.connection.hset(key, mapping=dic)
+        self._add_indexed(key, dic)
 
     def remove_all(self) -> int:
         r = self.connection
         count = 0
         for key in r.scan_iter(f'{self.namespace}*'):
             count += r.delete(key)
+        r.delete(self.index_key)
         return count
 
     def get_all(self) -> List[TaskModel]:
-        models: List[TaskModel] = []
-        keys = self.connection.keys(f'{self.namespace}*')
-        for key in keys:
-            dic = self.connection.hgetall(key)
-            model: TaskModel = self.from_redis(TaskModel(), dic)
-            models.append(model)
-        return models
+        return self._get_all_indexed(TaskModel)
 
     def get(self, identifier: TaskOp) -> TaskModel | None:
         key = self._get_key(identifier)
@@ -10,8 +10,7 @@ from rq.command import send_stop_job_command, send_kill_horse_command, send_shut
 from rq.job import Job, get_current_job, Retry
 
 from common.utilities import crate_redis_connection, RedisDb, logger, config
-from event_listeners_and_jobs import listen_editor_event, listen_start_stream_event, listen_stop_stream_event, listen_restart_stream_event, \
-    listen_various_events, execute_various_jobs
+from event_listeners_and_jobs import listen_editor_event, listen_stream_events, listen_various_events, execute_various_jobs
 from sustain.failed_stream.failed_stream_repository import FailedStreamRepository
 from sustain.failed_stream.zombie_repository import ZombieRepository
 from sustain.rec_stuck.rec_stuck_repository import RecStuckRepository
@@ -32,9 +31,7 @@ __watchdog = WatchDogTimer(__connection_main)
 
 __max_retry = Retry(max=sys.maxsize)
 __func_dic = {
-    TaskOp.listen_start_stream_event: listen_start_stream_event,
-    TaskOp.listen_stop_stream_event: listen_stop_stream_event,
-    TaskOp.listen_restart_stream_event: listen_restart_stream_event,
+    TaskOp.listen_stream_events: listen_stream_events,
     TaskOp.listen_editor_event: listen_editor_event,
     TaskOp.listen_various_events: listen_various_events,
     TaskOp.watchdog: __watchdog.start,
@@ -147,16 +144,13 @@ def clean_my_previous():
 # noinspection DuplicatedCode
 def add_tasks():
     task = TaskModel()
-    task.set_op(TaskOp.listen_start_stream_event)
-    __task_repository.add(task)
-    task.set_op(TaskOp.listen_stop_stream_event)
-    __task_repository.add(task)
-    task.set_op(TaskOp.listen_restart_stream_event)
-    __task_repository.add(task)
-    task.set_op(TaskOp.listen_editor_event)
-    __task_repository.add(task)
-    task.set_op(TaskOp.listen_various_events)
-    __task_repository.add(task)
+    if not config.event_bus.async_listeners_enabled:  # otherwise, the main process listens all the request channels on its event loop
+        task.set_op(TaskOp.listen_stream_events)
+        __task_repository.add(task)
+        task.set_op(TaskOp.listen_editor_event)
+        __task_repository.add(task)
+        task.set_op(TaskOp.listen_various_events)
+        __task_repository.add(task)
     task.set_op(TaskOp.watchdog)
     __task_repository.add(task)
     task.set_op(TaskOp.schedule_video_file_indexer)
@@ -1,4 +1,11 @@
-from common.utilities import crate_redis_connection, RedisDb, config
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from common.utilities import crate_redis_connection, RedisDb, config, logger
+from record.segment_catalog import SegmentCatalog
+from record.segment_watcher import SegmentWatcher
 from record.video_file_indexer import VideoFileIndexer
 from stream.stream_repository import StreamRepository
 from sustain.scheduler import setup_scheduler
@@ -7,14 +14,71 @@ __connection_main = crate_redis_connection(RedisDb.MAIN)
 __stream_repository = StreamRepository(__connection_main)
 __vfi = VideoFileIndexer(__stream_repository)
 __interval = config.ffmpeg.record_video_file_indexer_interval
+# the files of a source are moved and published in order by one task, the sources are indexed concurrently
+__executor = ThreadPoolExecutor(max_workers=max(config.ffmpeg.record_video_file_indexer_max_workers, 1))
+__check_lock = Lock()  # the async scheduler can start a run while the previous one is still draining a backlog
+__last_prune_at = 0.
+
+
+def __on_segment_closed(source_id: str, filename: str, closed: bool):
+    __executor.submit(__index_file, source_id, filename, closed)
+
+
+def __index_file(source_id: str, filename: str, closed: bool):
+    try:
+        if __vfi.index_file(source_id, filename, closed):
+            logger.info(f'a closed segment ({filename}) of {source_id} has been indexed at {datetime.now()}')
+    except BaseException as ex:
+        logger.error(f'an error occurred while indexing a closed segment ({filename}) of {source_id}, err: {ex}')
+
+
+__segment_watcher = SegmentWatcher(__on_segment_closed)
 
 
 def schedule_video_file_indexer():
+    if config.ffmpeg.record_segment_watcher_enabled:
+        __segment_watcher.start()
+        __check()  # the watches are added by the first reconciliation
     setup_scheduler(__interval, __check, True)
 
 
+def __move(stream_model):
+    try:
+        return __vfi.move(stream_model)
+    except BaseException as ex:
+        logger.error(f'an error occurred while indexing the video files of {stream_model.id}, err: {ex}')
+        return 0, 0
+
+
+def __prune_catalog():
+    global __last_prune_at
+    catalog = SegmentCatalog.get_instance()
+    if catalog is None or time.monotonic() - __last_prune_at < config.ffmpeg.record_segment_catalog_prune_interval:
+        return
+    __last_prune_at = time.monotonic()
+    try:
+        removed = catalog.remove_missing()
+        if removed > 0:
+            logger.info(f'{removed} deleted segments have been removed from the segment catalog at {datetime.now()}')
+    except BaseException as ex:
+        logger.error(f'an error occurred while pruning the segment catalog, err: {ex}')
+
+
 def __check():
-    stream_models = __stream_repository.get_all()
-    for stream_model in stream_models:
-        if stream_model.is_record_enabled():
-            __vfi.move(stream_model)
+    if not __check_lock.acquire(blocking=False):
+        logger.warning(f'the previous video file indexer run is still in progress, skipping at {datetime.now()}')
+        return
+    try:
+        started_at = time.monotonic()
+        stream_models = [sm for sm in __stream_repository.get_all(['id', 'record_enabled', 'root_dir_path']) if sm.is_record_enabled()]
+        __segment_watcher.sync(stream_models)
+        results = list(__executor.map(__move, stream_models))
+        backlog = sum(result[0] for result in results)
+        moved = sum(result[1] for result in results)
+        elapsed = time.monotonic() - started_at
+        throughput = moved / elapsed if elapsed > 0 else 0.
+        logger.info(f'video file indexer has moved {moved} of {backlog} files from {len(stream_models)} sources in {round(elapsed, 2)} seconds '
+                    f'({round(throughput, 2)} files/sec), backlog: {backlog - moved} at {datetime.now()}')
+        __prune_catalog()
+    finally:
+        __check_lock.release()
@@ -1,22 +1,28 @@
+from __future__ import annotations
+
 import os
 import signal
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from threading import Lock, Timer
+from typing import Callable, List
 import psutil
 from redis.client import Redis
 
-from common.data.source_model import SourceModel, SourceState
-from common.data.source_repository import SourceRepository
+from common.data.source_model import SourceModel, SourceState, MediaServerType
+from common.data.source_repository import CachedSourceRepository
 from common.event_bus.event_bus import EventBus
 from common.utilities import logger, config, datetime_now
 from media_server.docker_manager import DockerManager
+from record.clip_exporter import clip_export_pids_key
 from stream.stream_model import StreamModel
-from stream.stream_repository import StreamRepository
+from stream.stream_repository import CachedStreamRepository
 from sustain.failed_stream.notify_failed_stream_model import NotifyFailedStreamModel
-from sustain.failed_stream.failed_stream_model import FailedStreamModel, WatchDogOperations
-from sustain.failed_stream.failed_stream_repository import FailedStreamRepository
+from sustain.failed_stream.failed_stream_model import WatchDogOperations
+from sustain.failed_stream.restart_governor import RestartGovernor
 from sustain.failed_stream.zombie_repository import ZombieRepository
+from sustain.process_table import ProcessTable
 from sustain.rec_stuck.rec_stuck_model import RecStuckModel
 from sustain.rec_stuck.rec_stuck_repository import RecStuckRepository
 from sustain.scheduler import setup_scheduler
@@ -27,9 +33,9 @@ from utils.json_serializer import serialize_json_dic
 class WatchDogTimer:
     def __init__(self, connection_main: Redis):
         self.conn = connection_main
-        self.source_repository = SourceRepository(self.conn)
-        self.stream_repository = StreamRepository(self.conn)
-        self.failed_stream_repository = FailedStreamRepository(self.conn)
+        self.source_repository = CachedSourceRepository(self.conn)
+        self.stream_repository = CachedStreamRepository(self.conn)
+        self.restart_governor = RestartGovernor(self.conn)
         self.zombie_repository = ZombieRepository(self.conn)
         self.restart_stream_event_bus = EventBus('restart_stream_request')
         self.notify_failed_event_bus = EventBus('notify_failed')
@@ -37,12 +43,18 @@ class WatchDogTimer:
         logger.info(f'watchdog interval is: {self.interval}')
         self.failed_process_interval: float = max(config.ffmpeg.watch_dog_failed_wait_interval, 1.)
         logger.info(f'watch_dog failed_process_interval is : {self.failed_process_interval}')
+        self.max_workers: int = max(config.ffmpeg.watch_dog_max_workers, 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='watchdog')
+        self.schedule_lock = Lock()
+        self.next_schedule_at: float = 0.
         self.zombie_counter = 1
         self.zombie_multiplier: int = 6
         self.last_check_running_processes_date = datetime.now()
         self.last_kill_zombie_processes_date = datetime.now()
         self.work_in_progress: bool = False
         self.check_source_state_conflict: bool = True
+        self.process_table: ProcessTable | None = None
+        self.docker_manager = DockerManager(self.conn)
 
     def __remove_stream(self, source_id: str):  # if source was deleted, remove it from stream list
         self.stream_repository.remove(source_id)
@@ -56,8 +68,7 @@ class WatchDogTimer:
             if source_model is None:
                 self.__remove_stream(source_id)
                 continue
-            self.__publish_restart(source_model)
-            time.sleep(1.)
+            self.__publish_restart(source_model)  # the start handler limits the concurrent starts, see start_stream_max_concurrency
 
     def start(self):
         self.__start_prev_streams()
@@ -70,6 +81,8 @@ class WatchDogTimer:
         self.work_in_progress = True
         try:
             logger.info(f'watchdog timer is starting at {datetime.now()}')
+            self.process_table = ProcessTable.take()
+            self.docker_manager.refresh_containers()
 
             broken_streams = self._check_running_processes()
             if self.zombie_counter % self.zombie_multiplier == 0:
@@ -84,6 +97,29 @@ class WatchDogTimer:
         finally:
             self.work_in_progress = False
 
+    # recoveries are staggered by failed_process_interval on timers instead of sleeping on the checking thread,
+    # so the duration of a tick does not depend on the number of the broken streams.
+    def __schedule(self, fn: Callable, args: list):
+        with self.schedule_lock:
+            now = time.monotonic()
+            self.next_schedule_at = max(self.next_schedule_at + self.failed_process_interval, now)
+            delay = self.next_schedule_at - now
+        timer = Timer(delay, fn, args)
+        timer.daemon = True
+        timer.start()
+
+    def __schedule_recovery(self, source_model: SourceModel, op: WatchDogOperations | None = None, stream_model: StreamModel | None = None):
+        def fn():
+            try:
+                self.__publish_restart(source_model)
+                if op is not None:
+                    time.sleep(self.failed_process_interval)
+                    self.__publish_failed_notification(op, stream_model)
+            except BaseException as ex:
+                logger.error(f'an error occurred while recovering a stream ({source_model.id}), err: {ex} at {datetime.now()}')
+
+        self.__schedule(fn, [])
+
     def __publish_restart(self, source_model: SourceModel):
         dic = source_model.__dict__
         self.restart_stream_event_bus.publish_async(serialize_json_dic(dic))
@@ -94,15 +130,6 @@ class WatchDogTimer:
         self.notify_failed_event_bus.publish_async(serialize_json_dic(dic))
         logger.warning(f'a failed source ({model.name}) has been notified at {model.created_at}')
 
-    def __log_failed_stream(self, op: WatchDogOperations, source_model: SourceModel):
-        if source_model is None:
-            return
-        failed_stream_model: FailedStreamModel = self.failed_stream_repository.get(source_model.id)
-        if failed_stream_model is None:
-            failed_stream_model = FailedStreamModel().map_from_source(source_model)
-        failed_stream_model.set_failed_count(op)
-        self.failed_stream_repository.add(failed_stream_model)
-
     def __recover(self, op: WatchDogOperations, stream_model: StreamModel):
         source_id = stream_model.id
         source_model = self.source_repository.get(source_id)  # if it wasn't deleted before.
@@ -110,10 +137,8 @@ class WatchDogTimer:
             self.__remove_stream(source_id)
             return
 
-        self.__log_failed_stream(op, source_model)
-        self.__publish_restart(source_model)
-        time.sleep(self.failed_process_interval)
-        self.__publish_failed_notification(op, stream_model)
+        if self.restart_governor.try_acquire(source_model, op):
+            self.__schedule_recovery(source_model, op, stream_model)
 
     @staticmethod
     def __remove_zombie_rec_stuck_models(stream_models: List[StreamModel], rec_stuck_repository: RecStuckRepository):
@@ -136,49 +161,46 @@ class WatchDogTimer:
         stream_models = self.stream_repository.get_all()
         rec_stuck_repository = RecStuckRepository(self.conn)
         self.__remove_zombie_rec_stuck_models(stream_models, rec_stuck_repository)
-        for stream_model in stream_models:
-            if self.__check_ms_container(stream_model):
+        checks = self.executor.map(lambda sm: self.__check_stream(sm, rec_stuck_repository), stream_models)
+        for stream_model, broken in zip(stream_models, checks):
+            if broken:
                 broken_streams.append(stream_model)
-                logger.warning(f'a broken stream has been found for Media Server Container, waiting for {self.failed_process_interval} seconds')
-                time.sleep(self.failed_process_interval)
-                continue
+
+        if self.check_source_state_conflict and len(broken_streams) == 0:  # if everything goes well
+            self.__check_source_state_conflict_fn(stream_models)
+        self.restart_governor.reset_recovered(stream_models, broken_streams)
+        return broken_streams
+
+    # runs on the pool, the first failed check recovers the stream and the rest are skipped
+    def __check_stream(self, stream_model: StreamModel, rec_stuck_repository: RecStuckRepository) -> bool:
+        try:
+            if self.__check_ms_container(stream_model):
+                logger.warning(f'a broken stream has been found for Media Server Container ({stream_model.id})')
+                return True
             if self.__check_ms_feeder_process(stream_model):
-                broken_streams.append(stream_model)
-                logger.warning(f'a broken stream has been found for Media Server Feeder, waiting for {self.failed_process_interval} seconds')
-                time.sleep(self.failed_process_interval)
-                continue
+                logger.warning(f'a broken stream has been found for Media Server Feeder ({stream_model.id})')
+                return True
             if self.__check_hls_process(stream_model):
-                broken_streams.append(stream_model)
-                logger.warning(f'a broken stream has been found for HLS Process, waiting for {self.failed_process_interval} seconds')
-                time.sleep(self.failed_process_interval)
-                continue
+                logger.warning(f'a broken stream has been found for HLS Process ({stream_model.id})')
+                return True
             if self.__check_mp_ffmpeg_reader_process(stream_model):
-                broken_streams.append(stream_model)
-                logger.warning(f'a broken stream has been found for FFmpeg Reader Process, waiting for {self.failed_process_interval} seconds')
-                time.sleep(self.failed_process_interval)
-                continue
+                logger.warning(f'a broken stream has been found for FFmpeg Reader Process ({stream_model.id})')
+                return True
             if self.__check_record_process(stream_model):
-                broken_streams.append(stream_model)
-                logger.warning(f'a broken stream has been found for Recording Process, waiting for {self.failed_process_interval} seconds')
-                time.sleep(self.failed_process_interval)
-                continue
+                logger.warning(f'a broken stream has been found for Recording Process ({stream_model.id})')
+                return True
             if self.__check_snapshot_process(stream_model):
-                broken_streams.append(stream_model)
-                logger.warning(f'a broken stream has been found for Snapshot Process, waiting for {self.failed_process_interval} seconds')
-                time.sleep(self.failed_process_interval)
-                continue
-            if self.__check_record_stuck_process(stream_model, rec_stuck_repository):
-                broken_streams.append(stream_model)
-
-        if self.check_source_state_conflict and len(broken_streams) == 0:  # if everything goes well
-            self.__check_source_state_conflict_fn(stream_models)
-        return broken_streams
+                logger.warning(f'a broken stream has been found for Snapshot Process ({stream_model.id})')
+                return True
+            return self.__check_record_stuck_process(stream_model, rec_stuck_repository)
+        except BaseException as ex:
+            logger.error(f'an error occurred while checking stream ({stream_model.id}), err: {ex} at {datetime.now()}')
+            return False
 
     def __check_ms_container(self, stream_model: StreamModel) -> bool:
         op = WatchDogOperations.check_ms_container
         logger.info(f'{op.value} is being executed for {stream_model.id} at {datetime.now()}')
-        docker_manager = DockerManager(self.conn)
-        container = docker_manager.get_container(stream_model)
+        container = self.docker_manager.get_container(stream_model)
         if container is None or container.status != 'running':
             logger.warning(
                 f'a failed MS container was detected for model {stream_model.name} (container name:{stream_model.ms_container_name}) and will be recovered')
@@ -188,13 +210,12 @@ class WatchDogTimer:
 
     def __check_process(self, op: WatchDogOperations, stream_model: StreamModel, pid: int, check_memory_size: bool) -> bool:
         logger.info(f'{op.value} is being executed for {stream_model.id} at {datetime.now()}')
-        if not psutil.pid_exists(pid):
+        if not self.process_table.pid_exists(pid):
             logger.warning(f'a failed FFmpeg process was detected ({op}) for source {stream_model.name} (pid:{pid}) and will be recovered')
             self.__recover(op, stream_model)
             return True
         if check_memory_size:
-            prc = psutil.Process(pid)
-            rss = prc.memory_info().rss
+            rss = self.process_table.get_rss(pid)
             if rss == 0:
                 logger.error(f'a N/A memory sized FFmpeg process was detected ({op}) for source {stream_model.name} (pid:{pid}) and will be recovered')
                 self.__recover(op, stream_model)
@@ -274,17 +295,19 @@ class WatchDogTimer:
         return False
 
     def __check_source_state_conflict_fn(self, stream_models: List[StreamModel]):
-        source_models = self.source_repository.get_all()
+        source_models = self.source_repository.get_all(['id', 'state'])
         if len(source_models) > len(stream_models):
             stream_dic = dict()
             for stream_model in stream_models:
                 stream_dic[stream_model.id] = stream_model
             for source_model in source_models:
                 if source_model.id not in stream_dic and source_model.state == SourceState.Started:
+                    source_model = self.source_repository.get(source_model.id)
+                    if source_model is None:
+                        continue
                     logger.warning(f'an conflicted source({source_model.id} - {source_model.name}) found and wil be recovered soon')
-                    self.__log_failed_stream(WatchDogOperations.check_source_state_conflict, source_model)
-                    self.__publish_restart(source_model)
-                    time.sleep(self.failed_process_interval)
+                    if self.restart_governor.try_acquire(source_model, WatchDogOperations.check_source_state_conflict):
+                        self.__schedule_recovery(source_model)
 
     def _kill_zombie_processes(self, broken_streams: List[StreamModel]):
         now = datetime.now()
@@ -296,6 +319,34 @@ class WatchDogTimer:
         stream_models.extend(broken_streams)
         self.__check_zombie_ffmpeg_processes(stream_models)
         self.__check_unstopped_media_server_containers(stream_models)
+        self.__reclaim_leaked_ports()
+        self.__rebalance_shared_media_servers()
+
+    # the ports of the containers which have been removed without a stop request, i.e. a crashed start
+    def __reclaim_leaked_ports(self):
+        if self.docker_manager.containers_by_name is None:
+            return
+        logger.info(f'reclaim_leaked_ports is being executed at {datetime.now()}')
+        try:
+            self.docker_manager.port_allocator.reclaim(set(self.docker_manager.containers_by_name))
+        except BaseException as ex:
+            logger.error(f'an error occurred while reclaiming the leaked media server ports, err: {ex} at {datetime.now()}')
+
+    # a restarted stream is assigned to the least loaded shared instance, so the moves are done by restart requests
+    def __rebalance_shared_media_servers(self):
+        if not config.ffmpeg.ms_shared_enabled:
+            return
+        logger.info(f'rebalance_shared_media_servers is being executed at {datetime.now()}')
+        for ms_type in MediaServerType:
+            try:
+                for source_id in self.docker_manager.shared.rebalance(ms_type, config.ffmpeg.ms_shared_rebalance_max_moves):
+                    source_model = self.source_repository.get(source_id)
+                    if source_model is None:
+                        continue
+                    logger.warning(f'source ({source_id}) will be moved to a less loaded shared media server instance')
+                    self.__schedule(self.__publish_restart, [source_model])
+            except BaseException as ex:
+                logger.error(f'an error occurred while rebalancing the shared media servers ({ms_type.name}), err: {ex} at {datetime.now()}')
 
     def __check_zombie_ffmpeg_processes(self, stream_models: List[StreamModel]):
         logger.info(f'check_zombie_ffmpeg_processes is being executed at {datetime.now()}')
@@ -312,12 +363,13 @@ class WatchDogTimer:
             add_pid(stream_model.record_pid)
             add_pid(stream_model.snapshot_pid)
             add_pid(stream_model.concat_demuxer_pid)
-        all_process_list = psutil.process_iter()
+        for pid in self.conn.smembers(clip_export_pids_key):  # the clip exports are not bound to the streams
+            add_pid(int(pid))
         zombie_ppids = set()
-        for proc in all_process_list:
-            if proc.name() == "ffmpeg" and proc.pid not in models_pid_dic:
+        for proc in self.process_table.get_by_name('ffmpeg'):
+            if proc.pid not in models_pid_dic:
                 try:
-                    args = proc.cmdline()
+                    args = proc.get_cmdline()
                     if len(args) == 8 and args[4] == 'image2' and args[5] == '-vframes':
                         continue  # which means it is RtspVideoEditor FFmpeg subprocess
                     self.zombie_repository.add('ffmpeg', str(proc.pid))
@@ -352,14 +404,14 @@ class WatchDogTimer:
                 count += 1
         if count == 0:
             return
-        docker_manager = DockerManager(self.conn)
-        containers = docker_manager.get_all_containers()
+        containers = self.docker_manager.get_all_containers()
         prefixes = tuple(['srs_', 'srsrt_', 'livego_', 'nms_'])
         for container in containers:
             if container.name.startswith(prefixes) and container.name not in valid_containers_name_dic:
                 try:
                     self.zombie_repository.add('docker', container.name)
-                    docker_manager.stop_container(container)
+                    self.docker_manager.stop_container(container)
+                    self.docker_manager.port_allocator.release(container.name)
                     logger.warning(f'an unstopped media server container has been detected and stopped, container name: {container.name}')
                 except BaseException as e:
                     logger.error(f'an error occurred during stopping a zombie media server container, ex: {e} at {datetime.now()}')
@@ -17,7 +17,8 @@ from subprocess import Popen, PIPE
 from common.config import Config
 from common.data.rtsp_template_model import RtspTemplateModel
 from common.data.rtsp_template_repository import RtspTemplateRepository
-from common.data.source_model import RecordFileTypes
+from common.data.redis_mapper import RedisMapper
+from common.data.source_model import RecordFileTypes, SourceModel
 from common.data.source_repository import SourceRepository
 from common.event_bus.event_bus import EventBus
 from common.utilities import crate_redis_connection, RedisDb, logger
@@ -81,6 +82,27 @@ def redis_bench():
 # redis_bench()
 
 
+def redis_mapper_bench():  # no Redis round trip, measures only the generated encode/decode functions of RedisMapper
+    source = SourceModel('3xzdeqtd3p6', 'brand', 'name', 'rtsp://127.0.0.1')
+    dic = RedisMapper(source).to_redis()
+    binary_dic = {k.encode('utf-8'): str(v).encode('utf-8') for k, v in dic.items()}
+    length = 100000
+    start = datetime.now()
+    for j in range(length):
+        _ = RedisMapper(SourceModel()).from_redis(binary_dic)
+    end = datetime.now()
+    print(f'from_redis result in sec: {(end - start).total_seconds()}')
+
+    start = datetime.now()
+    for j in range(length):
+        _ = RedisMapper(source).to_redis()
+    end = datetime.now()
+    print(f'to_redis result in sec: {(end - start).total_seconds()}')
+
+
+# redis_mapper_bench()
+
+
 def set_test():
     arr = [j for j in range(1000)]
 
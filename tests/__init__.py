@@ -0,0 +1,14 @@
+import sys
+from contextlib import contextmanager
+from unittest import mock
+
+
+# the modules of the service read their config on import, so they are imported in this context by the tests
+@contextmanager
+def default_config():
+    with mock.patch.object(sys, 'argv', sys.argv[:1]):  # the arguments of the test runner are not the ones of the service
+        from common.config import Config
+
+        # the config is created with its defaults instead of being read from Redis
+        with mock.patch.object(Config, 'create', staticmethod(Config)):
+            yield
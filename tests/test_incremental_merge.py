@@ -0,0 +1,152 @@
+import os
+import struct
+import tempfile
+import unittest
+from os import path
+from typing import Dict, List, Tuple
+
+from tests import default_config
+
+with default_config():
+    from record.fmp4 import iter_boxes
+    from record.incremental_merger import IncrementalMerger
+
+_video_track_id, _video_timescale, _video_sample_duration = 1, 90000, 3000
+_audio_track_id, _audio_timescale, _audio_sample_duration = 2, 48000, 1024
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def _trak(track_id: int, timescale: int) -> bytes:
+    tkhd = _full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, track_id, 0, 0) + bytes(60))
+    mdhd = _full_box(b'mdhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, 0))
+    stsd = _full_box(b'stsd', 0, 0, struct.pack('>I', 0))
+    return _box(b'trak', tkhd + _box(b'mdia', mdhd + _box(b'minf', _box(b'stbl', stsd))))
+
+
+# an empty_moov init segment like FFmpeg writes, the audio samples have only the default duration of trex
+def _init_segment() -> bytes:
+    trex = _full_box(b'trex', 0, 0, struct.pack('>IIIII', _audio_track_id, 1, _audio_sample_duration, 0, 0))
+    moov = _box(b'moov', _trak(_video_track_id, _video_timescale) + _trak(_audio_track_id, _audio_timescale) + _box(b'mvex', trex))
+    return _box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso6') + moov
+
+
+# a fragment of a second. The video has a 64-bit tfdt and either the sample durations in trun or a default one in tfhd,
+# the audio has a 32-bit tfdt and takes its durations from trex.
+def _fragment(sequence_number: int, video_decode_time: int, audio_decode_time: int, tfhd_default: bool) -> bytes:
+    video_count, audio_count = _video_timescale // _video_sample_duration, _audio_timescale // _audio_sample_duration
+    if tfhd_default:
+        video_tfhd = _full_box(b'tfhd', 0, 0x20008, struct.pack('>II', _video_track_id, _video_sample_duration))
+        video_trun = _full_box(b'trun', 0, 0x201, struct.pack('>Ii', video_count, 0) + struct.pack('>I', 100) * video_count)
+    else:
+        video_tfhd = _full_box(b'tfhd', 0, 0x20000, struct.pack('>I', _video_track_id))
+        video_trun = _full_box(b'trun', 0, 0x301, struct.pack('>Ii', video_count, 0) +
+                               struct.pack('>II', _video_sample_duration, 100) * video_count)
+    video_traf = _box(b'traf', video_tfhd + _full_box(b'tfdt', 1, 0, struct.pack('>Q', video_decode_time)) + video_trun)
+    audio_traf = _box(b'traf', _full_box(b'tfhd', 0, 0x20000, struct.pack('>I', _audio_track_id)) +
+                      _full_box(b'tfdt', 0, 0, struct.pack('>I', audio_decode_time)) +
+                      _full_box(b'trun', 0, 0x201, struct.pack('>Ii', audio_count, 0) + struct.pack('>I', 10) * audio_count))
+    moof = _box(b'moof', _full_box(b'mfhd', 0, 0, struct.pack('>I', sequence_number)) + video_traf + audio_traf)
+    return moof + _box(b'mdat', bytes(video_count * 100 + audio_count * 10))
+
+
+def _fragment_duration(track_id: int) -> int:
+    if track_id == _video_track_id:
+        return _video_timescale // _video_sample_duration * _video_sample_duration
+    return _audio_timescale // _audio_sample_duration * _audio_sample_duration
+
+
+# writes the concatenation of each batch like FFmpeg does with empty_moov, the decode times start from 0 whatever the offset is
+class FragmentedConcatDemuxer:
+    def __init__(self, fragment_counts: List[int]):
+        self.fragment_counts = fragment_counts
+        self.output_args: List[List[str]] = []
+
+    def concatenate(self, source_id: str, filenames: List[str], output_filename: str, output_args: List[str] | None = None):
+        self.output_args.append(output_args)
+        fragment_count = self.fragment_counts[len(self.output_args) - 1]
+        video_duration, audio_duration = _fragment_duration(_video_track_id), _fragment_duration(_audio_track_id)
+        with open(output_filename, 'wb') as f:
+            f.write(_init_segment())
+            for index in range(fragment_count):
+                f.write(_fragment(index + 1, index * video_duration, index * audio_duration, index % 2 == 1))
+        return object()
+
+
+# returns (sequence number, [(track_ID, tfdt version, decode time)]) of the fragments
+def _read_fragments(filename: str) -> List[Tuple[int, List[Tuple[int, int, int]]]]:
+    fragments = []
+    with open(filename, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        for box_type, _, moof_start, moof_end in list(iter_boxes(f, 0, end)):
+            if box_type != b'moof':
+                continue
+            sequence_number, decode_times = 0, []
+            for child_type, _, child_start, child_end in list(iter_boxes(f, moof_start, moof_end)):
+                f.seek(child_start)
+                if child_type == b'mfhd':
+                    sequence_number = struct.unpack('>II', f.read(8))[1]
+                elif child_type == b'traf':
+                    track_id, version, decode_time = 0, 0, 0
+                    for traf_type, _, traf_child_start, _ in list(iter_boxes(f, child_start, child_end)):
+                        f.seek(traf_child_start)
+                        if traf_type == b'tfhd':
+                            track_id = struct.unpack('>II', f.read(8))[1]
+                        elif traf_type == b'tfdt':
+                            version = f.read(4)[0]
+                            decode_time = struct.unpack('>Q' if version == 1 else '>I', f.read(8 if version == 1 else 4))[0]
+                    decode_times.append((track_id, version, decode_time))
+            fragments.append((sequence_number, decode_times))
+    return fragments
+
+
+class IncrementalMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_file = path.join(self.tmp_dir.name, '2023_04_18_19.mp4')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def __create_segments(self, minutes: List[int]) -> List[str]:
+        filenames = []
+        for minute in minutes:
+            filename = path.join(self.tmp_dir.name, f'2023_04_18_19_{minute:02d}_00.mp4')
+            with open(filename, 'wb'):
+                pass
+            filenames.append(filename)
+        return filenames
+
+    # the appended fragments continue from the end of each track, so the merged file plays through without jumping back to 0
+    def test_the_decode_times_of_the_appended_batches_are_monotonic(self):
+        fragment_counts = [3, 2, 4]
+        cd = FragmentedConcatDemuxer(fragment_counts)
+        merger = IncrementalMerger(cd, lambda proc: False)
+        for index in range(len(fragment_counts)):
+            segments = self.__create_segments([index * 2, index * 2 + 1])
+            filenames = ([self.output_file] if path.exists(self.output_file) else []) + segments
+            self.assertEqual((self.output_file, segments), merger.merge('merge_test', filenames, self.output_file))
+            self.assertFalse(any(path.exists(filename) for filename in segments))
+        for output_args in cd.output_args:
+            self.assertNotIn('-output_ts_offset', output_args)
+
+        fragments = _read_fragments(self.output_file)
+        self.assertEqual(list(range(1, sum(fragment_counts) + 1)), [sequence_number for sequence_number, _ in fragments])
+        ends: Dict[int, int] = {}
+        for _, decode_times in fragments:
+            for track_id, version, decode_time in decode_times:
+                self.assertEqual(1 if track_id == _video_track_id else 0, version)  # the versions are kept
+                self.assertEqual(ends.get(track_id, 0), decode_time)  # no gap, no overlap
+                ends[track_id] = decode_time + _fragment_duration(track_id)
+        self.assertEqual({_video_track_id: _fragment_duration(_video_track_id) * sum(fragment_counts),
+                          _audio_track_id: _fragment_duration(_audio_track_id) * sum(fragment_counts)}, ends)
+
+
+if __name__ == '__main__':
+    unittest.main()
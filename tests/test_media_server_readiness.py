@@ -0,0 +1,140 @@
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from tests import default_config
+
+with default_config():
+    from media_server.media_server_models import SrsMediaServerModel, NodeMediaServerModel, Go2RtcMediaServerModel
+
+
+# accepts the connections but never answers like docker-proxy does before the media server listens
+class ProxyOnlyServer:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+
+    def close(self):
+        self.sock.close()
+
+
+# a stand-in for the HTTP API of a media server. While it is down, the connections are accepted and closed without a response,
+# so the port stays open like a port which is mapped by docker-proxy.
+class StandInServer:
+    def __init__(self, ok_paths: set, reboot_paths: set = frozenset(), down_interval: float = 0.):
+        self.ok_paths = ok_paths
+        self.reboot_paths = reboot_paths
+        self.down_interval = down_interval
+        self.down_until = 0.
+        self.posted_paths = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def __is_down(self) -> bool:
+                if time.monotonic() < stand_in.down_until:
+                    self.close_connection = True
+                    return True
+                return False
+
+            def __respond(self, status: int):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                if not self.__is_down():
+                    self.__respond(200 if self.path.split('?')[0] in stand_in.ok_paths else 404)
+
+            def do_POST(self):
+                if self.__is_down():
+                    return
+                stand_in.posted_paths.append(self.path)
+                self.__respond(200)
+                if self.path in stand_in.reboot_paths:
+                    stand_in.down_until = time.monotonic() + stand_in.down_interval
+
+            def do_PUT(self):
+                self.do_POST()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _create_model(model_type):
+    model = model_type('readiness_test', mock.MagicMock())
+    model.ready_poll_interval = .05
+    model.ready_timeout = 2.
+    return model
+
+
+class MediaServerReadinessTest(unittest.TestCase):
+    def test_srs_is_not_ready_while_only_the_port_is_open(self):
+        proxy = ProxyOnlyServer()
+        try:
+            model = _create_model(SrsMediaServerModel)
+            model.set_ports({'1935': str(proxy.port), '1985': str(proxy.port), '8080': str(proxy.port)})
+            self.assertFalse(model.is_ready())
+        finally:
+            proxy.close()
+
+    def test_srs_is_ready_when_its_api_answers(self):
+        server = StandInServer({'/api/v1/versions'})
+        try:
+            model = _create_model(SrsMediaServerModel)
+            model.set_ports({'1935': '1', '1985': str(server.port), '8080': '1'})
+            self.assertTrue(model.wait_until_ready())
+        finally:
+            server.close()
+
+    def test_nms_is_not_ready_while_only_the_port_is_open(self):
+        proxy = ProxyOnlyServer()
+        try:
+            model = _create_model(NodeMediaServerModel)
+            model.set_ports({'1935': str(proxy.port), '8000': str(proxy.port), '8443': str(proxy.port)})
+            self.assertFalse(model.is_ready())
+        finally:
+            proxy.close()
+
+    def test_nms_is_ready_when_its_http_server_answers(self):
+        server = StandInServer(set())  # any response, even a 404, means it is listening
+        try:
+            model = _create_model(NodeMediaServerModel)
+            model.set_ports({'1935': '1', '8000': str(server.port), '8443': '1'})
+            self.assertTrue(model.is_ready())
+        finally:
+            server.close()
+
+    # the port stays open while go2rtc restarts, so the initialization has to wait for its API to go down and come back
+    def test_go2rtc_waits_for_the_api_to_come_back_after_restart_and_exit(self):
+        down_interval = .4
+        server = StandInServer({'/api'}, {'/api/restart', '/api/exit'}, down_interval)
+        try:
+            model = _create_model(Go2RtcMediaServerModel)
+            model.ready_poll_interval = .2  # the down waits time out in 2 seconds
+            model.set_ports({'1984': str(server.port), '8554': '1', '8555': '1'})
+            started_at = time.monotonic()
+            model.on_media_server_initialized()
+            elapsed = time.monotonic() - started_at
+            self.assertEqual(['/api/config', '/api/restart', '/api/exit'], server.posted_paths)
+            self.assertGreaterEqual(elapsed, down_interval * 2)
+            self.assertLess(elapsed, model.ready_poll_interval * 10)  # none of the down waits has timed out
+            self.assertTrue(model.is_ready())
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
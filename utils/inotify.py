@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import List, Tuple
+
+# a minimal inotify binding over libc, only the calls which are needed to watch the record directories
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_event_header = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None  # i.e. not Linux
+
+
+_libc = _load_libc()
+
+
+def is_inotify_available() -> bool:
+    return _libc is not None
+
+
+class Inotify:
+    def __init__(self):
+        if _libc is None:
+            raise OSError('inotify is not available on this platform')
+        self.fd: int = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, dir_path: str, mask: int) -> int:
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(dir_path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), dir_path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        _libc.inotify_rm_watch(self.fd, wd)  # fails if the directory has already been removed, which is fine
+
+    # returns (wd, mask, name) list, an empty list if no event has arrived in timeout seconds
+    def read_events(self, timeout: float) -> List[Tuple[int, int, str]]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events: List[Tuple[int, int, str]] = []
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            wd, mask, _, name_len = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,42 @@
+import socket
+import time
+from typing import Callable
+import requests
+
+
+def is_port_open(host: str, port: int, timeout: float = 1.) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def is_http_ok(url: str, timeout: float = 1.) -> bool:
+    try:
+        return requests.get(url, timeout=timeout).status_code == 200
+    except requests.RequestException:
+        return False
+
+
+# any HTTP response means the server itself is listening, a port which is mapped by docker-proxy accepts connections before that
+def is_http_up(url: str, timeout: float = 1.) -> bool:
+    try:
+        return requests.get(url, timeout=timeout).status_code < 500
+    except requests.RequestException:
+        return False
+
+
+# polls the check until it returns True, returns False if it does not in timeout seconds
+def wait_until(check: Callable[[], bool], timeout: float, interval: float = .2) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        if check():
+            return True
+        if time.monotonic() + interval > deadline:
+            return False
+        time.sleep(interval)
+
+
+def wait_for_http(url: str, timeout: float, interval: float = .2) -> bool:
+    return wait_until(lambda: is_http_ok(url, min(max(timeout, .1), 1.)), timeout, interval)